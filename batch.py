@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+batch - run a list of commands in a rash session with one round trip.
+
+The commands are written into one script, uploaded with a single SFTP
+write and sourced by one line sent to the persistent shell, so they run in
+order and share cwd/environment exactly as if typed one by one. Every
+command still gets its history/stdout/stderr/status files and its own
+cmd_number. Results come back framed on the shell channel (the same
+base64 frames as rash's framed mode) and are parsed into one
+rash.CommandResult per command, which feed the usual ShellTest checks.
+
+Usage:
+    python batch.py HOST USERNAME --file commands.sh [--stop-on-failure]
+    python batch.py HOST USERNAME --tests
+"""
+import argparse
+import re
+import sys
+import time
+import rash
+from metrics import new_metrics
+
+
+def formulate_batch(commands: list[str], session_dir: str, cmd_number: int,
+                    stop_on_failure: bool = False) -> dict:
+    """
+    formulate_batch - build a script that runs commands in order as
+    cmd_number, cmd_number+1, ... and the exec line that sources it.
+
+    Each command writes its usual files and prints framed results with its
+    shell state snapshot (see rash.formulate_command) plus a __RASH_T_N__
+    line with its start and end times.
+    """
+    script_file = f"{session_dir}/batch-cmd{cmd_number}"
+    cmd_numbers = list(range(cmd_number, cmd_number + len(commands)))
+    lines = []
+    for number, command in zip(cmd_numbers, commands):
+        framed = rash.formulate_command(command, session_dir, number, framed=True)
+        lines += [framed['history'].decode(),
+                  "__rash_t=${EPOCHREALTIME:-$(date +%s.%N)}\n",
+                  framed['exec'].decode(),
+                  f"printf '__RASH_T_%s__ %s %s\\n' {number} \"$__rash_t\" "
+                  "\"${EPOCHREALTIME:-$(date +%s.%N)}\"\n"]
+        if stop_on_failure:
+            # returns from the sourced script only; the exec line carries on
+            lines.append("[ \"$__rash_rc\" -eq 0 ] || return 0\n")
+    exec_cmd = ''.join([f"source {script_file}; rm -f {script_file}; ",
+                        # printf keeps the literal sentinel out of the pty echo
+                        f"printf '__BATCH_DONE_%s__\\n' {cmd_number}\n"])
+    return {'script': ''.join(lines).encode(),
+            'script_file': script_file,
+            'exec': exec_cmd.encode(),
+            'sentinel': f"__BATCH_DONE_{cmd_number}__",
+            'cmd_numbers': cmd_numbers}
+
+
+def parse_batch_results(buffer: str, batch: dict, commands: list[str],
+                        elapsed: float, threshold: int) -> list[rash.CommandResult]:
+    """
+    Results of every command that ran, in order, from the channel text of a
+    finished batch. Durations are the remote wall time of each command, or
+    the batch average where the shell cannot tell. Outputs past threshold
+    bytes are LargeOutput handles.
+    """
+    results: list[rash.CommandResult] = []
+    for number, command in zip(batch['cmd_numbers'], commands):
+        stdout_text, stderr_text, exit_status = rash.parse_framed_results(buffer, number,
+                                                                          threshold)
+        if exit_status is None:
+            break
+        timing = re.search(rf"__RASH_T_{number}__ ([\d.]+) ([\d.]+)", buffer)
+        results.append({'cmd_number': number,
+                        'command': command,
+                        'stdout': stdout_text,
+                        'stderr': stderr_text,
+                        'exit_status': exit_status,
+                        'duration': float(timing.group(2)) - float(timing.group(1))
+                                    if timing else elapsed / len(commands),
+                        'file_reads': {},
+                        'metrics': new_metrics(),
+                        'state': None})
+        # a batch has no per-command transfer phases, only the remote run time
+        results[-1]['metrics']['phases']['remote'] = results[-1]['duration']
+    return results
+
+
+def execute_batch(cmd_number: int, session_vars: dict, commands: list[str],
+                  stop_on_failure: bool = False,
+                  on_output=rash.print_output) -> list[rash.CommandResult]:
+    """
+    execute_batch - run commands in the session's shell with one script upload
+    and one exec line, numbering them from cmd_number. Output is passed to
+    on_output per command once the whole batch is done. With stop_on_failure
+    the batch ends at the first non-zero exit and only the commands that ran
+    are returned.
+    """
+    batch = formulate_batch(commands, session_vars['session_dir'], cmd_number,
+                            stop_on_failure=stop_on_failure)
+    start_time = time.time()
+    with session_vars['sftp'].open(batch['script_file'], "w") as f:
+        f.write(batch['script'])
+    done, watched = rash.watch_for_sentinel(session_vars['channel'], batch['sentinel'])
+    session_vars['channel'].send(batch['exec'])
+    done.wait()
+    if batch['sentinel'] not in watched['buffer']:
+        print("[WARNING] Channel closed before the batch finished")
+
+    results = parse_batch_results(watched['buffer'], batch, commands, time.time() - start_time,
+                                  rash.large_output_threshold(session_vars))
+    for result in results:
+        for stream in ('stdout', 'stderr'):
+            rash.emit_output(on_output, stream, result[stream])
+            if isinstance(result[stream], str):
+                result[stream] = result[stream].strip()
+        # the shell state snapshot rides on each command's __DONE_N__ line
+        snapshot = re.search(rf"__DONE_{result['cmd_number']}__ ([^\n]*)", watched['buffer'])
+        result['state'] = rash.apply_snapshot(session_vars, result['cmd_number'],
+                                              snapshot.group(1).split() if snapshot else [])
+        rash.record_result(session_vars, result)
+    return results
+
+
+def report_batch(cmd_number: int, tests: list[rash.ShellTest],
+                 results: list[rash.CommandResult]) -> int:
+    """
+    Print each test's header, result summary and PASS/FAIL, as run_command
+    does (SKIPPED if the batch stopped before it). Returns the failure count.
+    """
+    failed = 0
+    for number, test in enumerate(tests, start=cmd_number):
+        print(f"\n--- Test #{number}: {test['desc']} ---")
+        if number - cmd_number >= len(results):
+            print("SKIPPED")
+            failed += 1
+            continue
+        result = results[number - cmd_number]
+        rash.print_result_summary(result)
+        failures = rash.check_shell_test(test, result)
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        if failures:
+            failed += 1
+        else:
+            print("PASS")
+    return failed
+
+
+def run_batch(cmd_number: int, session_vars: dict, tests: list[rash.ShellTest],
+              stop_on_failure: bool = False) -> int:
+    """
+    run_batch - run test commands as one batch and report each one.
+    Returns the next free cmd_number.
+    """
+    results = execute_batch(cmd_number, session_vars, [test['cmd'] for test in tests],
+                            stop_on_failure=stop_on_failure,
+                            on_output=lambda stream, text: None)
+    report_batch(cmd_number, tests, results)
+    return cmd_number + len(tests)
+
+
+def read_batch_file(path: str) -> list[rash.ShellTest]:
+    """Commands from a file (or stdin for -), one per line, skipping blanks and # comments."""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [{'desc': line, 'cmd': line} for line in lines
+            if line.strip() and not line.lstrip().startswith("#")]
+
+
+def main():
+    """
+    Connect, run the command file or SHELL_TESTS as one batch, print results
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("host")
+    parser.add_argument("username")
+    what = parser.add_mutually_exclusive_group(required=True)
+    what.add_argument("--file", help="file with one command per line (- for stdin)")
+    what.add_argument("--tests", action="store_true", help="run rash.SHELL_TESTS")
+    parser.add_argument("--key", default=None, help="private key file")
+    parser.add_argument("--stop-on-failure", action="store_true",
+                        help="end the batch at the first command that exits non-zero")
+    args = parser.parse_args()
+    tests = rash.SHELL_TESTS if args.tests else read_batch_file(args.file)
+
+    channel, ssh = rash.open_connection(args.host, args.username, args.key)
+    session_vars = rash.initialize_session(channel, ssh)
+    try:
+        start_time = time.time()
+        results = execute_batch(1, session_vars, [test['cmd'] for test in tests],
+                                stop_on_failure=args.stop_on_failure,
+                                on_output=lambda stream, text: None)
+        failed = report_batch(1, tests, results)
+        print(f"\n{len(results)}/{len(tests)} commands ran, {failed} failed, "
+              f"{time.time() - start_time:.2f} sec")
+    finally:
+        rash.close_session(session_vars)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+benchmark - latency measurements for rash's command execution path.
+
+Runs BENCH_SCENARIOS (tiny commands, large stdout, stderr-heavy output,
+many sequential commands, concurrent sessions) through open_connection,
+initialize_session and execute_command, and reports p50/p99 latency,
+throughput and, against the local stand-in server, bytes transferred.
+--local starts local_server in-process with a simulated --rtt, so
+results are reproducible on one box without a real host.
+
+--engines also compares the event-driven output streaming in
+rash.stream_command_output against the original fixed 100 ms SFTP
+re-open polling loop, and batched result fetching against both the
+original sleep-and-retry reads and rash's one-file-at-a-time reads.
+
+Usage:
+    python benchmark.py --local [--rtt 0.02] [--scenario tiny ...]
+    python benchmark.py HOST USERNAME [--key ~/.ssh/id_ed25519] [--engines] [--repeat 10]
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Callable, TypedDict
+import rash
+import local_server
+from metrics import percentile
+
+STREAM_BENCH_COMMANDS = ["true", "pwd", "ls -la /", "seq 1 20000", "sleep 0.3"]
+
+
+class Scenario(TypedDict):
+    """
+    A benchmark workload: each of `sessions` sessions runs commands `repeat` times
+    """
+    name: str
+    commands: list[str]
+    repeat: int
+    sessions: int
+
+
+BENCH_SCENARIOS: list[Scenario] = [
+    {'name': "tiny", 'commands': ["true"], 'repeat': 30, 'sessions': 1},
+    {'name': "large-output", 'commands': ["seq 1 1000000"], 'repeat': 3, 'sessions': 1},
+    {'name': "stderr-heavy", 'commands': ["seq 1 200000 >&2"], 'repeat': 5, 'sessions': 1},
+    {'name': "sequential", 'commands': ["pwd", "echo $RANDOM", "ls /", "date", "id"],
+     'repeat': 10, 'sessions': 1},
+    {'name': "concurrent", 'commands': ["pwd", "seq 1 1000"], 'repeat': 10, 'sessions': 4},
+]
+
+
+def poll_command_output(sftp, stdout_file, stderr_file, status_file, poll_interval=0.1):
+    """
+    The original stream loop: re-open both output files and stat the status
+    file every poll_interval until the status file exists. Returns bytes seen.
+    """
+    seen = {stdout_file: 0, stderr_file: 0}
+    while True:
+        for path, offset in seen.items():
+            try:
+                with sftp.open(path, "r") as f:
+                    f.seek(offset)
+                    seen[path] += len(f.read())
+            except FileNotFoundError:
+                pass
+        try:
+            sftp.stat(status_file)
+            break
+        except FileNotFoundError:
+            pass
+        time.sleep(poll_interval)
+    return sum(seen.values())
+
+
+def sleep_read_remote_file(sftp, remote_path, timeout=10.0):
+    """
+    The original result read: sleep 50 ms, then retry opening the file every
+    50 ms until it exists and read it with plain sequential requests.
+    """
+    start = time.time()
+    time.sleep(0.05)
+    while True:
+        try:
+            with sftp.open(remote_path, "r") as f:
+                return f.read().decode()
+        except FileNotFoundError as exc:
+            if time.time() - start > timeout:
+                raise TimeoutError(f"File {remote_path} not found in {timeout:.1f} sec") from exc
+            time.sleep(0.05)
+
+
+def time_streamed_command(session_vars: dict, cmd_number: int, command: str, engine: str) -> float:
+    """
+    Run one command and return seconds from sending the exec line until the
+    chosen engine ('poll' or 'event') reports completion.
+    """
+    channel = session_vars['channel']
+    sftp = session_vars['sftp']
+    commands = rash.formulate_command(command, session_vars['session_dir'], cmd_number)
+    channel.send(commands['history'])
+    time.sleep(.05)
+
+    # watch before sending: the channel reader only hands text to watchers already registered
+    done, watched = rash.watch_for_sentinel(channel, commands['sentinel'])
+    start_time = time.perf_counter()
+    channel.send(commands['exec'])
+    if engine == "poll":
+        poll_command_output(sftp, commands['stdout_file'], commands['stderr_file'],
+                            commands['status_file'])
+        elapsed = time.perf_counter() - start_time
+        # consume the sentinel so it does not leak into the next command
+        done.wait(10.0)
+    else:
+        rash.stream_command_output(sftp, commands['stdout_file'], commands['stderr_file'],
+                                   watched, on_output=lambda stream, text: None)
+        elapsed = time.perf_counter() - start_time
+    return elapsed
+
+
+def bench_stream_latency(session_vars: dict, cmd_number: int,
+                         commands: list[str], repeat: int = 10) -> int:
+    """
+    bench_stream_latency - alternate both engines over each command and print
+    median/mean completion latency. Returns the next free cmd_number.
+    """
+    print(f"{'command':<16}{'engine':<8}{'p50 ms':>10}{'mean ms':>10}")
+    for command in commands:
+        samples: dict[str, list[float]] = {"poll": [], "event": []}
+        for _ in range(repeat):
+            for engine, times in samples.items():
+                times.append(time_streamed_command(session_vars, cmd_number, command, engine))
+                cmd_number += 1
+        for engine, times in samples.items():
+            print(f"{command:<16}{engine:<8}"
+                  f"{statistics.median(times) * 1000:>10.1f}"
+                  f"{statistics.mean(times) * 1000:>10.1f}")
+    return cmd_number
+
+
+def bench_result_fetch(session_vars: dict, repeat: int = 10):
+    """
+    bench_result_fetch - time reading a stdout/stderr/status triple one file
+    after another with the original sleep-and-retry loop, one file after
+    another with read_remote_file, and in one batched read_remote_files.
+    """
+    sftp = session_vars['sftp']
+    paths = [f"{session_vars['session_dir']}/bench-{name}"
+             for name in ("stdout", "stderr", "status")]
+    for path, size in zip(paths, (20000, 200, 2)):
+        with sftp.open(path, "w") as f:
+            f.write(b"x" * size)
+
+    samples: dict[str, list[float]] = {"original": [], "sequential": [], "batched": []}
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for path in paths:
+            sleep_read_remote_file(sftp, path)
+        samples["original"].append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        for path in paths:
+            rash.read_remote_file(sftp, path)
+        samples["sequential"].append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        rash.read_remote_files(rash.fetch_pool(session_vars), paths)
+        samples["batched"].append(time.perf_counter() - start_time)
+
+    print(f"{'fetch':<16}{'p50 ms':>10}{'mean ms':>10}")
+    for name, times in samples.items():
+        print(f"{name:<16}"
+              f"{statistics.median(times) * 1000:>10.1f}"
+              f"{statistics.mean(times) * 1000:>10.1f}")
+
+
+def run_session_commands(session_vars: dict, scenario: Scenario, stats: dict[str, Any]):
+    """Run one session's share of a scenario, adding latencies and output bytes to stats."""
+    cmd_number = 1
+    for _ in range(scenario['repeat']):
+        for command in scenario['commands']:
+            start_time = time.perf_counter()
+            result = rash.execute_command(cmd_number, session_vars, command,
+                                          on_output=lambda stream, text: None)
+            elapsed = time.perf_counter() - start_time
+            cmd_number += 1
+            with stats['lock']:
+                stats['latencies'].append(elapsed)
+                stats['output_bytes'] += len(result['stdout']) + len(result['stderr'])
+
+
+def run_scenario(connect: Callable[[], dict], scenario: Scenario,
+                 server: dict|None = None) -> dict[str, Any]:
+    """
+    run_scenario - open the scenario's sessions, run its commands in every
+    session at once and return latencies, wall time, output bytes and (with
+    a local server) bytes relayed in each direction. Connecting is not timed.
+    """
+    sessions = [connect() for _ in range(scenario['sessions'])]
+    stats: dict[str, Any] = {'latencies': [], 'output_bytes': 0, 'lock': threading.Lock()}
+    before = local_server.bytes_transferred(server) if server else (0, 0)
+    start_time = time.perf_counter()
+    try:
+        threads = [threading.Thread(target=run_session_commands,
+                                    args=(session_vars, scenario, stats))
+                   for session_vars in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats['wall'] = time.perf_counter() - start_time
+        after = local_server.bytes_transferred(server) if server else (0, 0)
+        stats['bytes_up'], stats['bytes_down'] = (now - then for now, then in zip(after, before))
+    finally:
+        for session_vars in sessions:
+            rash.close_session(session_vars)
+    return stats
+
+
+def print_scenario_table(reports: dict[str, dict[str, Any]]):
+    """One row per scenario: latency percentiles, throughput and traffic per command."""
+    print(f"{'scenario':<14}{'cmds':>6}{'p50 ms':>10}{'p99 ms':>10}{'cmd/s':>9}"
+          f"{'MB/s':>9}{'KiB up/cmd':>12}{'KiB dn/cmd':>12}")
+    for name, stats in reports.items():
+        count = len(stats['latencies'])
+        print(f"{name:<14}{count:>6}"
+              f"{percentile(stats['latencies'], 50) * 1000:>10.1f}"
+              f"{percentile(stats['latencies'], 99) * 1000:>10.1f}"
+              f"{count / stats['wall']:>9.1f}"
+              f"{stats['output_bytes'] / stats['wall'] / 1e6:>9.2f}"
+              f"{stats['bytes_up'] / count / 1024:>12.1f}"
+              f"{stats['bytes_down'] / count / 1024:>12.1f}")
+
+
+def main():
+    """
+    Connect to the given host (or a local stand-in server) and run the benchmarks
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("host", nargs="?")
+    parser.add_argument("username", nargs="?")
+    parser.add_argument("--key", default=None, help="private key file")
+    parser.add_argument("--local", action="store_true",
+                        help="benchmark against an in-process local SSH/SFTP server")
+    parser.add_argument("--rtt", type=float, default=0.0,
+                        help="simulated round-trip time (sec) with --local")
+    parser.add_argument("--scenario", action="append",
+                        choices=[scenario['name'] for scenario in BENCH_SCENARIOS],
+                        help="run only these scenarios (repeatable)")
+    parser.add_argument("--engines", action="store_true",
+                        help="also compare streaming engines and result fetching")
+    parser.add_argument("--repeat", type=int, default=10, help="repetitions for --engines")
+    args = parser.parse_args()
+    if not args.local and not (args.host and args.username):
+        parser.error("HOST and USERNAME are required without --local")
+
+    server = local_server.start_local_server(rtt=args.rtt) if args.local else None
+
+    def connect() -> dict:
+        if server is not None:
+            channel, ssh = rash.open_connection("127.0.0.1", "bench", None,
+                                                password=server['password'], port=server['port'])
+        else:
+            channel, ssh = rash.open_connection(args.host, args.username, args.key)
+        return rash.initialize_session(channel, ssh)
+
+    try:
+        reports = {scenario['name']: run_scenario(connect, scenario, server)
+                   for scenario in BENCH_SCENARIOS
+                   if not args.scenario or scenario['name'] in args.scenario}
+        print_scenario_table(reports)
+        if args.engines:
+            session_vars = connect()
+            try:
+                bench_stream_latency(session_vars, 1, STREAM_BENCH_COMMANDS, args.repeat)
+                bench_result_fetch(session_vars, args.repeat)
+            finally:
+                rash.close_session(session_vars)
+    finally:
+        if server is not None:
+            local_server.stop_local_server(server)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
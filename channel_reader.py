@@ -0,0 +1,170 @@
+"""
+channel_reader - one background reader per shell channel.
+
+A ChannelReader drains its channel continuously (not only while a command
+is waiting), so the server never blocks on a full channel window. Bytes are
+decoded incrementally, so multibyte UTF-8 characters split across reads
+stay intact, and kept in a bounded ring buffer of recent output. Decoded
+text is routed to the watchers registered for the commands in flight. Each
+watcher scans only the new text (plus a small overlap) for its sentinel
+and echo marker, so the work per byte stays constant no matter how much
+output passes through.
+"""
+import codecs
+import select
+import threading
+import time
+from typing import Any
+
+# raw bytes of recent channel output kept by each reader
+CHANNEL_RING_BYTES = 64 * 1024
+# largest single recv from the channel
+CHANNEL_READ_CHUNK = 32 * 1024
+
+READERS: dict[Any, "ChannelReader"] = {}
+READERS_LOCK = threading.Lock()
+
+
+class SentinelWatcher:
+    """
+    Consumer for one command: finds the line starting with its sentinel and,
+    optionally, the first appearance of an echo marker. The state shared
+    with the caller is the dict under `result` (see ChannelReader.watch).
+    """
+
+    def __init__(self, sentinel: str, echo: str|None, keep_text: bool):
+        self.sentinel = sentinel
+        self.echo = echo
+        self.keep_text = keep_text
+        self.parts: list[str] = []
+        # text that may hold the start of a sentinel or echo split across reads
+        self.tail = ""
+        self.overlap = max(len(sentinel), len(echo or "")) - 1
+        self.result: dict[str, Any] = {'buffer': "", 'done': threading.Event(), 'fields': [],
+                                       'echoed': None, 'found': False, 'bytes': 0}
+
+    def feed(self, text: str, nbytes: int):
+        """Take newly decoded channel text; finish once the sentinel line is complete."""
+        result = self.result
+        result['bytes'] += nbytes
+        if self.keep_text:
+            self.parts.append(text)
+        window = self.tail + text
+        if self.echo is not None and result['echoed'] is None and self.echo in window:
+            result['echoed'] = time.perf_counter()
+        index = window.find(self.sentinel)
+        if index < 0:
+            self.tail = window[-self.overlap:] if self.overlap > 0 else ""
+            return
+        rest = window[index + len(self.sentinel):]
+        if "\n" not in rest:
+            # keep the partial sentinel line until its newline arrives
+            self.tail = window[index:]
+            return
+        result['found'] = True
+        result['fields'] = rest[:rest.index("\n")].split()
+        self.finish()
+
+    def finish(self):
+        """Publish the kept text and wake the caller."""
+        self.result['buffer'] = "".join(self.parts)
+        self.result['done'].set()
+
+
+class ChannelReader:
+    """
+    Background thread draining one channel into a ring buffer and the
+    registered watchers. Ends, finishing every watcher, when the channel or
+    its transport closes.
+    """
+
+    def __init__(self, channel, timeout: float = 0.1):
+        self.channel = channel
+        self.timeout = timeout
+        self.ring = bytearray()
+        self.watchers: list[SentinelWatcher] = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        threading.Thread(target=self.run, daemon=True,
+                         name=f"rash-channel-{channel.get_id()}").start()
+
+    def run(self):
+        """Reader loop: select, recv, dispatch, until the channel is gone."""
+        try:
+            while not self.channel.closed:
+                # select wakes as soon as data arrives; no sleeping between reads
+                readable, _, _ = select.select([self.channel], [], [], self.timeout)
+                if not readable:
+                    if not self.channel.get_transport().is_active():
+                        break
+                    continue
+                data = self.channel.recv(CHANNEL_READ_CHUNK)
+                if not data:
+                    break
+                self.dispatch(data)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self.closed = True
+                watchers, self.watchers = self.watchers, []
+            for watcher in watchers:
+                watcher.finish()
+            with READERS_LOCK:
+                if READERS.get(self.channel) is self:
+                    del READERS[self.channel]
+
+    def dispatch(self, data: bytes):
+        """Add bytes to the ring buffer and pass their text to every watcher."""
+        text = self.decoder.decode(data)
+        with self.lock:
+            self.ring += data
+            if len(self.ring) > CHANNEL_RING_BYTES:
+                del self.ring[:len(self.ring) - CHANNEL_RING_BYTES]
+            for watcher in list(self.watchers):
+                watcher.feed(text, len(data))
+                if watcher.result['done'].is_set():
+                    self.watchers.remove(watcher)
+
+    def watch(self, sentinel: str, echo: str|None = None,
+              keep_text: bool = True) -> tuple[threading.Event, dict]:
+        """
+        Register a watcher for the text that arrives from now on. Returns the
+        event set once the whole sentinel line has arrived (or the channel
+        closes) and a dict with 'buffer' (all text seen, if keep_text, set
+        when done), 'done', 'fields' (words after the sentinel), 'echoed'
+        (perf_counter time echo first appeared), 'found' and 'bytes'.
+        """
+        watcher = SentinelWatcher(sentinel, echo, keep_text)
+        with self.lock:
+            if self.closed:
+                watcher.finish()
+            else:
+                self.watchers.append(watcher)
+        return watcher.result['done'], watcher.result
+
+    def unwatch(self, result: dict):
+        """Stop feeding the watcher that returned result, publishing what it has."""
+        with self.lock:
+            for watcher in self.watchers:
+                if watcher.result is result:
+                    self.watchers.remove(watcher)
+                    watcher.finish()
+                    break
+
+    def recent(self) -> bytes:
+        """The last CHANNEL_RING_BYTES bytes read from the channel."""
+        with self.lock:
+            return bytes(self.ring)
+
+
+def reader_for(channel, timeout: float|None = None) -> ChannelReader:
+    """The channel's reader, started on first use; timeout updates its liveness check."""
+    with READERS_LOCK:
+        reader = READERS.get(channel)
+        if reader is None or reader.closed:
+            reader = READERS[channel] = ChannelReader(channel, timeout or 0.1)
+        elif timeout is not None:
+            reader.timeout = timeout
+    return reader
@@ -0,0 +1,137 @@
+"""
+completion - remote tab completion for rash's interactive prompt.
+
+RemoteCompleter answers from local indexes, never with a round trip on the
+prompt's thread:
+
+* command names from an index of the remote shell's `compgen -c`
+  (executables on $PATH, builtins, keywords), built in the background once
+  per session and again when the shell's PATH changes;
+* paths from the session's FileBrowser (file_browser.py): listings are
+  fetched over SFTP on first use, cached per directory and refetched in
+  the background, and the directories around the cwd are prefetched;
+* rash's own ':' commands.
+
+interactive_loop wraps it in prompt_toolkit's ThreadedCompleter, so a
+directory that is not cached yet is fetched without freezing the prompt.
+"""
+import bisect
+import re
+import shlex
+import threading
+from typing import Iterable
+import paramiko
+from prompt_toolkit.completion import CompleteEvent, Completer, Completion
+from prompt_toolkit.document import Document
+
+# rash's ':' commands (see rash.run_meta_command)
+META_COMMANDS = ["bg", "jobs", "wait", "history", "failed", "show", "sessions", "prune",
+                 "metrics", "state", "upload", "download", "replay"]
+# most command names offered at once (an empty word matches them all)
+COMPLETION_MAX_COMMANDS = 500
+# a word after one of these is in command position
+COMMAND_SEPARATORS = ("|", "||", "&&", ";", "&", "(", "sudo", "time", "exec", "nohup")
+# characters escaped in completed names
+SHELL_SPECIAL = re.compile(r"""([\s'"\\$`&|;()<>*?!#~{}\[\]])""")
+
+CONNECTION_ERRORS = (OSError, EOFError, paramiko.SSHException)
+
+
+class RemoteCompleter(Completer):
+    """
+    prompt_toolkit completer over a rash session's remote shell (see module
+    docstring). Safe to call from ThreadedCompleter's worker threads.
+    """
+
+    def __init__(self, session_vars: dict):
+        self.session_vars = session_vars
+        # sorted, for prefix lookups with bisect
+        self.commands: list[str] = []
+        # PATH the command index was built for (None: the login default)
+        self.indexed_path: str|None = None
+        self.built = False
+        self.building = False
+        self.lock = threading.Lock()
+        self.refresh_commands()
+
+    def shell_path(self) -> str|None:
+        """The primary shell's PATH, if a command has reported it yet."""
+        model = self.session_vars.get('shell_state')
+        if model is None or model.cwd is None:
+            return None
+        return model.snapshot()['environment'].get('PATH')
+
+    def refresh_commands(self):
+        """Rebuild the command index in the background unless it is current."""
+        path = self.shell_path()
+        with self.lock:
+            if self.building or (self.built and path in (None, self.indexed_path)):
+                return
+            self.building = True
+        threading.Thread(target=self.build_commands, args=(path,), daemon=True,
+                         name="rash-completion").start()
+
+    def build_commands(self, path: str|None):
+        """Background thread: index `compgen -c` and prefetch the cwd's listing."""
+        cache = self.session_vars.get('state_cache')
+        commands = None
+        try:
+            if cache is not None:
+                cache.browser.prefetch([cache.cwd()], neighbours=True)
+            environment = f"PATH={shlex.quote(path)} " if path is not None else ""
+            _, stdout, _ = self.session_vars['ssh'].exec_command(
+                f"{environment}bash -c 'compgen -c'")
+            # sorted here: the remote sort's collation may not match bisect's
+            commands = sorted(set(stdout.read().decode(errors="replace").split()))
+        except CONNECTION_ERRORS:
+            # tried again on the next completion
+            pass
+        with self.lock:
+            if commands is not None:
+                self.commands, self.indexed_path, self.built = commands, path, True
+            self.building = False
+
+    def get_completions(self, document: Document,
+                        complete_event: CompleteEvent) -> Iterable[Completion]:
+        text = document.text_before_cursor
+        words = text.split()
+        word = "" if not text or text[-1].isspace() else words.pop()
+        if text.startswith(":") and not words:
+            yield from (Completion(name, -len(word) + 1) for name in META_COMMANDS
+                        if name.startswith(word[1:]))
+        elif "/" not in word and (not words or words[-1] in COMMAND_SEPARATORS):
+            yield from self.complete_command(word)
+        else:
+            yield from self.complete_path(word)
+
+    def complete_command(self, word: str) -> Iterable[Completion]:
+        """Command names starting with word."""
+        self.refresh_commands()
+        with self.lock:
+            commands = self.commands
+        start = bisect.bisect_left(commands, word)
+        for name in commands[start:start + COMPLETION_MAX_COMMANDS]:
+            if not name.startswith(word):
+                break
+            yield Completion(name, -len(word))
+
+    def complete_path(self, word: str) -> Iterable[Completion]:
+        """Entries of word's directory (relative to the shell's cwd) starting with its last part."""
+        cache = self.session_vars.get('state_cache')
+        if cache is None:
+            return
+        directory, slash, prefix = word.rpartition("/")
+        try:
+            path = cache.resolve(directory + slash or None)
+            entries = cache.browser.peek(path)
+            if entries is None:
+                entries = cache.browser.listdir(path)
+        except CONNECTION_ERRORS:
+            return
+        for entry in entries:
+            name = entry['name']
+            # hidden entries only once the prefix asks for them
+            if name.startswith(prefix) and (prefix.startswith(".") or not name.startswith(".")):
+                suffix = "/" if entry['is_dir'] else ""
+                yield Completion(SHELL_SPECIAL.sub(r"\\\1", name) + suffix, -len(prefix),
+                                 display=name + suffix)
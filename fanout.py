@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+fanout - run the same commands on many hosts at once.
+
+Opens a rash session to every host in parallel (at most --parallel at a
+time), runs a command, a file of commands, or rash.SHELL_TESTS on each,
+streams output prefixed with the host name, and finishes with a table of
+exit status and duration per host. Total time is close to the slowest host
+rather than the sum over hosts.
+
+Usage:
+    python fanout.py USERNAME HOST [HOST ...] -c "uptime"
+    python fanout.py USERNAME HOST [HOST ...] --file diag.sh --parallel 8
+    python fanout.py USERNAME HOST [HOST ...] --tests
+
+Hosts may be given as HOST:PORT.
+"""
+import argparse
+import getpass
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict
+import paramiko
+import rash
+
+FANOUT_PARALLELISM = 16
+
+# one lock for all hosts so prefixed lines never interleave mid-line
+PRINT_LOCK = threading.Lock()
+
+
+class HostReport(TypedDict):
+    """
+    Aggregated outcome of the fan-out on one host
+    """
+    host: str
+    results: list[rash.CommandResult]
+    failed_tests: int
+    error: str|None
+    duration: float
+
+
+class PrefixedOutput:
+    """
+    on_output consumer that prints complete lines prefixed with the host name,
+    holding back a partial line until the rest of it arrives.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.partial = {'stdout': "", 'stderr': ""}
+
+    def __call__(self, stream: str, text: str):
+        lines = (self.partial[stream] + text).split("\n")
+        self.partial[stream] = lines.pop()
+        self.emit(stream, lines)
+
+    def flush(self):
+        """Print whatever partial lines are left."""
+        for stream, text in self.partial.items():
+            if text:
+                self.emit(stream, [text])
+            self.partial[stream] = ""
+
+    def emit(self, stream: str, lines: list[str]):
+        """Print lines with the host prefix to stdout or stderr."""
+        if not lines:
+            return
+        out = sys.stderr if stream == "stderr" else sys.stdout
+        with PRINT_LOCK:
+            for line in lines:
+                print(f"[{self.host}] {line}", file=out)
+            out.flush()
+
+
+def split_host(host: str) -> tuple[str, int]:
+    """Split HOST[:PORT] into host name and port (22 by default)."""
+    hostname, _, port = host.partition(":")
+    return hostname, int(port or 22)
+
+
+def run_tests(session_vars: dict, tests: list[rash.ShellTest], output: PrefixedOutput,
+              report: HostReport):
+    """Run every test command in order, adding results and failures to report."""
+    for cmd_number, test in enumerate(tests, start=1):
+        result = rash.execute_command(cmd_number, session_vars, test['cmd'], output)
+        output.flush()
+        report['results'].append(result)
+        for failure in rash.check_shell_test(test, result):
+            report['failed_tests'] += 1
+            output.emit('stderr', [f"FAIL ({test['cmd']}): {failure}"])
+
+
+def run_on_host(host: str, credentials: dict, tests: list[rash.ShellTest]) -> HostReport:
+    """
+    run_on_host - connect, initialize a session and run every test command in order.
+    credentials holds username, private_key_path and password for open_connection.
+    Connection errors are reported in the HostReport rather than raised.
+    """
+    start_time = time.time()
+    output = PrefixedOutput(host)
+    report: HostReport = {'host': host, 'results': [], 'failed_tests': 0,
+                          'error': None, 'duration': 0.0}
+    session_vars = None
+    hostname, port = split_host(host)
+    try:
+        channel, ssh = rash.open_connection(hostname, credentials['username'],
+                                            credentials['private_key_path'],
+                                            password=credentials['password'],
+                                            port=port)
+        session_vars = rash.initialize_session(channel, ssh)
+        run_tests(session_vars, tests, output, report)
+    except (OSError, paramiko.SSHException, RuntimeError, TimeoutError) as e:
+        report['error'] = str(e) or type(e).__name__
+    finally:
+        if session_vars is not None:
+            rash.close_session(session_vars)
+    report['duration'] = time.time() - start_time
+    return report
+
+
+def run_fanout(hosts: list[str], credentials: dict, tests: list[rash.ShellTest],
+               parallel: int = FANOUT_PARALLELISM) -> list[HostReport]:
+    """
+    run_fanout - run tests on every host with at most `parallel` sessions open
+    at once. Reports come back in the order the hosts were given.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        futures = [pool.submit(run_on_host, host, credentials, tests) for host in hosts]
+        return [future.result() for future in futures]
+
+
+def print_fanout_table(reports: list[HostReport]):
+    """Print one row per host: last exit status, failures, duration or error."""
+    width = max([len("HOST")] + [len(report['host']) for report in reports])
+    print(f"\n{'HOST':<{width}}  {'EXIT':>4}  {'CMDS':>4}  {'FAILED':>6}  {'SECONDS':>8}  ERROR")
+    for report in reports:
+        results = report['results']
+        exit_status = results[-1]['exit_status'] if results else None
+        print(f"{report['host']:<{width}}  {str(exit_status):>4}  {len(results):>4}  "
+              f"{report['failed_tests']:>6}  {report['duration']:>8.2f}  {report['error'] or ''}")
+
+
+def main():
+    """
+    Parse hosts and commands, fan out, print the summary table
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("username")
+    parser.add_argument("hosts", nargs="+")
+    what = parser.add_mutually_exclusive_group(required=True)
+    what.add_argument("-c", "--command", help="command to run on every host")
+    what.add_argument("--file", help="file with one command per line")
+    what.add_argument("--tests", action="store_true", help="run rash.SHELL_TESTS")
+    parser.add_argument("--key", default=None, help="private key file")
+    parser.add_argument("--parallel", type=int, default=FANOUT_PARALLELISM,
+                        help="maximum hosts connected at once")
+    args = parser.parse_args()
+
+    if args.tests:
+        tests = rash.SHELL_TESTS
+    elif args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            tests = [{'desc': line, 'cmd': line} for line in f.read().splitlines()
+                     if line.strip() and not line.lstrip().startswith("#")]
+    else:
+        tests = [{'desc': args.command, 'cmd': args.command}]
+
+    # ask once up front rather than from every worker thread
+    credentials = {'username': args.username,
+                   'private_key_path': args.key,
+                   'password': None if args.key else getpass.getpass("Password (no pkey): ")}
+
+    start_time = time.time()
+    reports = run_fanout(args.hosts, credentials, tests, args.parallel)
+    print_fanout_table(reports)
+    print(f"Total: {time.time() - start_time:.2f} sec for {len(reports)} hosts")
+    return 0 if all(report['error'] is None and report['failed_tests'] == 0
+                    for report in reports) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+file_browser - cached remote directory listings for the GUI file browser.
+
+Listings come from SFTP listdir_attr (names, sizes, modes and mtimes in one
+request per directory) instead of `ls` through the shell. Each directory's
+listing is cached:
+
+* within FILE_BROWSER_TTL of being fetched it is returned with no request
+  at all;
+* after that, or once a command that may have changed files finishes
+  (expire), it is fetched again on its next use. A stat of the directory
+  would cost the same one request, but its mtime does not change when a
+  file in it is rewritten in place, so it cannot vouch for the entries'
+  sizes and mtimes.
+
+A background worker prefetches the directories a user is likely to open
+next: the subdirectories of every directory listed, the parent, and, after
+expire, the recently visited ones. The cache is bounded by the total number
+of entries it holds: prefetched directories nobody opened are evicted
+first, then the least recently visited ones.
+"""
+import posixpath
+import queue
+import stat
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, TypedDict
+import paramiko
+
+# seconds a listing is trusted without any request
+FILE_BROWSER_TTL = 30.0
+# total directory entries kept, over all cached directories
+FILE_BROWSER_MAX_ENTRIES = 100_000
+# subdirectories of a listed directory that are prefetched
+FILE_BROWSER_PREFETCH_CHILDREN = 16
+# recently visited directories refetched in the background after expire()
+FILE_BROWSER_RECENT = 16
+
+# prefetch queue order: stop first, then directories asked for, then their neighbours
+PRIORITY_STOP, PRIORITY_REQUESTED, PRIORITY_SPECULATIVE = range(3)
+
+CONNECTION_ERRORS = (OSError, EOFError, paramiko.SSHException)
+
+
+class FileEntry(TypedDict):
+    """
+    One entry of a directory listing
+    """
+    name: str
+    size: int
+    mtime: int
+    mode: int
+    is_dir: bool
+
+
+class FileBrowser:
+    """
+    Directory listings of one rash session with TTL and expiry, LRU bound
+    and background prefetch. Uses its own SFTP client on the session's
+    current transport (reopened after a reconnect), since one
+    paramiko SFTPClient cannot serve the command path and the browser at
+    once; the state cache borrows it under client_lock. Safe to share
+    between threads.
+    """
+
+    def __init__(self, session_vars: dict):
+        self.session_vars = session_vars
+        self.sftp = None
+        self.lock = threading.Lock()
+        self.client_lock = threading.Lock()
+        # path -> {'entries', 'checked' (fetch time, 0 once expired)}; most recently visited last
+        self.listings: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        # (priority, order within it, path or None to stop, whether to queue its
+        # neighbours too); requested paths go first come first served, speculative
+        # ones newest batch first, since the latest directory visited matters most
+        self.pending: queue.PriorityQueue[tuple[int, tuple[float, int], str|None, bool]] = \
+            queue.PriorityQueue()
+        self.stats = {'hits': 0, 'refetches': 0, 'fetches': 0, 'prefetches': 0,
+                      'entries': 0}
+        threading.Thread(target=self.prefetch_worker, daemon=True,
+                         name="rash-file-browser").start()
+
+    def client(self):
+        """The browser's SFTP client on the session's current transport (client_lock held)."""
+        ssh = self.session_vars['ssh']
+        if self.sftp is None or self.sftp.get_channel().get_transport() is not ssh.get_transport():
+            self.sftp = ssh.open_sftp()
+        return self.sftp
+
+    def listdir(self, path: str) -> list[FileEntry]:
+        """Entries of the directory at an absolute path, sorted by name."""
+        path = posixpath.normpath(path)
+        entries, fetched = self.lookup(path)
+        with self.lock:
+            if path in self.listings:
+                self.listings.move_to_end(path)
+        if fetched:
+            self.queue_neighbours(path, entries)
+        return entries
+
+    def peek(self, path: str) -> list[FileEntry]|None:
+        """
+        The cached listing of a directory with no request at all: None if it
+        is not cached; an expired one is returned and fetched again in the
+        background.
+        """
+        path = posixpath.normpath(path)
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing is None:
+                return None
+            self.listings.move_to_end(path)
+            self.stats['hits'] += 1
+            if time.time() - listing['checked'] >= FILE_BROWSER_TTL:
+                self.pending.put((PRIORITY_REQUESTED, (time.monotonic(), 0), path, False))
+            return listing['entries']
+
+    def fresh(self, path: str, prefetch: bool) -> tuple[dict[str, Any]|None, list[FileEntry]|None]:
+        """(cached listing or None, its entries if still within the TTL, else None)."""
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing is None or time.time() - listing['checked'] >= FILE_BROWSER_TTL:
+                return listing, None
+            if not prefetch:
+                self.stats['hits'] += 1
+            return listing, listing['entries']
+
+    def lookup(self, path: str, prefetch: bool = False) -> tuple[list[FileEntry], bool]:
+        """Cached or freshly fetched listing; True if it was fetched."""
+        listing, entries = self.fresh(path, prefetch)
+        if entries is not None:
+            return entries, False
+        with self.client_lock:
+            # another thread may have fetched it while this one waited for the client
+            listing, entries = self.fresh(path, prefetch)
+            if entries is not None:
+                return entries, False
+            self.stats['refetches' if listing is not None
+                       else 'prefetches' if prefetch else 'fetches'] += 1
+            fetched = time.time()
+            entries = [{'name': attrs.filename,
+                        'size': attrs.st_size or 0,
+                        'mtime': attrs.st_mtime or 0,
+                        'mode': attrs.st_mode or 0,
+                        'is_dir': stat.S_ISDIR(attrs.st_mode or 0)}
+                       for attrs in self.client().listdir_attr(path)]
+            entries.sort(key=lambda entry: entry['name'])
+            self.store(path, entries, fetched, prefetch)
+        return entries, True
+
+    def store(self, path: str, entries: list[FileEntry], fetched: float, prefetch: bool):
+        """
+        Cache a listing (a prefetched one as least recently visited, unless
+        it replaces a visited one), evicting past the entry bound.
+        """
+        with self.lock:
+            listing = self.listings.get(path)
+            if listing is not None:
+                self.stats['entries'] -= len(listing['entries'])
+                listing.update(entries=entries, checked=fetched)
+            else:
+                self.listings[path] = {'entries': entries, 'checked': fetched}
+                if prefetch:
+                    self.listings.move_to_end(path, last=False)
+            self.stats['entries'] += len(entries)
+            while self.stats['entries'] > FILE_BROWSER_MAX_ENTRIES and len(self.listings) > 1:
+                _, evicted = self.listings.popitem(last=False)
+                self.stats['entries'] -= len(evicted['entries'])
+
+    def queue_neighbours(self, path: str, entries: list[FileEntry]):
+        """Queue the first subdirectories, then the parent, of a listed directory."""
+        # hidden directories are rarely opened
+        children = [posixpath.join(path, entry['name']) for entry in entries
+                    if entry['is_dir'] and not entry['name'].startswith(".")]
+        batch = -time.monotonic()
+        neighbours = children[:FILE_BROWSER_PREFETCH_CHILDREN] + [posixpath.dirname(path)]
+        for index, neighbour in enumerate(neighbours):
+            if neighbour != path:
+                self.pending.put((PRIORITY_SPECULATIVE, (batch, index), neighbour, False))
+
+    def prefetch(self, paths: list[str], neighbours: bool = False):
+        """
+        Load directories (with neighbours, their subdirectories and parents
+        too) in the background, ahead of speculative neighbour fetches.
+        """
+        for path in paths:
+            self.pending.put((PRIORITY_REQUESTED, (time.monotonic(), 0),
+                              posixpath.normpath(path), neighbours))
+
+    def prefetch_worker(self):
+        """Background thread: fetch queued directories not cached yet or expired."""
+        while (item := self.pending.get())[2] is not None:
+            _, _, path, neighbours = item
+            try:
+                entries, _ = self.lookup(path, prefetch=True)
+            except CONNECTION_ERRORS:
+                # unreadable or gone, or the connection dropped: the user will see it on visit
+                continue
+            if neighbours:
+                self.queue_neighbours(path, entries)
+
+    def expire(self, first: str|None = None):
+        """
+        Make every listing be fetched again on its next use (a command may
+        have changed files) and refetch first (with its neighbours), then the
+        recently visited ones, in the background now.
+        """
+        with self.lock:
+            for listing in self.listings.values():
+                listing['checked'] = 0.0
+            recent = list(self.listings)[-FILE_BROWSER_RECENT:][::-1]
+        if first is not None:
+            self.prefetch([first], neighbours=True)
+        self.prefetch(recent)
+
+    def invalidate(self, path: str|None = None):
+        """Forget one directory's listing, or all of them."""
+        with self.lock:
+            if path is None:
+                self.listings.clear()
+                self.stats['entries'] = 0
+            elif (listing := self.listings.pop(posixpath.normpath(path), None)) is not None:
+                self.stats['entries'] -= len(listing['entries'])
+
+    def close(self):
+        """Stop the prefetch worker and close the SFTP client."""
+        self.pending.put((PRIORITY_STOP, (0.0, 0), None, False))
+        with self.client_lock:
+            sftp, self.sftp = self.sftp, None
+        if sftp is not None:
+            try:
+                sftp.close()
+            except CONNECTION_ERRORS:
+                pass
@@ -0,0 +1,198 @@
+"""
+history_cache - local, size-bounded cache of command history and outputs.
+
+Every finished command (text, stdout, stderr, exit status, timings) is kept
+in memory keyed by (session, cmd_number), with least-recently-used eviction
+once the cached text and its index entries exceed max_bytes. Searches match
+substrings of the command and output text (as the SQLite LIKE search does),
+narrowed first by a word index and an exit-status index, without touching
+the server. With db_path set, entries are also written to a local SQLite
+file, so evicted entries and earlier sessions stay searchable.
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any
+
+HISTORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# approximate memory of one key in the word or status index (set slot, share of the word)
+INDEX_POSTING_BYTES = 64
+
+WORD_PATTERN = re.compile(r"\w+")
+
+HistoryKey = tuple[str, int]
+
+
+def index_words(*texts: str) -> set[str]:
+    """Lower-cased words of the given texts, as used by the search index."""
+    return {word.lower() for text in texts for word in WORD_PATTERN.findall(text)}
+
+
+def inner_words(text: str) -> set[str]:
+    """
+    Lower-cased words of a search text that any match must contain as whole
+    words: those not at the text's edges (an edge word may be part of a longer one).
+    """
+    return {match.group().lower() for match in WORD_PATTERN.finditer(text)
+            if match.start() > 0 and match.end() < len(text)}
+
+
+def entry_size(entry: dict[str, Any], words: set[str]) -> int:
+    """Approximate memory charged to an entry: its text fields and its index keys."""
+    return (len(entry['command']) + len(entry['stdout']) + len(entry['stderr'])
+            + (len(words) + 1) * INDEX_POSTING_BYTES)
+
+
+class HistoryCache:
+    """
+    In-memory LRU of command results with word and exit-status indexes and
+    an optional SQLite store. Safe to share between threads.
+    """
+
+    COLUMNS = ("session", "cmd_number", "command", "stdout", "stderr",
+               "exit_status", "started", "duration")
+
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES, db_path: str|None = None):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[HistoryKey, dict[str, Any]] = OrderedDict()
+        self.word_index: defaultdict[str, set[HistoryKey]] = defaultdict(set)
+        self.status_index: defaultdict[int|None, set[HistoryKey]] = defaultdict(set)
+        self.lock = threading.Lock()
+        self.db: sqlite3.Connection|None = None
+        if db_path is not None:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS history ("
+                            "session TEXT, cmd_number INTEGER, command TEXT, stdout TEXT, "
+                            "stderr TEXT, exit_status INTEGER, started REAL, duration REAL, "
+                            "PRIMARY KEY (session, cmd_number))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS history_status ON history (exit_status)")
+            self.db.commit()
+
+    def add(self, session: str, result: dict[str, Any]):
+        """Cache a finished command; result is a rash.CommandResult."""
+        entry = {'session': session,
+                 'cmd_number': result['cmd_number'],
+                 'command': result['command'],
+                 # large outputs (large_output.LargeOutput) are kept as a head/tail preview
+                 'stdout': str(result['stdout']),
+                 'stderr': str(result['stderr']),
+                 'exit_status': result['exit_status'],
+                 'started': time.time() - result['duration'],
+                 'duration': result['duration']}
+        with self.lock:
+            self.insert(entry)
+            self.evict()
+            if self.db is not None:
+                self.db.execute(f"INSERT OR REPLACE INTO history VALUES "
+                                f"({', '.join('?' * len(self.COLUMNS))})",
+                                [entry[column] for column in self.COLUMNS])
+                self.db.commit()
+
+    def insert(self, entry: dict[str, Any]):
+        """Add an entry to the LRU and both indexes (lock held)."""
+        key = (entry['session'], entry['cmd_number'])
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = entry
+        words = index_words(entry['command'], entry['stdout'], entry['stderr'])
+        self.size += entry_size(entry, words)
+        for word in words:
+            self.word_index[word].add(key)
+        self.status_index[entry['exit_status']].add(key)
+
+    def remove(self, key: HistoryKey):
+        """Drop an entry from memory and from both indexes (lock held)."""
+        entry = self.entries.pop(key)
+        words = index_words(entry['command'], entry['stdout'], entry['stderr'])
+        self.size -= entry_size(entry, words)
+        for word in words:
+            self.word_index[word].discard(key)
+            if not self.word_index[word]:
+                del self.word_index[word]
+        self.status_index[entry['exit_status']].discard(key)
+        if not self.status_index[entry['exit_status']]:
+            del self.status_index[entry['exit_status']]
+
+    def evict(self):
+        """Evict least recently used entries until under max_bytes (lock held)."""
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
+
+    def get(self, session: str, cmd_number: int) -> dict[str, Any]|None:
+        """Return one cached command, from memory or else the SQLite store."""
+        key = (session, cmd_number)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            if self.db is None:
+                return None
+            row = self.db.execute("SELECT * FROM history WHERE session = ? AND cmd_number = ?",
+                                  key).fetchone()
+            if row is None:
+                return None
+            entry = dict(zip(self.COLUMNS, row))
+            self.insert(entry)
+            self.evict()
+            return entry
+
+    def search(self, text: str = "", session: str|None = None, exit_status: int|None = None,
+               failed: bool = False, limit: int = 50) -> list[dict[str, Any]]:
+        """
+        Newest-first commands whose command line or output contains text (a
+        case-insensitive substring), optionally limited to one session, one
+        exit status, or failures (non-zero status). The SQLite store is
+        searched too when configured.
+        """
+        with self.lock:
+            keys = set(self.entries)
+            for word in inner_words(text):
+                keys &= self.word_index.get(word, set())
+            if exit_status is not None:
+                keys &= self.status_index.get(exit_status, set())
+            matches = {key: self.entries[key] for key in keys
+                       if self.matches(self.entries[key], text, session, failed)}
+            if self.db is not None:
+                for entry in self.search_db(text, session, exit_status, failed, limit):
+                    matches.setdefault((entry['session'], entry['cmd_number']), entry)
+        return sorted(matches.values(), key=lambda entry: entry['started'], reverse=True)[:limit]
+
+    @staticmethod
+    def matches(entry: dict[str, Any], text: str, session: str|None, failed: bool) -> bool:
+        """Check the filters the indexes cannot answer exactly."""
+        if session is not None and entry['session'] != session:
+            return False
+        if failed and entry['exit_status'] in (0, None):
+            return False
+        needle = text.lower()
+        return not needle or any(needle in entry[field].lower()
+                                 for field in ('command', 'stdout', 'stderr'))
+
+    def search_db(self, text: str, session: str|None, exit_status: int|None,
+                  failed: bool, limit: int) -> list[dict[str, Any]]:
+        """The same search against the SQLite store (lock held)."""
+        clauses, params = [], []
+        if text:
+            clauses.append("(command LIKE ? OR stdout LIKE ? OR stderr LIKE ?)")
+            params += [f"%{text}%"] * 3
+        if session is not None:
+            clauses.append("session = ?")
+            params.append(session)
+        if exit_status is not None:
+            clauses.append("exit_status = ?")
+            params.append(exit_status)
+        if failed:
+            clauses.append("exit_status != 0")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.db.execute(f"SELECT * FROM history {where} ORDER BY started DESC LIMIT ?",
+                               params + [limit]).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def close(self):
+        """Close the SQLite store, if any."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,125 @@
+"""
+large_output - bounded-memory capture of command output.
+
+OutputCapture collects a stream's bytes as they are read. Up to its
+threshold they stay in memory and come back as a plain string; past it they
+are spilled to a local temporary file and come back as a LargeOutput, a
+lazy memory-mapped handle with size, head/tail and paged slices. The
+threshold is per capture; rash takes it from the session option
+'large_output_threshold' (LARGE_OUTPUT_THRESHOLD by default).
+"""
+import codecs
+import mmap
+import os
+import tempfile
+import weakref
+
+# output beyond this many bytes per stream is spilled to a local file
+LARGE_OUTPUT_THRESHOLD = 8 * 1024 * 1024
+LARGE_OUTPUT_PAGE_SIZE = 64 * 1024
+
+
+def release_spill(view: mmap.mmap|None, handle, path: str):
+    """Unmap, close and delete a spill file."""
+    if view is not None:
+        view.close()
+    handle.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class LargeOutput:
+    """
+    Read-only view of a spilled output file. Slices are decoded on demand,
+    so only the requested part is ever held as a string. The file is
+    deleted on close() or when the handle is garbage collected.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.handle = open(path, "rb") # pylint: disable=consider-using-with
+        self.size = os.fstat(self.handle.fileno()).st_size
+        # mmap cannot map an empty file
+        self.view = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ) \
+            if self.size else None
+        self.finalizer = weakref.finalize(self, release_spill, self.view, self.handle, path)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def slice(self, start: int, end: int) -> str:
+        """Decoded bytes [start, end) of the output."""
+        if self.view is None:
+            return ""
+        return self.view[max(0, start):min(end, self.size)].decode(errors="replace")
+
+    def head(self, nbytes: int = 4096) -> str:
+        """The first nbytes of the output."""
+        return self.slice(0, nbytes)
+
+    def tail(self, nbytes: int = 4096) -> str:
+        """The last nbytes of the output."""
+        return self.slice(self.size - nbytes, self.size)
+
+    def page_count(self, page_size: int = LARGE_OUTPUT_PAGE_SIZE) -> int:
+        """Number of pages of page_size bytes."""
+        return -(-self.size // page_size)
+
+    def page(self, number: int, page_size: int = LARGE_OUTPUT_PAGE_SIZE) -> str:
+        """Page `number` (from 0) of page_size bytes."""
+        return self.slice(number * page_size, (number + 1) * page_size)
+
+    def chunks(self, page_size: int = LARGE_OUTPUT_PAGE_SIZE):
+        """The whole output as decoded text, page_size bytes at a time."""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        for start in range(0, self.size, page_size):
+            yield decoder.decode(self.view[start:start + page_size])
+        yield decoder.decode(b"", final=True)
+
+    def __contains__(self, text: str) -> bool:
+        return self.view is not None and self.view.find(text.encode()) != -1
+
+    def __str__(self) -> str:
+        """A preview: head and tail around a note of how much was left out."""
+        if self.size <= 2 * 4096:
+            return self.slice(0, self.size)
+        return f"{self.head()}\n... [{self.size - 2 * 4096} bytes omitted] ...\n{self.tail()}"
+
+    def close(self):
+        """Unmap and delete the spill file now."""
+        self.finalizer()
+
+
+class OutputCapture:
+    """
+    Accumulates one output stream: in memory up to threshold bytes, then in
+    a temporary file.
+    """
+
+    def __init__(self, threshold: int = LARGE_OUTPUT_THRESHOLD):
+        self.threshold = threshold
+        self.buffer = bytearray()
+        self.spill = None
+        self.size = 0
+
+    def write(self, data: bytes):
+        """Append bytes, spilling everything to disk once past the threshold."""
+        self.size += len(data)
+        if self.spill is None and self.size > self.threshold:
+            # pylint: disable-next=consider-using-with
+            self.spill = tempfile.NamedTemporaryFile(prefix="rash-output-", delete=False)
+            self.spill.write(self.buffer)
+            self.buffer = bytearray()
+        if self.spill is not None:
+            self.spill.write(data)
+        else:
+            self.buffer += data
+
+    def finish(self) -> str|LargeOutput:
+        """The captured output: a string, or a LargeOutput if it was spilled."""
+        if self.spill is None:
+            return self.buffer.decode(errors="replace")
+        self.spill.close()
+        return LargeOutput(self.spill.name)
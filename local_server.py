@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+local_server - in-process SSH/SFTP stand-in server for benchmarking rash.
+
+Serves a real local bash (shell and exec requests) and an SFTP subsystem
+backed by the local filesystem. Clients connect through a relay that adds
+rtt/2 of delay in each direction (none by default) and counts the bytes it
+forwards, so the effect of RTT can be measured reproducibly on one box.
+The shell runs as the invoking user, so the server only accepts the random
+password it was started with (server['password']), never a key: other
+local users can reach its port too.
+
+Usage:
+    server = start_local_server(rtt=0.02)
+    channel, ssh = rash.open_connection("127.0.0.1", "bench", None,
+                                        password=server['password'], port=server['port'])
+    ...
+    stop_local_server(server)
+"""
+import hmac
+import os
+import pty
+import secrets
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import heapq
+from typing import Any
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+from paramiko.sftp import SFTP_OK
+
+# generated once per process; the stand-in server identity is not persisted
+HOST_KEY: paramiko.RSAKey | None = None
+
+def host_key() -> paramiko.RSAKey:
+    """Return (generating on first use) the throwaway host key."""
+    global HOST_KEY # pylint: disable=global-statement
+    if HOST_KEY is None:
+        HOST_KEY = paramiko.RSAKey.generate(2048)
+    return HOST_KEY
+
+
+class LocalHandle(SFTPHandle):
+    """SFTP handle over a local file object."""
+
+    def __init__(self, flags: int, path: str, f):
+        super().__init__(flags)
+        self.filename = path
+        self.readfile = f
+        self.writefile = f
+
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+class LocalSFTP(SFTPServerInterface):
+    """Local filesystem SFTP implementation; paths are used as-is."""
+
+    def list_folder(self, path):
+        try:
+            out = []
+            for name in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+                attr.filename = name
+                out.append(attr)
+            return out
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        f = os.fdopen(fd, mode)
+        return LocalHandle(flags, path, f)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(oldpath, newpath)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        return self.rename(oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(path)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        return SFTP_OK
+
+    def canonicalize(self, path):
+        return os.path.realpath(path)
+
+
+class LocalServer(paramiko.ServerInterface):
+    """Accept the server's password only and serve shell/exec/sftp on local processes."""
+
+    def __init__(self, home_dir: str, password: str):
+        self.home_dir = home_dir
+        self.password = password
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_auth_password(self, username, password):
+        if hmac.compare_digest(password.encode(), self.password.encode()):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    # signature fixed by paramiko.ServerInterface
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def check_channel_pty_request(self, channel, term, width, height,
+                                  pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_window_change_request(self, channel, width, height,
+                                            pixelwidth, pixelheight):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=serve_shell, args=(channel, self.home_dir),
+                         daemon=True).start()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=serve_exec, args=(channel, command.decode(), self.home_dir),
+                         daemon=True).start()
+        return True
+
+
+def shell_env(home_dir: str) -> dict[str, str]:
+    """Environment for served shells: the local one with HOME and a fixed prompt."""
+    env = dict(os.environ)
+    env.update({"HOME": home_dir, "PS1": "bench$ ", "TERM": "dumb"})
+    return env
+
+
+def serve_shell(channel: paramiko.Channel, home_dir: str):
+    """Run an interactive bash on a pty and pump bytes to/from the channel."""
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.chdir(home_dir)
+        os.execve("/bin/bash", ["bash", "--norc", "--noprofile", "-i"], shell_env(home_dir))
+
+    def pump_out():
+        try:
+            while True:
+                try:
+                    data = os.read(fd, 65536)
+                except OSError:
+                    break
+                if not data:
+                    break
+                channel.sendall(data)
+            channel.send_exit_status(0)
+            channel.close()
+        except (OSError, EOFError, paramiko.SSHException):
+            # the client hung up while the shell was still writing
+            pass
+
+    threading.Thread(target=pump_out, daemon=True).start()
+    while True:
+        data = channel.recv(65536)
+        if not data:
+            break
+        os.write(fd, data)
+    try:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+
+
+def serve_exec(channel: paramiko.Channel, command: str, home_dir: str):
+    """Run one command with bash -c, returning its output and exit status."""
+    with subprocess.Popen(["/bin/bash", "-c", command], cwd=home_dir, env=shell_env(home_dir),
+                          stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE) as proc:
+
+        def pump_err():
+            try:
+                for chunk in iter(lambda: proc.stderr.read1(65536), b""):
+                    channel.sendall_stderr(chunk)
+            except (OSError, EOFError, paramiko.SSHException):
+                pass
+
+        err_thread = threading.Thread(target=pump_err, daemon=True)
+        err_thread.start()
+        try:
+            for chunk in iter(lambda: proc.stdout.read1(65536), b""):
+                channel.sendall(chunk)
+            err_thread.join()
+            channel.send_exit_status(proc.wait())
+            channel.close()
+        except (OSError, EOFError, paramiko.SSHException):
+            # the client hung up before the command finished
+            proc.kill()
+
+
+class LatencyProxy:
+    """
+    TCP relay that delays every segment by rtt/2 in each direction and
+    counts the bytes it forwards.
+    """
+
+    def __init__(self, target_port: int, rtt: float):
+        self.target_port = target_port
+        self.delay = rtt / 2
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.lock = threading.Lock()
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        """Relay every accepted connection to the server."""
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.relay(client, upstream, "bytes_up")
+            self.relay(upstream, client, "bytes_down")
+
+    def relay(self, src: socket.socket, dst: socket.socket, counter: str):
+        """Forward src to dst, each chunk held back until its due time."""
+        queue: list[tuple[float, int, bytes]] = []
+        cond = threading.Condition()
+        seq = iter(range(1 << 62))
+
+        def reader():
+            while True:
+                try:
+                    data = src.recv(65536)
+                except OSError:
+                    data = b""
+                with cond:
+                    heapq.heappush(queue, (time.monotonic() + self.delay, next(seq), data))
+                    cond.notify()
+                if not data:
+                    return
+                with self.lock:
+                    setattr(self, counter, getattr(self, counter) + len(data))
+
+        def writer():
+            while True:
+                with cond:
+                    while not queue:
+                        cond.wait()
+                    due, _, data = queue[0]
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        cond.wait(wait)
+                        continue
+                    heapq.heappop(queue)
+                if not data:
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    return
+                try:
+                    dst.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=reader, daemon=True).start()
+        threading.Thread(target=writer, daemon=True).start()
+
+    def close(self):
+        """Stop accepting new connections."""
+        self.listener.close()
+
+
+def start_local_server(rtt: float = 0.0, home_dir: str | None = None) -> dict[str, Any]:
+    """
+    start_local_server - listen on a free localhost port and serve SSH in background threads.
+    The returned port is the LatencyProxy in front of the server, adding rtt; the returned
+    password is the only credential it accepts.
+    """
+    if home_dir is None:
+        home_dir = tempfile.mkdtemp(prefix="rash-bench-home-")
+    password = secrets.token_urlsafe()
+    listener = socket.create_server(("127.0.0.1", 0))
+    server_port = listener.getsockname()[1]
+    transports: list[paramiko.Transport] = []
+
+    def accept_loop():
+        while True:
+            try:
+                client, _ = listener.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(client)
+            transport.add_server_key(host_key())
+            transport.set_subsystem_handler("sftp", SFTPServer, LocalSFTP)
+            transport.start_server(server=LocalServer(home_dir, password))
+            transports.append(transport)
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    proxy = LatencyProxy(server_port, rtt)
+    return {'port': proxy.port,
+            'server_port': server_port,
+            'home_dir': home_dir,
+            'password': password,
+            'listener': listener,
+            'proxy': proxy,
+            'transports': transports}
+
+
+def stop_local_server(server: dict[str, Any]):
+    """stop_local_server - close the listener, proxy and any live transports."""
+    server['listener'].close()
+    server['proxy'].close()
+    for transport in server['transports']:
+        transport.close()
+
+
+def bytes_transferred(server: dict[str, Any]) -> tuple[int, int]:
+    """Bytes relayed so far as (client to server, server to client)."""
+    proxy = server['proxy']
+    with proxy.lock:
+        return proxy.bytes_up, proxy.bytes_down
@@ -0,0 +1,126 @@
+"""
+metrics - per-command latency and transfer metrics.
+
+rash records, for every command, how long each phase of its execution took
+(e.g. the post-history pause, following output, waiting for the sentinel,
+fetching the status file) and how many SFTP requests, SFTP bytes and shell
+channel bytes it used. MetricsRecorder turns those into a structured event
+stream: one JSON line per command to an optional log file, callbacks
+registered with add_hook, and rolling per-phase aggregates (count, mean,
+p50, p99 over the last METRICS_WINDOW commands).
+"""
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, TypedDict
+
+METRICS_WINDOW = 1000
+
+
+class CommandMetrics(TypedDict):
+    """
+    Where one command's time and traffic went
+    """
+    phases: dict[str, float]
+    sftp_requests: int
+    sftp_bytes: int
+    channel_bytes: int
+
+
+def new_metrics() -> CommandMetrics:
+    """An empty CommandMetrics to be filled in while a command runs."""
+    return {'phases': {}, 'sftp_requests': 0, 'sftp_bytes': 0, 'channel_bytes': 0}
+
+
+def end_phase(metrics: CommandMetrics, name: str, start: float) -> float:
+    """Record phase `name` as lasting from start (perf_counter) until now; return now."""
+    now = time.perf_counter()
+    metrics['phases'][name] = metrics['phases'].get(name, 0.0) + now - start
+    return now
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """Nearest-rank q-th percentile of samples."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class MetricsRecorder:
+    """
+    Collects CommandMetrics from finished commands: writes them as JSON lines,
+    passes them to hooks and keeps rolling aggregates. Safe to share between
+    threads (background shells record into the same recorder).
+    """
+
+    def __init__(self, log_path: str|None = None, window: int = METRICS_WINDOW):
+        self.hooks: list[Callable[[dict[str, Any]], None]] = []
+        self.samples: defaultdict[str, deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self.lock = threading.Lock()
+        self.log = open(log_path, "a", encoding="utf-8") \
+            if log_path else None # pylint: disable=consider-using-with
+
+    def add_hook(self, hook: Callable[[dict[str, Any]], None]):
+        """Call hook(event) for every command recorded from now on."""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[dict[str, Any]], None]):
+        """Stop calling a hook added with add_hook."""
+        self.hooks.remove(hook)
+
+    def record(self, session: str, result: dict[str, Any]):
+        """Emit the event for a finished command; result is a rash.CommandResult."""
+        metrics: CommandMetrics = result['metrics']
+        event = {'event': "command",
+                 'time': time.time(),
+                 'session': session,
+                 'cmd_number': result['cmd_number'],
+                 'command': result['command'],
+                 'exit_status': result['exit_status'],
+                 'duration': result['duration'],
+                 **metrics}
+        with self.lock:
+            self.samples['duration'].append(result['duration'])
+            for name, seconds in metrics['phases'].items():
+                self.samples[f"phase.{name}"].append(seconds)
+            for counter in ('sftp_requests', 'sftp_bytes', 'channel_bytes'):
+                self.samples[counter].append(metrics[counter])
+        self.emit(event)
+
+    def record_startup(self, session: str, timings: dict[str, float]):
+        """Emit a 'startup' event with the seconds each startup step took."""
+        with self.lock:
+            for name, seconds in timings.items():
+                self.samples[f"startup.{name}"].append(seconds)
+        self.emit({'event': "startup", 'time': time.time(), 'session': session, **timings})
+
+    def emit(self, event: dict[str, Any]):
+        """Write an event to the JSON-lines log and pass it to every hook."""
+        if self.log is not None:
+            with self.lock:
+                self.log.write(json.dumps(event) + "\n")
+                self.log.flush()
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                # a broken hook must not break command execution
+                print(f"[metrics] hook {hook!r} failed: {e}", file=sys.stderr)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Count, mean, p50 and p99 of the duration, each phase and each counter."""
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items() if values}
+        return {name: {'count': len(values),
+                       'mean': sum(values) / len(values),
+                       'p50': percentile(values, 50),
+                       'p99': percentile(values, 99)}
+                for name, values in sorted(samples.items())}
+
+    def close(self):
+        """Close the JSON-lines log, if any."""
+        if self.log is not None:
+            self.log.close()
+            self.log = None
@@ -14,22 +14,83 @@ Dependencies:
     See environment.yml for full list.
 
 """
+# pylint: disable=too-many-lines
 import os
+import posixpath
 import sys
+import importlib
 import time
 from datetime import datetime
 from collections import defaultdict
 import getpass
+import re
+import shlex
+import secrets
+import codecs
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+import socket
+import select
 # libs to get fingerprint from publickey
 import hashlib
 import base64
 from typing import Any,TypedDict,Optional
 import paramiko
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import InMemoryHistory
+from history_cache import HistoryCache
+from large_output import LARGE_OUTPUT_THRESHOLD, LargeOutput, OutputCapture
+from retention import SessionStore
+from state_cache import StateCache
+from shell_state import SNAPSHOT_FUNCTION, ShellState, StateChange
+from channel_reader import reader_for
+from metrics import CommandMetrics, MetricsRecorder, end_phase, new_metrics
+from session_recorder import SessionPlayer, SessionRecorder
+from transfer import download, upload
 
 
 DO_TESTS_ON_CONNECT = False
+# return results inline on the shell channel instead of reading them over SFTP
+USE_FRAMED_RESULTS = False
+
+# adaptive backoff bounds (sec) for following stdout/stderr while a command runs
+STREAM_MIN_INTERVAL = 0.005
+STREAM_MAX_INTERVAL = 0.2
+# wait (sec) for completion before the first poll of a command's output files
+STREAM_FIRST_POLL = 0.05
+# largest single read while following output
+STREAM_READ_CHUNK = 1024 * 1024
+# base64 characters of a framed result decoded at a time
+FRAME_DECODE_CHUNK = 1024 * 1024
+# silence (sec) before a channel's transport is checked: CHANNEL_TIMEOUT_RTTS x the
+# session's smoothed RTT, kept within [CHANNEL_TIMEOUT_MIN, CHANNEL_TIMEOUT_MAX]
+CHANNEL_TIMEOUT_RTTS = 4
+CHANNEL_TIMEOUT_MIN = 0.05
+CHANNEL_TIMEOUT_MAX = 1.0
+# SFTP clients per session used to fetch several files concurrently (recovery, transfers);
+# the extra ones are opened on first use, as each holds one of the server's MaxSessions channels
+FETCH_PARALLELISM = 3
+# background shells opened on demand by ShellPool, and the primary shell's saved state
+SHELL_POOL_SIZE = 2
+SHELL_STATE_FILE = "shell-state"
+# local SQLite file keeping command history/outputs across sessions (None: memory only)
+HISTORY_CACHE_DB: str|None = None
+# append one JSON line of per-phase metrics per command to this local file (None: off)
+METRICS_LOG: str|None = None
+# record each session (commands, timed output, exit statuses) for :replay as
+# <session>.rashrec in this local directory (None: off)
+SESSION_RECORDING_DIR: str|None = None
+# delete (rm -rf) old ~/.rash sessions past the retention.py limits when connecting;
+# off: sessions are only deleted when asked with :prune
+PRUNE_ON_CONNECT = False
+# SSH keepalive interval (sec), so idle connections are not dropped by servers or NAT
+KEEPALIVE_INTERVAL = 15
+# reconnect attempts after the connection drops, first pause (sec) between them (doubling)
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 1.0
+# seconds a command's connection error waits for the transport to finish going down, if it is
+DROP_SETTLE_SECONDS = 1.0
+# what a dropped connection raises from channel and SFTP calls
+CONNECTION_ERRORS = (OSError, EOFError, paramiko.SSHException)
 
 def fingerprint_from_pubkey_file(pub_file: str) -> Optional[str]:
     """
@@ -93,16 +154,33 @@ def main():
     Set connection info, optionally run shell tests, and enter interactive session
     """
 
+    start_time = time.perf_counter()
+    # prompt_toolkit (and the completer built on it) is only needed for the
+    # first prompt: load it while connecting
+    threading.Thread(target=importlib.import_module, args=("completion",),
+                     daemon=True).start()
+
     # --- Connection info ---
     host = "riviera.colostate.edu"
     username = "dking"
     # passwordless login
     private_key_file = "" # "~/.ssh/id_ed25519"
-    channel,ssh = open_connection(host, username, private_key_file)
+    # resolved once (agent key, passphrase or password) and kept for reconnects
+    connection = resolve_connection(host, username, private_key_file)
+    channel,ssh = connect(connection)
+    connected_time = time.perf_counter()
     session_vars = initialize_session(channel, ssh)
+    session_vars['connection'] = connection
+    session_vars['framed'] = USE_FRAMED_RESULTS
+    session_vars['history_cache'] = HistoryCache(db_path=HISTORY_CACHE_DB)
+    session_vars['metrics'] = MetricsRecorder(log_path=METRICS_LOG)
+    session_vars['state_cache'] = StateCache(session_vars, SHELL_STATE_FILE)
+    if SESSION_RECORDING_DIR is not None:
+        session_vars['recorder'] = open_recording(SESSION_RECORDING_DIR, session_vars)
+    if PRUNE_ON_CONNECT:
+        session_vars['session_store'].prune_in_background()
 
     # extract vars for session
-    sftp = session_vars['sftp']
     session_dir = session_vars['session_dir']
     #home_dir = session_vars['home_dir']
     #server_prompt = session_vars['server_prompt']
@@ -117,73 +195,235 @@ def main():
                                     test=shell_test)
 
 
+    # --- Time to first prompt ---
+    startup = {'connect': connected_time - start_time,
+               'session': session_vars['startup'],
+               'first_prompt': time.perf_counter() - start_time}
+    session_vars['metrics'].record_startup(os.path.basename(session_dir), startup)
+    print(f"Ready in {startup['first_prompt']:.2f} sec (connect {startup['connect']:.2f}, "
+          f"session setup {startup['session']:.2f})")
+
     # INTERACTIVE LOOP
     interactive_loop(cmd_number, session_vars)
 
-    # --- Optional: check session directory size ---
+    # --- Optional: check session directory size (after packing) ---
+    session_vars.pop('session_store').close()
     _,stdout,_ = ssh.exec_command(f"du -sh {session_dir}")
 
     size_info = stdout.read().decode().strip()
     print(f"\nTotal session directory size: {size_info}")
 
     # --- Close SSH ---
-    sftp.close()
-    channel.close()
-    ssh.close()
+    close_session(session_vars)
+    session_vars['history_cache'].close()
+    session_vars['metrics'].close()
 
-def stream_command_output(sftp, stdout_file, stderr_file, sentinel_file, poll_interval=0.1):
-    """Stream stdout/stderr while command is running."""
-    stdout_seen = 0
-    stderr_seen = 0
 
-    while True:
-        # Read new stdout
-        try:
-            with sftp.open(stdout_file, "r") as f:
-                f.seek(stdout_seen)
-                new_stdout = f.read().decode()
-                if new_stdout:
-                    print(new_stdout, end="", flush=True)
-                    stdout_seen += len(new_stdout.encode())
-        except FileNotFoundError:
-            pass
+def open_recording(directory: str, session_vars: dict) -> SessionRecorder:
+    """Start recording the session to <directory>/<session>.rashrec (session_recorder.py)."""
+    directory = os.path.expanduser(directory)
+    os.makedirs(directory, exist_ok=True)
+    return SessionRecorder(os.path.join(
+        directory, f"{os.path.basename(session_vars['session_dir'])}.rashrec"))
 
-        # Read new stderr
-        try:
-            with sftp.open(stderr_file, "r") as f:
-                f.seek(stderr_seen)
-                new_stderr = f.read().decode()
-                if new_stderr:
-                    print(new_stderr, end="", flush=True, file=sys.stderr)
-                    stderr_seen += len(new_stderr.encode())
-        except FileNotFoundError:
-            pass
 
-        # Check if sentinel/status file exists (command finished)
-        try:
-            sftp.stat(sentinel_file)
-            break
-        except FileNotFoundError:
-            pass
+def close_session(session_vars: dict):
+    """
+    close_session - pack the session's remaining command files, then close its
+    background shells, SFTP clients, shell and connection
+    """
+    if 'session_store' in session_vars:
+        session_vars.pop('session_store').close()
+    if 'shell_pool' in session_vars:
+        session_vars.pop('shell_pool').close()
+    if 'state_cache' in session_vars:
+        session_vars.pop('state_cache').close()
+    if 'recorder' in session_vars:
+        session_vars.pop('recorder').close()
+    for client in session_vars['sftp_pool']:
+        client.close()
+    session_vars['channel'].close()
+    session_vars['ssh'].close()
+
+def read_requests(nbytes: int) -> int:
+    """SFTP READ requests paramiko issues for nbytes (it splits reads into 32 KiB requests)."""
+    return max(1, -(-nbytes // paramiko.SFTPFile.MAX_REQUEST_SIZE))
+
+
+class RemoteFileFollower:
+    """
+    Follow a growing remote file over one open SFTP handle, returning only
+    the bytes appended since the previous read.
+    """
 
-        time.sleep(poll_interval)
+    def __init__(self, sftp, path: str, threshold: int = LARGE_OUTPUT_THRESHOLD):
+        self.sftp = sftp
+        self.path = path
+        self.handle = None
+        self.seen = 0
+        self.requests = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.capture = OutputCapture(threshold)
+
+    def read_new(self, final_size: int|None = None) -> str:
+        """
+        Return newly appended text, or "" if nothing new (or not created yet).
+        With final_size (the file's known complete size) no fstat is needed,
+        and nothing is requested at all once that much has been read.
+        """
+        if final_size is not None and final_size <= self.seen:
+            return ""
+        if self.handle is None:
+            self.requests += 1
+            try:
+                self.handle = self.sftp.open(self.path, "r")
+            except FileNotFoundError:
+                return ""
+        # fstat first so an idle tick costs one request and a read is sized exactly;
+        # reads are capped so a burst of output never sits in memory all at once
+        if final_size is None:
+            size = self.handle.stat().st_size
+            self.requests += 1
+        else:
+            size = final_size
+        if size <= self.seen:
+            return ""
+        # readv pipelines all 32 KiB requests instead of one round trip each
+        data = b"".join(self.handle.readv([(self.seen, min(size - self.seen,
+                                                           STREAM_READ_CHUNK))]))
+        self.requests += read_requests(len(data))
+        self.seen += len(data)
+        self.capture.write(data)
+        return self.decoder.decode(data)
+
+    def close(self) -> str:
+        """Release the handle and flush any partial character."""
+        # dropping the last reference lets paramiko send CLOSE asynchronously
+        # (SFTPFile.__del__), keeping that round trip off the completion path
+        if self.handle is not None:
+            self.requests += 1
+        self.handle = None
+        return self.decoder.decode(b"", final=True)
+
+
+def print_output(stream: str, text: str):
+    """Default output consumer: echo stdout/stderr chunks to the local terminal."""
+    print(text, end="", flush=True, file=sys.stderr if stream == "stderr" else sys.stdout)
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def stream_command_output(sftp, stdout_file, stderr_file, watched: dict,
+                          on_output=print_output, threshold: int = LARGE_OUTPUT_THRESHOLD):
+    """
+    Stream stdout/stderr while command is running.
+
+    Both files stay open for the whole command and are read incrementally
+    (one SFTP client is not safe for concurrent requests, so they are read
+    in turn). Polling starts after STREAM_FIRST_POLL unless the command
+    has finished by then. The poll interval starts at STREAM_MIN_INTERVAL, doubles
+    while no new data arrives (up to STREAM_MAX_INTERVAL) and resets as
+    soon as output shows up.
+    Completion is signalled by watched['done'] (see watch_for_sentinel).
+    The files are then drained up to the final sizes reported on the
+    sentinel line, so a command whose output was already read costs no
+    more requests; without sizes they are read until nothing new
+    appears. Every byte read is also captured, so the complete
+    output is returned as {'stdout': ..., 'stderr': ...} without reading
+    the files again: a string, or a LargeOutput once it passes threshold
+    bytes. 'sftp_requests' and 'sftp_bytes' count
+    the traffic it took.
+    """
+    followers = {'stdout': RemoteFileFollower(sftp, stdout_file, threshold),
+                 'stderr': RemoteFileFollower(sftp, stderr_file, threshold)}
+    interval = STREAM_MIN_INTERVAL
+    try:
+        # quick commands finish within this; polling them would only queue
+        # SFTP requests ahead of the final drain
+        watched['done'].wait(STREAM_FIRST_POLL)
+        while not watched['done'].is_set():
+            got_data = False
+            for stream, follower in followers.items():
+                text = follower.read_new()
+                if text:
+                    on_output(stream, text)
+                    got_data = True
+            if got_data:
+                interval = STREAM_MIN_INTERVAL
+            else:
+                interval = min(interval * 2, STREAM_MAX_INTERVAL)
+            watched['done'].wait(interval)
+        sizes = final_output_sizes(watched)
+        for stream, follower in followers.items():
+            while True:
+                seen = follower.seen
+                text = follower.read_new(sizes.get(stream))
+                if text:
+                    on_output(stream, text)
+                if follower.seen == seen:
+                    break
+    finally:
+        for stream, follower in followers.items():
+            text = follower.close()
+            if text:
+                on_output(stream, text)
+    captured: dict[str, Any] = {stream: follower.capture.finish()
+                                for stream, follower in followers.items()}
+    captured['sftp_requests'] = sum(follower.requests for follower in followers.values())
+    captured['sftp_bytes'] = sum(follower.seen for follower in followers.values())
+    return captured
+
+
+def final_output_sizes(watched: dict) -> dict[str, int]:
+    """
+    stdout/stderr sizes from a streamed command's sentinel line
+    ('__DONE_N__ rc out err snapshot...').
+    """
+    fields = watched.get('fields', [])[:3]
+    if len(fields) == 3 and all(field.isdigit() for field in fields):
+        return {'stdout': int(fields[1]), 'stderr': int(fields[2])}
+    return {}
 
 
 def read_channel_with_timeout(channel, sentinel, timeout=5.0):
-    """Read from channel until no more data or timeout expires."""
-    start_time = time.time()
-    buffer = ""
-    while True:
-        if channel.recv_ready():
-            buffer += channel.recv(4096).decode()
-            start_time = time.time()  # reset timeout after new data
-            if sentinel in buffer:
-                return buffer
-        elif time.time() - start_time > timeout:
-            break
-        else:
-            time.sleep(0.05)
-    return buffer
+    """
+    Read from channel (through its ChannelReader) until the sentinel line
+    arrives or no data comes for timeout seconds; return the text read.
+    """
+    reader = reader_for(channel)
+    done, watched = reader.watch(sentinel)
+    seen = -1
+    while not done.wait(timeout) and watched['bytes'] != seen:
+        seen = watched['bytes']
+    reader.unwatch(watched)
+    return watched['buffer']
+
+
+def update_rtt(session_vars: dict, sample: float):
+    """Fold one round-trip sample into the session's smoothed RTT (as TCP does)."""
+    rtt = session_vars.get('rtt')
+    session_vars['rtt'] = sample if rtt is None else 0.875 * rtt + 0.125 * sample
+
+
+def channel_timeout(session_vars: dict) -> float:
+    """How long a channel may stay silent before liveness is checked, scaled by RTT."""
+    rtt = session_vars.get('rtt') or 0.0
+    return min(CHANNEL_TIMEOUT_MAX, max(CHANNEL_TIMEOUT_MIN, CHANNEL_TIMEOUT_RTTS * rtt))
+
+
+def watch_for_sentinel(channel, sentinel, timeout: float = 0.1, echo: str|None = None,
+                       keep_text: bool = True) -> tuple[threading.Event, dict]:
+    """
+    Watch the shell channel (through its background ChannelReader) and set
+    the returned event once the whole sentinel line has arrived (or the
+    channel or its transport closes). The returned dict holds the channel
+    text read meanwhile under 'buffer' (with keep_text, once done), the
+    event under 'done', the words after the sentinel under 'fields', whether
+    it arrived under 'found', the bytes read under 'bytes' and the
+    perf_counter time at which the text `echo` first appeared under
+    'echoed'. The transport is checked whenever the channel is silent for
+    timeout sec.
+    """
+    return reader_for(channel, timeout).watch(sentinel, echo=echo, keep_text=keep_text)
 
 class ShellTest(TypedDict):
     """
@@ -194,10 +434,22 @@ class ShellTest(TypedDict):
     expected_exit: int
     expected_stdout: Optional[str]
     expected_stderr: Optional[str]
+    # checked against the shell state snapshot taken with the command
+    expected_cwd: Optional[str]
+    expected_env: Optional[dict[str, str]]
 
-def formulate_command(command:str, session_dir: str, cmd_number: int) -> dict:
+def formulate_command(command:str, session_dir: str, cmd_number: int,
+                      framed: bool = False, save_state: bool = True) -> dict:
     """
     formulate_command - resolve paths of history/output files and write command strings
+
+    With framed=True the exec line also echoes stdout, stderr (base64, so the
+    pty cannot mangle them) and the exit status back on the shell channel
+    between per-command markers; see parse_framed_results.
+    With save_state=True the shell's exported env and cwd are saved as a
+    sourceable script (SHELL_STATE_FILE) after the command, for ShellPool,
+    and a snapshot of what changed is appended to the sentinel line (see
+    shell_state.py).
     """
     hist_file   = f"{session_dir}/history-cmd{cmd_number}"
     stdout_file = f"{session_dir}/stdout-cmd{cmd_number}"
@@ -205,24 +457,326 @@ def formulate_command(command:str, session_dir: str, cmd_number: int) -> dict:
     status_file = f"{session_dir}/status-cmd{cmd_number}"
     sentinel    = f"__DONE_{cmd_number}__"
 
-    # Write the user command to history
-    escaped_cmd = command.replace('"', '\\"')
-    history_cmd = f'echo "{escaped_cmd}" > {hist_file}\n'
-
-
-    exec_cmd = ''.join([ f"source {hist_file} > {stdout_file}",
-                         f" 2> {stderr_file}; ",
-                         f"echo $? > {status_file}; ",
-                         f"echo {sentinel}\n"])
+    # Write the user command to history; single-quoted so nothing is expanded until it is sourced
+    history_cmd = f"printf '%s\\n' {shlex.quote(command)} > {hist_file}\n"
+
+
+    state_cmd, snapshot = "", ""
+    if save_state:
+        state_cmd = f"__rash_snapshot {session_dir}/{SHELL_STATE_FILE}; "
+        snapshot = " \"$__rash_snap\""
+
+    if framed:
+        # markers are assembled by printf so the pty echo of this line never matches them
+        exec_cmd = ''.join([ f"source {hist_file} > {stdout_file}",
+                             f" 2> {stderr_file}; ",
+                             "__rash_rc=$?; ",
+                             f"echo $__rash_rc > {status_file}; ",
+                             state_cmd,
+                             f"printf '__RASH_OUT_%s__\\n' {cmd_number}; ",
+                             f"base64 < {stdout_file}; ",
+                             f"printf '__RASH_ERR_%s__\\n' {cmd_number}; ",
+                             f"base64 < {stderr_file}; ",
+                             f"printf '__RASH_RC_%s__ %s\\n' {cmd_number} $__rash_rc; ",
+                             f"printf '__DONE_%s__ %s\\n' {cmd_number}{snapshot or ' -'}\n"])
+    else:
+        # the sentinel line carries the exit status and final output sizes,
+        # so nothing has to be fetched once it arrives
+        exec_cmd = ''.join([ f"source {hist_file} > {stdout_file}",
+                             f" 2> {stderr_file}; ",
+                             "__rash_rc=$?; ",
+                             f"echo $__rash_rc > {status_file}; ",
+                             state_cmd,
+                             # printf keeps the literal sentinel out of the pty echo
+                             f"printf '__DONE_%s__ %s %s %s %s\\n' {cmd_number} $__rash_rc ",
+                             f"$(wc -c < {stdout_file}) $(wc -c < {stderr_file})",
+                             f"{snapshot or ' -'}\n"])
 
     return {'history': history_cmd.encode(),
             'exec': exec_cmd.encode(),
+            'history_file': hist_file,
             'stdout_file': stdout_file,
             'stderr_file': stderr_file,
             'status_file': status_file,
-            'sentinel': sentinel
+            'sentinel': sentinel,
+            'cmd_number': cmd_number
             }
 
+def decode_frame(buffer: str, span: tuple[int, int],
+                 threshold: int = LARGE_OUTPUT_THRESHOLD) -> str|LargeOutput:
+    """
+    Decode the base64 frame at buffer[span[0]:span[1]] FRAME_DECODE_CHUNK
+    characters at a time into an OutputCapture, so output past threshold
+    bytes is spilled as it is decoded rather than held twice in memory.
+    """
+    capture = OutputCapture(threshold)
+    pending = ""
+    for start in range(span[0], span[1], FRAME_DECODE_CHUNK):
+        # the pty turns newlines into \r\n; base64 ignores neither, so drop all whitespace
+        pending += re.sub(r"\s", "", buffer[start:min(start + FRAME_DECODE_CHUNK, span[1])])
+        usable = len(pending) - len(pending) % 4
+        capture.write(base64.b64decode(pending[:usable]))
+        pending = pending[usable:]
+    capture.write(base64.b64decode(pending))
+    return capture.finish()
+
+
+def parse_framed_results(buffer: str, cmd_number: int, threshold: int = LARGE_OUTPUT_THRESHOLD
+                         ) -> tuple[str|LargeOutput, str|LargeOutput, int|None]:
+    """
+    parse_framed_results - extract (stdout, stderr, exit status) from the
+    channel text produced by a framed exec line for cmd_number. Outputs past
+    threshold bytes come back as LargeOutput handles.
+    """
+    frames = re.search(rf"__RASH_OUT_{cmd_number}__(.*?)"
+                       rf"__RASH_ERR_{cmd_number}__(.*?)"
+                       rf"__RASH_RC_{cmd_number}__ (\d+)", buffer, re.DOTALL)
+    if frames is None:
+        return "", "", None
+    return (decode_frame(buffer, frames.span(1), threshold),
+            decode_frame(buffer, frames.span(2), threshold), int(frames.group(3)))
+
+
+def emit_output(on_output, stream: str, output: str|LargeOutput):
+    """Pass a whole output to on_output: a string at once, a LargeOutput page by page."""
+    if isinstance(output, str):
+        on_output(stream, output)
+        return
+    for text in output.chunks():
+        on_output(stream, text)
+
+
+def run_framed(channel, commands: dict, on_output=print_output,
+               threshold: int = LARGE_OUTPUT_THRESHOLD
+               ) -> tuple[str|LargeOutput, str|LargeOutput, int|None, dict[str, float]]:
+    """
+    Send history and exec lines together and collect the results inline from
+    the shell channel. The shell runs input lines in order, so no pause is
+    needed between them, and no SFTP request is made. The base64 text of the
+    whole output is held in the channel buffer until the command ends, so
+    this suits short outputs; decoded outputs past threshold bytes are
+    spilled to LargeOutput handles like streamed ones.
+    Phases: send, wait (for the sentinel), parse.
+    """
+    metrics = commands['metrics']
+    start = time.perf_counter()
+    done, watched = watch_for_sentinel(channel, commands['sentinel'])
+    channel.send(commands['history'] + commands['exec'])
+    start = end_phase(metrics, 'send', start)
+    done.wait()
+    start = end_phase(metrics, 'wait', start)
+    if commands['sentinel'] not in watched['buffer']:
+        print("[WARNING] Channel closed before the command finished")
+    stdout_text, stderr_text, exit_status = parse_framed_results(watched['buffer'],
+                                                                 commands['cmd_number'], threshold)
+    end_phase(metrics, 'parse', start)
+    metrics['channel_bytes'] = watched['bytes']
+    commands['snapshot'] = watched['fields']
+    emit_output(on_output, 'stdout', stdout_text)
+    emit_output(on_output, 'stderr', stderr_text)
+    stdout_text, stderr_text = (text.strip() if isinstance(text, str) else text
+                                for text in (stdout_text, stderr_text))
+    return stdout_text, stderr_text, exit_status, {}
+
+
+def run_streamed(session_vars: dict, commands: dict,
+                 on_output=print_output) -> tuple[str|LargeOutput, str|LargeOutput,
+                                                  int|None, dict[str, float]]:
+    """
+    Send history and exec lines together, stream output over SFTP while the
+    command runs and take the exit status and final output sizes from the
+    sentinel line. The shell reads its input lines in order, so the history
+    file is written before it is sourced without waiting in between.
+    stdout/stderr are what the stream captured (strings, or LargeOutput
+    handles when large). The status file is only fetched if the sentinel
+    line is incomplete; the last item returned is its arrival time (sec).
+    Phases: send, stream (until the sentinel and the final drain), status.
+    """
+    channel = session_vars['channel']
+    metrics = commands['metrics']
+
+    # Write history and execute; the sentinel on the channel marks completion
+    start = time.perf_counter()
+    done, watched = watch_for_sentinel(channel, commands['sentinel'],
+                                       timeout=channel_timeout(session_vars),
+                                       # the end of the exec line, as the pty echoes it
+                                       echo=f"-cmd{commands['cmd_number']})",
+                                       # everything needed is in the sentinel line
+                                       keep_text=False)
+    channel.send(commands['history'] + commands['exec'])
+    sent = start = end_phase(metrics, 'send', start)
+
+    # Stream output while running; what was streamed is the final output
+    captured = stream_command_output(session_vars['sftp'], commands['stdout_file'],
+                                     commands['stderr_file'], watched, on_output,
+                                     large_output_threshold(session_vars))
+    start = end_phase(metrics, 'stream', start)
+    if not done.is_set() or not watched['found']:
+        print("[WARNING] Channel closed before the command finished")
+    if watched['echoed'] is not None:
+        # the pty echoes the exec line back one round trip after it was sent
+        update_rtt(session_vars, watched['echoed'] - sent)
+
+    file_reads = {}
+    commands['snapshot'] = watched['fields'][3:]
+    if final_output_sizes(watched):
+        exit_status = int(watched['fields'][0])
+    else:
+        exit_status = fetch_exit_status(session_vars, commands)
+        end_phase(metrics, 'status', start)
+        file_reads['status'] = time.perf_counter() - start
+    metrics['sftp_requests'] += captured['sftp_requests']
+    metrics['sftp_bytes'] += captured['sftp_bytes']
+    metrics['channel_bytes'] = watched['bytes']
+    stdout_text, stderr_text = (text.strip() if isinstance(text, str) else text
+                                for text in (captured['stdout'], captured['stderr']))
+    return stdout_text, stderr_text, exit_status, file_reads
+
+
+def fetch_exit_status(session_vars: dict, commands: dict) -> int|None:
+    """Read a command's status file (fallback when its sentinel line is incomplete)."""
+    status = read_remote_files([session_vars['sftp']],
+                               [commands['status_file']])[commands['status_file']]
+    commands['metrics']['sftp_requests'] += status['requests']
+    commands['metrics']['sftp_bytes'] += status['size']
+    try:
+        return int(status['text'].strip())
+    except ValueError:
+        return None
+
+
+class CommandResult(TypedDict):
+    """
+    Outcome of one command run through execute_command. Outputs past
+    LARGE_OUTPUT_THRESHOLD are LargeOutput handles rather than strings.
+    """
+    cmd_number: int
+    command: str
+    stdout: str|LargeOutput
+    stderr: str|LargeOutput
+    exit_status: int|None
+    duration: float
+    file_reads: dict[str, float]
+    metrics: CommandMetrics
+    # shell state after the command (None without a snapshot, e.g. background jobs)
+    state: StateChange|None
+
+
+def execute_command(cmd_number: int, session_vars: dict, command: str,
+                    on_output=print_output) -> CommandResult:
+    """
+    execute_command - run one command in the session's shell and return its results.
+    Output is passed to on_output(stream, text) as it arrives.
+    """
+    # transfer user command to history file, make 'source' command
+    framed = session_vars.get('framed', False)
+    commands = formulate_command(command, session_vars['session_dir'], cmd_number,
+                                 framed=framed,
+                                 save_state=session_vars.get('save_state', True))
+    commands['metrics'] = new_metrics()
+    recorder = session_vars.get('recorder')
+    if recorder is not None:
+        recorder.command_started(cmd_number, command)
+        on_output = recorder.tee(cmd_number, on_output)
+
+    start_time = time.time()
+    if framed:
+        stdout_text, stderr_text, exit_status, file_reads = run_framed(
+            session_vars['channel'], commands, on_output, large_output_threshold(session_vars))
+    else:
+        stdout_text, stderr_text, exit_status, file_reads = run_streamed(session_vars, commands,
+                                                                         on_output)
+    result: CommandResult = {'cmd_number': cmd_number,
+                             'command': command,
+                             'stdout': stdout_text,
+                             'stderr': stderr_text,
+                             'exit_status': exit_status,
+                             'duration': time.time() - start_time,
+                             'file_reads': file_reads,
+                             'metrics': commands['metrics'],
+                             'state': apply_snapshot(session_vars, cmd_number,
+                                                     commands.get('snapshot', []))}
+    record_result(session_vars, result)
+    return result
+
+
+def large_output_threshold(session_vars: dict) -> int:
+    """Bytes of one output stream kept in memory before it is spilled (see large_output.py)."""
+    return session_vars.get('large_output_threshold', LARGE_OUTPUT_THRESHOLD)
+
+
+def apply_snapshot(session_vars: dict, cmd_number: int,
+                   fields: list[str]) -> StateChange|None:
+    """Fold a command's state snapshot into the session's ShellState model."""
+    if session_vars.get('shell_state') is None or not session_vars.get('save_state', True):
+        return None
+    return session_vars['shell_state'].apply(cmd_number, fields)
+
+
+def record_result(session_vars: dict, result: CommandResult):
+    """
+    Add a finished command to the history cache, metrics and recording, hand
+    its files to retention and let the state cache drop what it may have changed.
+    """
+    if session_vars.get('history_cache') is not None:
+        session_vars['history_cache'].add(os.path.basename(session_vars['session_dir']), result)
+    if session_vars.get('metrics') is not None:
+        session_vars['metrics'].record(os.path.basename(session_vars['session_dir']), result)
+    if session_vars.get('recorder') is not None:
+        session_vars['recorder'].command_finished(result)
+    if session_vars.get('session_store') is not None:
+        session_vars['session_store'].command_finished(result['cmd_number'])
+    if session_vars.get('state_cache') is not None:
+        session_vars['state_cache'].command_finished(result['command'], result.get('state'))
+
+
+def print_result_summary(result: CommandResult):
+    """Print the byte counts, exit status and timings of a finished command."""
+    print(f"STDOUT[{len(result['stdout'])} bytes]")
+    print(f"STDERR[{len(result['stderr'])} bytes]")
+    print(f"Exit status: {result['exit_status']}")
+    print(f"Duration (including file reads): {result['duration']:.2f} sec")
+    if result['file_reads']:
+        print("File reads: " + ", ".join(f"{key} {elapsed * 1000:.1f} ms"
+                                         for key, elapsed in result['file_reads'].items()))
+    metrics = result['metrics']
+    if metrics['phases']:
+        print("Phases: " + ", ".join(f"{name} {seconds * 1000:.1f} ms"
+                                     for name, seconds in metrics['phases'].items()))
+    print(f"Traffic: {metrics['sftp_requests']} SFTP requests, {metrics['sftp_bytes']} SFTP bytes, "
+          f"{metrics['channel_bytes']} channel bytes")
+    state = result.get('state')
+    if state is not None:
+        changed = ", ".join(f"{name}={value}" if value is not None else f"-{name}"
+                            for name, value in state['changed'].items())
+        print(f"Shell: cwd {state['cwd']}, {state['jobs']} jobs"
+              + (f", changed {changed}" if changed and len(changed) < 200 else ""))
+
+
+def check_shell_test(test: ShellTest, result: CommandResult) -> list[str]:
+    """
+    check_shell_test - compare a command's results against a ShellTest's
+    expectations and return the failure messages (empty if it passed).
+    """
+    tested = defaultdict(lambda: None, test)
+    failures = []
+    if tested['expected_exit'] is not None and result['exit_status'] != tested['expected_exit']:
+        failures.append(f"Expected exit status {tested['expected_exit']}, "
+                        f"got {result['exit_status']}")
+    if tested['expected_stdout'] is not None and tested['expected_stdout'] not in result['stdout']:
+        failures.append(f"Expected stdout to contain: {tested['expected_stdout']}")
+    if tested['expected_stderr'] is not None and tested['expected_stderr'] not in result['stderr']:
+        failures.append(f"Expected stderr to contain: {tested['expected_stderr']}")
+    state = result.get('state')
+    if tested['expected_cwd'] is not None and \
+            (state is None or not (state['cwd'] or "").endswith(tested['expected_cwd'])):
+        failures.append(f"Expected cwd to end with: {tested['expected_cwd']}")
+    for name, value in (tested['expected_env'] or {}).items():
+        if state is None or state['environment'].get(name) != value:
+            failures.append(f"Expected {name} to be set to: {value}")
+    return failures
+
+
 # --- Run command using source history-cmd# ---
 def run_command(
     cmd_number:int,
@@ -233,75 +787,170 @@ def run_command(
     """
     Basic function for running a command
     """
-
-    channel = session_vars['channel']
-    sftp = session_vars['sftp']
-
     if test is not None:
         print(f"\n--- Test #{cmd_number}: {test['desc']} ---")
 
-    # transfer user command to history file, make 'source' command
-    commands = formulate_command(command, session_vars['session_dir'], cmd_number)
-
-    # write history
-    channel.send(commands['history'])
-    time.sleep(.05)
-
-    # Execute the command
-    start_time = time.time()
-    channel.send(commands['exec'])
-
-    # Stream output while running
-    stream_command_output(sftp, commands['stdout_file'],
-                          commands['stderr_file'],
-                          commands['status_file'])
-
-    # Wait until sentinel appears in the channel
-    timeout=10.0
-    #command_timedout = False
-    buffer = read_channel_with_timeout(channel, commands['sentinel'], timeout=timeout)
-    if commands['sentinel'] not in buffer:
-        print(f"[WARNING] Command output exceeded {timeout}")
-        #command_timedout = True
-
-    # Read outputs
-    stdout_text = read_remote_file(sftp, commands['stdout_file']).strip()
-    stderr_text = read_remote_file(sftp, commands['stderr_file']).strip()
-    try:
-        exit_status = int(read_remote_file(sftp, commands['status_file']).strip())
-    except ValueError:
-        exit_status = None
+    result = execute_command(cmd_number, session_vars, command)
 
     # Always print main outputs
-    print(f"STDOUT[{len(stdout_text)} bytes]")
-    print(f"STDERR[{len(stderr_text)} bytes]")
-    print(f"Exit status: {exit_status}")
-    print(f"Duration (including file reads): {time.time() - start_time:.2f} sec")
+    print_result_summary(result)
 
     # --- Automatic pass/fail checks (verbose) ---
     if test is not None:
-        tested = defaultdict(lambda: None, test)
-        test_passed = True
-        if tested['expected_exit'] is not None and exit_status != tested['expected_exit']:
-            test_passed = False
-            print(f"FAIL: Expected exit status {tested['expected_exit']}, got {exit_status}")
-        if tested['expected_stdout'] is not None and tested['expected_stdout'] not in stdout_text:
-            test_passed = False
-            print(f"FAIL: Expected stdout to contain: {tested['expected_stdout']}")
-        if tested['expected_stderr'] is not None and tested['expected_stderr'] not in stderr_text:
-            test_passed = False
-            print(f"FAIL: Expected stderr to contain: {tested['expected_stderr']}")
-        if test_passed:
+        failures = check_shell_test(test, result)
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        if not failures:
             print("PASS")
 
     return cmd_number + 1
 
 
+class ShellPool:
+    """
+    Extra persistent shells, multiplexed over the session's transport, for
+    running commands in the background while the primary shell stays free.
+
+    Each pooled shell gets its own SFTP client, since one client cannot
+    serve two commands at once. Before every command a pooled shell sources
+    a copy of the primary shell's saved cwd and exported environment (see
+    formulate_command's save_state) taken when the command was submitted,
+    so it runs where the user was then, even if the job waits for a free
+    shell. Background commands do not change the primary shell's state.
+    """
+
+    def __init__(self, session_vars: dict, size: int = SHELL_POOL_SIZE):
+        self.session_vars = session_vars
+        self.size = size
+        self.lanes: list[dict] = []
+        self.idle: queue.Queue[dict] = queue.Queue()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self.jobs: dict[int, Future] = {}
+
+    def open_lane(self) -> dict:
+        """Open one more shell + SFTP client on the primary transport."""
+        transport = self.session_vars['ssh'].get_transport()
+        channel = transport.open_session()
+        channel.get_pty()
+        channel.invoke_shell()
+        channel.settimeout(0.1)
+        reader_for(channel)
+        sftp = self.session_vars['ssh'].open_sftp()
+        lane = dict(self.session_vars)
+        lane.update({'channel': channel, 'sftp': sftp, 'save_state': False})
+        return lane
+
+    def acquire(self) -> dict:
+        """
+        Take an idle shell, opening a new one while below the pool size.
+        Shells whose connection dropped are discarded and replaced.
+        """
+        while True:
+            with self.lock:
+                if self.idle.empty() and len(self.lanes) < self.size:
+                    lane = self.open_lane()
+                    self.lanes.append(lane)
+                    return lane
+            try:
+                # timeout: a shell may be discarded, freeing a slot, while waiting
+                lane = self.idle.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if not lane['channel'].closed:
+                return lane
+            self.discard(lane)
+
+    def release(self, lane: dict):
+        """Return a shell to the pool, or discard it if its connection dropped."""
+        if lane['channel'].closed:
+            self.discard(lane)
+        else:
+            self.idle.put(lane)
+
+    def discard(self, lane: dict):
+        """Forget a dead shell so that acquire opens a new one on the current transport."""
+        with self.lock:
+            self.lanes = [other for other in self.lanes if other is not lane]
+        try:
+            lane['sftp'].close()
+        except CONNECTION_ERRORS:
+            pass
+
+    def run_job(self, cmd_number: int, command: str) -> CommandResult:
+        """Sync a pooled shell to the state saved for this job and run command on it."""
+        lane = self.acquire()
+        try:
+            state_file = f"{self.session_vars['session_dir']}/{SHELL_STATE_FILE}-cmd{cmd_number}"
+            lane['channel'].send(f"source {state_file} > /dev/null 2>&1; "
+                                 f"rm -f {state_file}\n".encode())
+            return execute_command(cmd_number, lane, command, on_output=lambda stream, text: None)
+        finally:
+            self.release(lane)
+
+    def save_state(self, cmd_number: int):
+        """
+        Copy the primary shell's saved state for one job (one exec round
+        trip), since the user may cd or export before a shell is free.
+        """
+        state_file = f"{self.session_vars['session_dir']}/{SHELL_STATE_FILE}"
+        # no state file yet (no command has run): the job starts where the shell logged in
+        _, stdout, _ = self.session_vars['ssh'].exec_command(
+            f"cp {state_file} {state_file}-cmd{cmd_number} 2>/dev/null "
+            f"|| : > {state_file}-cmd{cmd_number}")
+        stdout.channel.recv_exit_status()
+
+    def submit(self, cmd_number: int, command: str) -> Future:
+        """
+        Schedule command on the next idle shell, in the primary shell's
+        state as of now; the future yields a CommandResult.
+        """
+        self.save_state(cmd_number)
+        future = self.executor.submit(self.run_job, cmd_number, command)
+        self.jobs[cmd_number] = future
+        return future
+
+    def close(self):
+        """Wait for running jobs and close the pooled shells."""
+        self.executor.shutdown(wait=True)
+        for lane in self.lanes:
+            lane['sftp'].close()
+            lane['channel'].close()
+
+
+class Connection(TypedDict):
+    """
+    Everything needed to log in again without asking the user: the loaded key
+    (or SSH agent key) or the password
+    """
+    host: str
+    port: int
+    username: str
+    pkey: paramiko.PKey|paramiko.AgentKey|None
+    password: str|None
+
+
 def open_connection(host:str,
                username:str,
-               private_key_path:str|None) -> tuple[paramiko.Channel, paramiko.SSHClient]:
+               private_key_path:str|None,
+               password:str|None = None,
+               port:int = 22) -> tuple[paramiko.Channel, paramiko.SSHClient]:
     """
     open_connection - connect using password or key file
+    The password is prompted for when no key is usable and none is given.
+    """
+    return connect(resolve_connection(host, username, private_key_path, password, port))
+
+
+def resolve_connection(host:str,
+                       username:str,
+                       private_key_path:str|None,
+                       password:str|None = None,
+                       port:int = 22) -> Connection:
+    """
+    resolve_connection - load the key (from the SSH agent if it is
+    passphrase-protected and the agent holds it) or ask for the password,
+    once, so that connect() can log in again later without prompting.
     """
     # --- SSH key authentication ---
     #key_file = os.path.expanduser("~/.ssh/id_rsa")
@@ -322,18 +971,32 @@ def open_connection(host:str,
                 pkey = paramiko.Ed25519Key.from_private_key_file(private_key_path,
                                                                  password=passphrase)
 
+    if not pkey and password is None:
+        password = getpass.getpass("Password (no pkey): ")
+    return {'host': host, 'port': port, 'username': username,
+            'pkey': pkey or None, 'password': None if pkey else password}
+
+
+def connect(connection: Connection) -> tuple[paramiko.Channel, paramiko.SSHClient]:
+    """
+    connect - log in with resolved credentials and open the persistent shell
+    """
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    if pkey:
-        ssh.connect(host, username=username, pkey=pkey)
+    if connection['pkey']:
+        ssh.connect(connection['host'], port=connection['port'],
+                    username=connection['username'], pkey=connection['pkey'])
     else:
-        password = getpass.getpass("Password (no pkey): ")
-        ssh.connect(host, username=username, password=password)
+        ssh.connect(connection['host'], port=connection['port'],
+                    username=connection['username'], password=connection['password'])
 
     # --- Open persistent shell ---
     transport = ssh.get_transport()
     if transport is None:
         raise AttributeError("Ssh was unable to get_transport()")
+    # small pipelined SFTP requests must not wait on Nagle's algorithm
+    transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    transport.set_keepalive(KEEPALIVE_INTERVAL)
 
     channel = transport.open_session()
     channel.get_pty()
@@ -342,55 +1005,315 @@ def open_connection(host:str,
     return channel, ssh
 
 
-def initialize_session(channel:paramiko.Channel, ssh:paramiko.SSHClient) -> dict[str, Any]:
+def detect_prompt(channel, timeout: float = 5.0) -> str:
     """
-    initialize_session - Initialize backend setup after successful login.
+    Return the shell's rendered prompt: print a marker line and take what the
+    shell writes after it. Waits on the channel, not on fixed sleeps.
+    """
+    # printf assembles the marker so its echo on the pty does not match
+    channel.send("printf '__RASH_%s__\\n' PROMPT\n".encode())
+    # read directly: the channel's ChannelReader is only started once this is done
+    buffer = bytearray()
+    # the marker's newline, then the prompt (which has none)
+    while not (after := buffer.partition(b"__RASH_PROMPT__")[2]).strip(b"\r\n"):
+        readable, _, _ = select.select([channel], [], [], timeout)
+        data = channel.recv(4096) if readable else b""
+        if not data:
+            break
+        buffer += data
+    return after.decode(errors="replace").strip()
+
+
+def create_session_dir(ssh, session_name: str) -> tuple[str, str]:
+    """
+    Create ~/.rash/<session_name> and discover the home directory with a
+    single exec request. Returns (home_dir, session_dir).
     """
-    # --- Detect server prompt ---
-    time.sleep(0.2)
-    channel.send('echo "$PS1"\n'.encode())
-    time.sleep(0.2)
-    ps1_output = ""
-    while channel.recv_ready():
-        ps1_output += channel.recv(4096).decode()
-    server_prompt = ps1_output.strip().splitlines()[-1]
-
-    # --- Determine remote home directory ---
-    _, stdout, _ = ssh.exec_command("echo $HOME")
+    _, stdout, _ = ssh.exec_command(f"cd && mkdir -p .rash/{session_name} && echo \"$HOME\"")
     home_dir = stdout.read().decode().strip()
     if not home_dir:
         raise RuntimeError("Could not determine remote home directory.")
+    return home_dir, f"{home_dir}/.rash/{session_name}"
+
+
+def initialize_session(channel:paramiko.Channel, ssh:paramiko.SSHClient) -> dict[str, Any]:
+    """
+    initialize_session - Initialize backend setup after successful login.
 
-    # --- Create session directory ---
+    See attach_session for the setup itself. The seconds taken are returned
+    under 'startup'.
+    """
+    start_time = time.perf_counter()
     timestamp = datetime.now().strftime("%Y-%m-%d-%H%M-%S")
-    session_dir = f"{home_dir}/.rash/session-{timestamp}"
-    channel.send(f"mkdir -p {session_dir}\n".encode())
-    time.sleep(0.1)
-    print(f"Session directory: {session_dir}")
+    # suffix keeps sessions started in the same second (fan-out, async) apart
+    session_name = f"session-{timestamp}-{secrets.token_hex(3)}"
+    session_vars = attach_session(channel, ssh, session_name)
+    print(f"Session directory: {session_vars['session_dir']}")
+
+    # packs finished commands' files in the background (retention.py)
+    session_vars['session_store'] = SessionStore(ssh, session_vars['session_dir'])
+    # the shell's cwd/environment as of the last command (shell_state.py)
+    session_vars['shell_state'] = ShellState()
+    session_vars['startup'] = time.perf_counter() - start_time
+    return session_vars
 
-    # --- SFTP for reading files efficiently ---
-    sftp = ssh.open_sftp()
 
-    return {'sftp':sftp,
+def attach_session(channel:paramiko.Channel, ssh:paramiko.SSHClient,
+                   session_name: str) -> dict[str, Any]:
+    """
+    attach_session - set up ~/.rash/<session_name> (new or existing) on a
+    fresh connection.
+
+    The independent steps (prompt detection on the shell, home directory
+    discovery plus session directory creation in one exec request, opening
+    the SFTP client) run at the same time, so this costs about as many
+    round trips as the slowest of them. More SFTP clients are only opened
+    when something needs them (fetch_pool).
+    """
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        # --- Detect server prompt ---
+        prompt = pool.submit(detect_prompt, channel)
+        # --- Determine remote home directory and create session directory ---
+        directories = pool.submit(create_session_dir, ssh, session_name)
+        # --- SFTP for reading files efficiently ---
+        sftp = pool.submit(ssh.open_sftp)
+        home_dir, session_dir = directories.result()
+        server_prompt = prompt.result()
+    # used by every save_state command (shell_state.py)
+    channel.send(SNAPSHOT_FUNCTION.encode())
+    # drain the shell from now on, between commands too
+    reader_for(channel)
+
+    return {'sftp': sftp.result(),
+            'sftp_pool': [sftp.result()],
             'session_dir': session_dir,
             'home_dir': home_dir,
             'server_prompt': server_prompt,
             'channel':channel,
             'ssh':ssh}
 
+
+def fetch_pool(session_vars: dict) -> list:
+    """
+    The session's FETCH_PARALLELISM SFTP clients (the first is
+    session_vars['sftp']), opening the extra ones on first use.
+    """
+    sftp_pool = session_vars['sftp_pool']
+    if len(sftp_pool) < FETCH_PARALLELISM:
+        with ThreadPoolExecutor(max_workers=FETCH_PARALLELISM) as pool:
+            opened = [pool.submit(session_vars['ssh'].open_sftp)
+                      for _ in range(FETCH_PARALLELISM - len(sftp_pool))]
+            sftp_pool += [future.result() for future in opened]
+    return sftp_pool
+
+
+def connection_alive(session_vars: dict) -> bool:
+    """True while the session's transport and primary shell are still up."""
+    transport = session_vars['ssh'].get_transport()
+    return transport is not None and transport.is_active() and not session_vars['channel'].closed
+
+
+def connection_dropped(session_vars: dict) -> bool:
+    """
+    After a command failed with one of CONNECTION_ERRORS: True if its
+    connection is down. connection_alive() alone cannot tell yet, because
+    paramiko's transport thread closes the channels (failing the command)
+    before it marks itself inactive, so this waits up to DROP_SETTLE_SECONDS
+    for that thread to finish.
+    """
+    transport = session_vars['ssh'].get_transport()
+    if transport is not None and transport.is_alive():
+        transport.join(DROP_SETTLE_SECONDS)
+    return not connection_alive(session_vars)
+
+
+def reconnect_session(session_vars: dict):
+    """
+    reconnect_session - replace a dropped connection and re-attach to the
+    same session directory: new transport, shell and SFTP clients (in place
+    in session_vars), with the shell's saved cwd and exported environment
+    replayed. Command numbering, history cache, metrics and retention carry
+    on. Raises ConnectionError if every attempt fails.
+    """
+    connection = session_vars.get('connection')
+    if connection is None:
+        raise ConnectionError("Connection lost and no login details to reconnect with")
+    start_time = time.perf_counter()
+    for client in session_vars['sftp_pool']:
+        try:
+            client.close()
+        except CONNECTION_ERRORS:
+            # its transport is already gone
+            pass
+    session_vars['ssh'].close()
+
+    attached = attach_with_retries(connection, os.path.basename(session_vars['session_dir']))
+    session_vars.update(attached)
+    if session_vars.get('session_store') is not None:
+        session_vars['session_store'].ssh = attached['ssh']
+    state_file = f"{session_vars['session_dir']}/{SHELL_STATE_FILE}"
+    session_vars['channel'].send(f"source {state_file} > /dev/null 2>&1\n".encode())
+
+    elapsed = time.perf_counter() - start_time
+    print(f"[reconnected in {elapsed:.2f} sec]", file=sys.stderr)
+    if session_vars.get('metrics') is not None:
+        session_vars['metrics'].emit({'event': "reconnect", 'time': time.time(),
+                                      'session': os.path.basename(session_vars['session_dir']),
+                                      'seconds': elapsed})
+
+
+def attach_with_retries(connection: Connection, session_name: str) -> dict[str, Any]:
+    """Connect and attach_session, retrying RECONNECT_ATTEMPTS times with doubling pauses."""
+    delay = RECONNECT_DELAY
+    for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+        try:
+            channel, ssh = connect(connection)
+            return attach_session(channel, ssh, session_name)
+        except CONNECTION_ERRORS as e:
+            print(f"[reconnect] attempt {attempt} failed: {e}", file=sys.stderr)
+            if attempt < RECONNECT_ATTEMPTS:
+                time.sleep(delay)
+                delay *= 2
+    raise ConnectionError(f"Could not reconnect after {RECONNECT_ATTEMPTS} attempts")
+
+
+def ensure_connected(session_vars: dict):
+    """Reconnect first if the session's connection has dropped (e.g. while idle)."""
+    if not connection_alive(session_vars):
+        print("[WARNING] Connection lost; reconnecting", file=sys.stderr)
+        reconnect_session(session_vars)
+
+
+def recover_command(session_vars: dict, cmd_number: int) -> CommandResult|None:
+    """
+    recover_command - result of a command whose outcome was lost with the
+    connection, read back from its files once reconnected. None if it never
+    finished (its status file is missing). The duration is unknown (0).
+    """
+    commands = formulate_command("", session_vars['session_dir'], cmd_number)
+    try:
+        session_vars['sftp'].stat(commands['status_file'])
+    except FileNotFoundError:
+        return None
+    start_time = time.perf_counter()
+    paths = [commands['history_file'], commands['stdout_file'],
+             commands['stderr_file'], commands['status_file']]
+    files = read_remote_files(fetch_pool(session_vars), paths)
+    metrics = new_metrics()
+    end_phase(metrics, 'recover', start_time)
+    metrics['sftp_requests'] = sum(files[path]['requests'] for path in paths)
+    metrics['sftp_bytes'] = sum(files[path]['size'] for path in paths)
+    status = files[commands['status_file']]['text'].strip()
+    result: CommandResult = {'cmd_number': cmd_number,
+                             'command': files[commands['history_file']]['text'].rstrip("\n"),
+                             'stdout': files[commands['stdout_file']]['text'].strip(),
+                             'stderr': files[commands['stderr_file']]['text'].strip(),
+                             'exit_status': int(status) if status.lstrip("-").isdigit() else None,
+                             'duration': 0.0,
+                             'file_reads': {'recover': time.perf_counter() - start_time},
+                             'metrics': metrics,
+                             'state': None}
+    record_result(session_vars, result)
+    return result
+
+
+def run_resumable(cmd_number: int, session_vars: dict, command: str) -> int:
+    """
+    run_command for the interactive loop: if the connection drops during the
+    command, reconnect and recover its result from the session directory
+    (it is not run again). Returns the next cmd_number.
+
+    An error only leads to a reconnect if the connection really went down
+    (connection_dropped); otherwise (a missing or unreadable result file, a
+    read timeout) it is reported as the command's failure and the live shell,
+    with its jobs, variables and functions, is kept.
+    """
+    try:
+        return run_command(cmd_number, session_vars, command=command, test=None)
+    except CONNECTION_ERRORS as e:
+        if not connection_dropped(session_vars):
+            print(f"[ERROR] Command {cmd_number} failed: {e!r}", file=sys.stderr)
+            return cmd_number + 1
+        print(f"[WARNING] Connection lost during command {cmd_number}: {e!r}", file=sys.stderr)
+    reconnect_session(session_vars)
+    result = recover_command(session_vars, cmd_number)
+    if result is None:
+        print(f"Command {cmd_number} did not finish before the connection dropped")
+    else:
+        print(f"[recovered command {cmd_number}]")
+        for stream in ('stdout', 'stderr'):
+            if result[stream]:
+                print_output(stream, f"{result[stream]}\n")
+        print_result_summary(result)
+    return cmd_number + 1
+
 # --- Read remote file with wait ---
 def read_remote_file(sftp, remote_path, timeout=10.0):
     """Wait for the remote file to exist, then read and return its contents."""
-    start = time.time()
-    time.sleep(0.05) # slight delay to let things sync up
-    while True:
-        try:
-            with sftp.open(remote_path, "r") as f:
-                return f.read().decode()
-        except FileNotFoundError as exc:
-            if time.time() - start > timeout:
-                raise TimeoutError(f"File {remote_path} not found in {timeout:.1f} sec") from exc
-            time.sleep(0.05)
+    return fetch_remote_lane(sftp, [remote_path], time.perf_counter(), timeout)[remote_path]['text']
+
+
+class RemoteRead(TypedDict):
+    """
+    One file of a batched fetch: decoded contents, byte size and seconds
+    from the start of the batch until this file had arrived
+    """
+    text: str
+    size: int
+    elapsed: float
+    requests: int
+
+
+def fetch_remote_lane(sftp, remote_paths: list[str], start: float, timeout: float):
+    """
+    Fetch files one after another over a single SFTP client. Each file is
+    read with paramiko's prefetch, so all of its read requests are in flight
+    at once. A missing file is retried with backoff instead of a fixed sleep.
+    """
+    results: dict[str, RemoteRead] = {}
+    for remote_path in remote_paths:
+        delay = STREAM_MIN_INTERVAL
+        requests = 0
+        while True:
+            requests += 1
+            try:
+                f = sftp.open(remote_path, "r")
+                break
+            except FileNotFoundError as exc:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"File {remote_path} not found in {timeout:.1f} sec") \
+                        from exc
+                time.sleep(delay)
+                delay = min(delay * 2, STREAM_MAX_INTERVAL)
+        size = f.stat().st_size
+        f.prefetch(size)
+        data = f.read(size)
+        # not closed explicitly: paramiko closes dropped handles asynchronously
+        del f
+        results[remote_path] = {'text': data.decode(errors="replace"),
+                                'size': len(data),
+                                'elapsed': time.perf_counter() - start,
+                                # open attempts, stat, reads, close
+                                'requests': requests + 2 + read_requests(size)}
+    return results
+
+
+def read_remote_files(sftp_pool: list, remote_paths: list[str],
+                      timeout=10.0) -> dict[str, RemoteRead]:
+    """
+    Read several remote files at once, spreading them over the SFTP clients
+    in sftp_pool (one paramiko SFTPClient cannot serve concurrent requests
+    from several threads). Returns as soon as every file has arrived.
+    """
+    start = time.perf_counter()
+    lanes = [remote_paths[i::len(sftp_pool)] for i in range(len(sftp_pool))]
+    results: dict[str, RemoteRead] = {}
+    with ThreadPoolExecutor(max_workers=len(sftp_pool)) as pool:
+        futures = [pool.submit(fetch_remote_lane, sftp, lane, start, timeout)
+                   for sftp, lane in zip(sftp_pool, lanes) if lane]
+        for future in futures:
+            results.update(future.result())
+    return results
 
 SHELL_TESTS = [
     {"desc": "Check whoami",                        "cmd": "whoami",            "expected_exit": 0},
@@ -399,7 +1322,9 @@ SHELL_TESTS = [
 
     ## --- test directory creation, cd, removal ---
     {"desc": "Create directory testdir",            "cmd": "mkdir -p testdir",  "expected_exit": 0},
-    {"desc": "Change into testdir",                 "cmd": "cd testdir",        "expected_exit": 0},
+    {"desc": "Change into testdir",                 "cmd": "cd testdir",        "expected_exit": 0,
+                                                                                "expected_cwd":
+                                                                                        "/testdir"},
     {"desc": "Print pwd inside testdir",            "cmd": "basename $(pwd)",   "expected_exit": 0,
                                                                                 "expected_stdout":
                                                                                          "testdir"},
@@ -409,7 +1334,9 @@ SHELL_TESTS = [
 
     ## --- test creating and accessing a variable ---
     {"desc": "Export env variable MYVAR",           "cmd": 'export MYVAR="hello world"',
-                                                                                "expected_exit": 0},
+                                                                                "expected_exit": 0,
+                                                                                "expected_env":
+                                                                    {"MYVAR": "hello world"}},
     {"desc": "Echo env variable MYVAR",             "cmd": "echo $MYVAR",       "expected_stdout":
                                                                                     "hello world",
                                                                                 "expected_exit": 0},
@@ -429,12 +1356,279 @@ SHELL_TESTS = [
 ]
 
 
+def get_shell_pool(session_vars: dict) -> ShellPool:
+    """Return the session's ShellPool, creating it on first use."""
+    if 'shell_pool' not in session_vars:
+        session_vars['shell_pool'] = ShellPool(session_vars)
+    return session_vars['shell_pool']
+
+
+def print_job(cmd_number: int, future: Future, session_vars: dict|None = None):
+    """
+    Print a finished background job's output and summary. A job cut off by a
+    dropped connection is recovered from its files when session_vars is given.
+    """
+    try:
+        result = future.result()
+    except CONNECTION_ERRORS as e:
+        recovered = recover_command(session_vars, cmd_number) if session_vars else None
+        if recovered is None:
+            print(f"[job {cmd_number}] failed: {e}")
+            return
+        result = recovered
+    print(f"[job {cmd_number}] {result['command']}")
+    for stream, text in (('stdout', result['stdout']), ('stderr', result['stderr'])):
+        if text:
+            print_output(stream, f"{text}\n")
+    print_result_summary(result)
+
+
+def show_history(name: str, arg: str, session_vars: dict):
+    """Answer :history/:failed/:show from the local history cache, without the server."""
+    cache = session_vars.get('history_cache')
+    if cache is None:
+        print("No history cache in this session")
+        return
+    session = os.path.basename(session_vars['session_dir'])
+    if name == "show":
+        entry = cache.get(session, int(arg)) if arg.isdigit() else None
+        if entry is None:
+            print(f"No cached command: {arg}")
+            return
+        for stream in ('stdout', 'stderr'):
+            if entry[stream]:
+                print_output(stream, entry[stream] + "\n")
+        print(f"Exit status: {entry['exit_status']}")
+        return
+    for entry in reversed(cache.search(arg if name == "history" else "",
+                                       failed=name == "failed")):
+        where = "" if entry['session'] == session else f"{entry['session']} "
+        print(f"{where}{entry['cmd_number']:>5}  [{entry['exit_status']}]  {entry['command']}")
+
+
+def print_metrics(session_vars: dict):
+    """Answer :metrics with the rolling aggregates of the session's MetricsRecorder."""
+    if session_vars.get('metrics') is None:
+        print("No metrics in this session")
+        return
+    print(f"{'metric':<22}{'count':>7}{'mean':>12}{'p50':>12}{'p99':>12}")
+    for name, stats in session_vars['metrics'].summary().items():
+        # times in ms, counters as they are
+        scale = 1000 if name == "duration" or name.startswith("phase.") else 1
+        print(f"{name:<22}{stats['count']:>7}" + "".join(f"{stats[key] * scale:>12.1f}"
+                                                        for key in ('mean', 'p50', 'p99')))
+
+
+def show_state(arg: str, session_vars: dict):
+    """Answer :state from the session's StateCache, as a GUI panel would refresh."""
+    cache = session_vars.get('state_cache')
+    if cache is None:
+        print("No state cache in this session")
+        return
+    probe, _, path = arg.partition(" ")
+    path = path.strip() or None
+    if probe == "env":
+        for name, value in sorted(cache.environment().items()):
+            print(f"{name}={value}")
+    elif probe == "ls":
+        for entry in cache.listdir(path):
+            print(f"{entry['size']:>12}  {entry['name']}{'/' if entry['is_dir'] else ''}")
+    elif probe == "git":
+        print(cache.git_status(path), end="")
+    elif probe == "stats":
+        print(", ".join(f"{name} {count}" for name, count in cache.stats.items()))
+        print("browser: " + ", ".join(f"{name} {count}"
+                                      for name, count in cache.browser.stats.items()))
+    else:
+        print(cache.cwd())
+
+
+def print_progress(done: int, total: int, seconds: float):
+    """Overwrite one status line with a transfer's progress and throughput."""
+    rate = done / seconds / 1e6 if seconds > 0 else 0.0
+    print(f"\r{done / total if total else 1:7.1%}  {done / 1e6:,.1f} of {total / 1e6:,.1f} MB"
+          f"  {rate:.1f} MB/s", end="" if done < total else "\n", flush=True)
+
+
+def transfer_file(name: str, arg: str, session_vars: dict):
+    """
+    Answer :upload LOCAL [REMOTE] and :download REMOTE [LOCAL] with
+    transfer.py. Remote paths are relative to the shell's cwd, local ones
+    to rash's.
+    """
+    try:
+        paths = shlex.split(arg)
+    except ValueError as e:
+        print(f"{name}: {e}", file=sys.stderr)
+        return
+    if not 1 <= len(paths) <= 2:
+        print("Usage: :upload LOCAL [REMOTE] or :download REMOTE [LOCAL]")
+        return
+    cache = session_vars.get('state_cache')
+
+    def remote(path: str|None) -> str:
+        if cache is not None:
+            return cache.resolve(path)
+        return posixpath.join(session_vars['home_dir'], path or "")
+
+    try:
+        if name == "upload":
+            result = upload(session_vars['ssh'], paths[0],
+                            remote(paths[1] if len(paths) > 1 else None), print_progress,
+                            fetch_pool(session_vars))
+        else:
+            result = download(session_vars['ssh'], remote(paths[0]),
+                              paths[1] if len(paths) > 1 else ".", print_progress,
+                              fetch_pool(session_vars))
+    except (*CONNECTION_ERRORS, RuntimeError, KeyboardInterrupt) as e:
+        # the partial file stays; anything but a missing or unreadable path can be resumed
+        hint = "" if isinstance(e, (FileNotFoundError, PermissionError)) \
+            else " Run it again to resume."
+        print(f"\n{name} of {paths[0]} stopped: {e!r}.{hint}", file=sys.stderr)
+        return
+    print(f"{name.capitalize()}ed {result['source']} to {result['destination']}: "
+          f"{result['size'] / 1e6:,.1f} MB in {result['seconds']:.1f} sec "
+          f"({result['transferred'] / result['seconds'] / 1e6:.1f} MB/s, "
+          f"{result['resumed'] / 1e6:,.1f} MB resumed), sha256 verified")
+    if name == "upload" and cache is not None:
+        cache.browser.invalidate(posixpath.dirname(result['destination']))
+    if session_vars.get('metrics') is not None:
+        session_vars['metrics'].emit({'event': name, 'time': time.time(),
+                                      'session': os.path.basename(session_vars['session_dir']),
+                                      **result})
+
+
+def replay_session(arg: str, session_vars: dict):
+    """Answer :replay [N|@SECONDS] [xSPEED] from the session's recording."""
+    recorder = session_vars.get('recorder')
+    if recorder is None:
+        print("No recording in this session (set SESSION_RECORDING_DIR)")
+        return
+    recorder.flush()
+    player = SessionPlayer(recorder.log.name)
+    try:
+        speed, offset, after = 1.0, None, 0.0
+        for word in arg.split():
+            if word.startswith("x"):
+                speed = float(word[1:])
+            elif word.startswith("@"):
+                after = float(word[1:])
+                offset = player.seek_time(after)
+            else:
+                offset = player.seek_command(int(word))
+        if offset is None:
+            for cmd_number, seconds in player.commands():
+                print(f"{cmd_number:>5}  {seconds:>10.1f} sec")
+            return
+        player.replay(offset, speed, after=after)
+    except (ValueError, KeyError) as e:
+        print(f"replay: {e.args[0]}")
+    except KeyboardInterrupt:
+        print("\n[replay stopped]")
+    finally:
+        player.close()
+
+
+def manage_sessions(name: str, session_vars: dict):
+    """Answer :sessions and :prune with the session's SessionStore."""
+    store = session_vars['session_store']
+    if name == "prune":
+        pruned = store.prune()
+        print(f"Pruned {len(pruned)} sessions: {' '.join(pruned)}")
+        return
+    current = os.path.basename(session_vars['session_dir'])
+    for session in store.list_sessions():
+        age = (time.time() - session['mtime']) / 86400
+        mark = "*" if session['name'] == current else " "
+        print(f"{mark} {session['name']:<40} {age:>6.1f} days {session['size'] // 1024:>10} KiB")
+
+
+def run_meta_command(user_cmd: str, cmd_number: int, session_vars: dict) -> int:
+    """
+    run_meta_command - handle rash's own ':' commands, returning the next cmd_number.
+
+        :bg COMMAND     run COMMAND on a pooled background shell
+        :jobs           list background jobs
+        :wait [N]       wait for job N (default: all) and print its results
+        :history [TEXT] search cached commands and output for TEXT
+        :failed         list cached commands that exited non-zero
+        :show N         print the cached output of command N
+        :sessions       list session directories with age and size
+        :prune          delete old sessions past the retention limits
+        :metrics        per-phase latency and traffic aggregates
+        :state [cwd|env|ls [DIR]|git [DIR]|stats]
+                        cached shell state, without a command round trip
+        :upload LOCAL [REMOTE]
+        :download REMOTE [LOCAL]
+                        parallel, verified file transfer; run again to resume
+        :replay [N|@SECONDS] [xSPEED]
+                        list the recorded commands, or replay the recording from
+                        command N or SECONDS in, at SPEED (x0: no pauses)
+    """
+    name, _, arg = user_cmd[1:].strip().partition(" ")
+    arg = arg.strip()
+    if name in ("history", "failed", "show"):
+        show_history(name, arg, session_vars)
+    elif name == "metrics":
+        print_metrics(session_vars)
+    elif name == "state":
+        show_state(arg, session_vars)
+    elif name in ("sessions", "prune"):
+        manage_sessions(name, session_vars)
+    elif name in ("upload", "download"):
+        transfer_file(name, arg, session_vars)
+    elif name == "replay":
+        replay_session(arg, session_vars)
+    elif name == "bg" and arg:
+        try:
+            get_shell_pool(session_vars).submit(cmd_number, arg)
+        except CONNECTION_ERRORS as e:
+            print(f"[job {cmd_number}] not started: {e!r}", file=sys.stderr)
+            return cmd_number
+        print(f"[job {cmd_number}] started: {arg}")
+        return cmd_number + 1
+    elif name in ("jobs", "wait"):
+        manage_jobs(name, arg, session_vars)
+    else:
+        print(run_meta_command.__doc__)
+    return cmd_number
+
+
+def manage_jobs(name: str, arg: str, session_vars: dict):
+    """Answer :jobs and :wait [N] for the session's background shells."""
+    jobs = session_vars['shell_pool'].jobs if 'shell_pool' in session_vars else {}
+    if name == "jobs":
+        for job_number, future in jobs.items():
+            print(f"[job {job_number}] {'done' if future.done() else 'running'}")
+        return
+    selected = [int(arg)] if arg.isdigit() else list(jobs)
+    for job_number in selected:
+        if job_number not in jobs:
+            print(f"No such job: {job_number}")
+            continue
+        wait([jobs[job_number]])
+        print_job(job_number, jobs.pop(job_number), session_vars)
+
+
 def interactive_loop(cmd_number, session_vars):
     """
     interactive_loop - take user text input, detect exit or send it to run_command 
     """
+    # loaded here rather than at import: only the interactive front end needs it
+    # pylint: disable-next=import-outside-toplevel
+    from prompt_toolkit import PromptSession
+    # pylint: disable-next=import-outside-toplevel
+    from prompt_toolkit.completion import ThreadedCompleter
+    # pylint: disable-next=import-outside-toplevel
+    from prompt_toolkit.history import InMemoryHistory
+    # pylint: disable-next=import-outside-toplevel
+    from completion import RemoteCompleter
+
     # --- Interactive loop ---
-    session = PromptSession(history=InMemoryHistory())
+    # completions come from local indexes; a directory not cached yet is fetched off the UI thread
+    session = PromptSession(history=InMemoryHistory(),
+                            completer=ThreadedCompleter(RemoteCompleter(session_vars)),
+                            complete_while_typing=False)
     print("\nEntering interactive mode. Type 'exit' or press CTRL-D to quit.\n")
     while True:
         try:
@@ -451,14 +1645,15 @@ def interactive_loop(cmd_number, session_vars):
         if user_cmd.strip().lower() in ("exit", "quit", "logout"):
             print("Exiting session...")
             break
+        ensure_connected(session_vars)
+        if user_cmd.startswith(":"):
+            cmd_number = run_meta_command(user_cmd, cmd_number, session_vars)
+            continue
+
+        # run_command without test expectations, surviving a dropped connection
+        cmd_number = run_resumable(cmd_number, session_vars, user_cmd)
 
-        # Reuse run_command; no test expectations in interactive mode
-        cmd_number = run_command(
-            cmd_number,
-            session_vars,
-            command=user_cmd,
-            test=False
-        )
+    return cmd_number
 
 if __name__ == "__main__":
     main()
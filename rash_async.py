@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+rash_async - asyncio front end for rash sessions.
+
+Each AsyncSession owns one I/O thread that runs the blocking paramiko code
+in rash.py (connect, initialize_session, execute_command). Output chunks are
+handed back to the event loop with call_soon_threadsafe, so the loop never
+blocks or busy-waits and one loop can drive many sessions.
+
+Usage:
+    async with AsyncSession(host, username, key) as session:
+    # or, with credentials resolved once for several sessions (never prompts):
+    async with AsyncSession.from_connection(rash.resolve_connection(...)) as session:
+        command = session.run_command("make")
+        async for stream, text in command:
+            ...
+        result = await command
+
+    python rash_async.py USERNAME HOST [HOST ...] -c "uptime"
+"""
+import argparse
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+import rash
+
+
+class AsyncCommand:
+    """
+    A command running on an AsyncSession. Iterate it for (stream, text)
+    output chunks; await it for the final rash.CommandResult.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.chunks: asyncio.Queue[tuple[str, str] | None] = asyncio.Queue()
+        self.future: asyncio.Future = loop.create_future()
+
+    def on_output(self, stream: str, text: str):
+        """Output callback for rash.execute_command; runs on the I/O thread."""
+        if text:
+            self.loop.call_soon_threadsafe(self.chunks.put_nowait, (stream, text))
+
+    def finish(self, result: asyncio.Future):
+        """Close the chunk stream and resolve the command with the thread's result."""
+        self.chunks.put_nowait(None)
+        if result.exception() is not None:
+            self.future.set_exception(result.exception())
+        else:
+            self.future.set_result(result.result())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> tuple[str, str]:
+        chunk = await self.chunks.get()
+        if chunk is None:
+            # leave the end marker for any other reader
+            self.chunks.put_nowait(None)
+            raise StopAsyncIteration
+        return chunk
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+class AsyncSession:
+    """
+    An asyncio-driven rash session: one SSH connection and persistent shell,
+    served by a dedicated I/O thread. Commands are queued on that thread in
+    submission order, as they would be typed into the shell.
+    """
+
+    def __init__(self, host: str, username: str, private_key_path: str | None = None,
+                 password: str | None = None, port: int = 22):
+        self.connect_args = (host, username, private_key_path, password, port)
+        # resolved login details; None: resolved (and maybe prompted for) on the I/O thread
+        self.connection: rash.Connection|None = None
+        self.io_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"rash-{host}")
+        self.session_vars: dict[str, Any] = {}
+        self.cmd_number = 1
+
+    @classmethod
+    def from_connection(cls, connection: rash.Connection) -> "AsyncSession":
+        """A session logging in with credentials already resolved, so it never prompts."""
+        session = cls(connection['host'], connection['username'], port=connection['port'])
+        session.connection = connection
+        return session
+
+    async def connect(self) -> dict[str, Any]:
+        """Open the connection and initialize the session on the I/O thread."""
+        self.session_vars = await self.call(self.connect_blocking)
+        return self.session_vars
+
+    def connect_blocking(self) -> dict[str, Any]:
+        """Blocking half of connect(), run on the I/O thread."""
+        connection = self.connection or rash.resolve_connection(*self.connect_args)
+        channel, ssh = rash.connect(connection)
+        session_vars = rash.initialize_session(channel, ssh)
+        # so a dropped connection can be re-established without asking again
+        session_vars['connection'] = connection
+        return session_vars
+
+    async def call(self, func, *args):
+        """Run a blocking function on this session's I/O thread."""
+        return await asyncio.get_running_loop().run_in_executor(self.io_thread, func, *args)
+
+    def run_command(self, command: str) -> AsyncCommand:
+        """Queue command on the session's shell and return it as an AsyncCommand."""
+        loop = asyncio.get_running_loop()
+        pending = AsyncCommand(loop)
+        cmd_number = self.cmd_number
+        self.cmd_number += 1
+        result = loop.run_in_executor(self.io_thread, rash.execute_command,
+                                      cmd_number, self.session_vars, command, pending.on_output)
+        result.add_done_callback(pending.finish)
+        return pending
+
+    async def close(self):
+        """Close SFTP clients, the shell and the connection."""
+        if self.session_vars:
+            await self.call(rash.close_session, self.session_vars)
+        self.io_thread.shutdown(wait=False)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+async def run_everywhere(connections: list[rash.Connection], command: str):
+    """
+    Connect to every host concurrently on one event loop, run command on each
+    and print its output prefixed with the host name.
+    """
+    async def run_one(connection: rash.Connection):
+        host = connection['host']
+        async with AsyncSession.from_connection(connection) as session:
+            pending = session.run_command(command)
+            async for stream, text in pending:
+                for line in text.splitlines():
+                    print(f"{host}: {line}", file=sys.stderr if stream == "stderr" else sys.stdout)
+            result = await pending
+            print(f"{host}: exit {result['exit_status']} in {result['duration']:.2f} sec")
+
+    await asyncio.gather(*(run_one(connection) for connection in connections))
+
+
+def main():
+    """
+    Run one command on each given host from a single event loop
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("username")
+    parser.add_argument("hosts", nargs="+")
+    parser.add_argument("-c", "--command", required=True)
+    parser.add_argument("--key", default=None, help="private key file")
+    args = parser.parse_args()
+    # load the key or ask for the password (or passphrase) once, up front, rather than from
+    # every host's I/O thread at once
+    login = rash.resolve_connection(args.hosts[0], args.username, args.key)
+    asyncio.run(run_everywhere([{**login, 'host': host} for host in args.hosts], args.command))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+rash_web - HTTP API around rash sessions, for the GUI.
+
+A SessionPool keeps live rash sessions (SSH transport, shell, SFTP clients)
+per user, so a browser session is handed a warm connection and never pays
+for the SSH handshake and initialize_session; released sessions stay warm
+until WEB_IDLE_TIMEOUT. Commands run in order on their session's own
+thread. Their output is published as it streams in (execute_command's
+on_output), and clients follow it as Server-Sent Events.
+
+    POST   /sessions                          {host, username, key[, passphrase]|password, port}
+    GET    /sessions/<id>                     session info
+    DELETE /sessions/<id>                     release to the user's warm pool
+    POST   /sessions/<id>/commands            {command} -> {cmd_number}
+    GET    /sessions/<id>/commands/<n>        status, and the result once finished
+    GET    /sessions/<id>/commands/<n>/stream SSE: stdout/stderr events, then done
+    GET    /sessions/<id>/history?q=&failed=1 cached history of the session
+    GET    /sessions/<id>/state/<probe>?path= cwd, env, ls or git panel state (state_cache)
+
+Usage:
+    python rash_web.py [--port 8080]
+    python rash_web.py --load-test [--clients 8] [--commands 20] [--rtt 0.02]
+"""
+import argparse
+import hashlib
+import http.client
+import io
+import json
+import logging
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator
+import paramiko
+from flask import Flask, Response, abort, jsonify, request
+from werkzeug.serving import make_server
+import rash
+import local_server
+from history_cache import HistoryCache
+from metrics import MetricsRecorder, percentile
+from state_cache import StateCache
+
+# seconds a released session stays connected for its user's next request
+WEB_IDLE_TIMEOUT = 300
+# sessions one user may have in use at once (released ones do not count)
+WEB_SESSIONS_PER_USER = 8
+# finished commands per session whose output can still be streamed
+WEB_LIVE_COMMANDS = 32
+
+# (host, port, username, credential digest): only identical logins share sessions
+UserKey = tuple[str, int, str, str]
+
+
+def user_key(connection: rash.Connection) -> UserKey:
+    """Pool key for a login; the credential is kept only as a digest."""
+    secret = connection['pkey'].asbytes() if connection['pkey'] is not None \
+        else (connection['password'] or "").encode()
+    return (connection['host'], connection['port'], connection['username'],
+            hashlib.sha256(secret).hexdigest())
+
+
+def web_connection(body: Any) -> rash.Connection:
+    """
+    Login details from a POST /sessions body: the Ed25519 private key itself
+    (with its passphrase, if encrypted) or a password. Unlike
+    rash.resolve_connection it never reads a file or prompts on the
+    server's terminal. Raises ValueError for a malformed body or key.
+    """
+    if not isinstance(body, dict) or not body.get('host') or not body.get('username'):
+        raise ValueError("host and username required")
+    pkey = None
+    if body.get('key'):
+        try:
+            pkey = paramiko.Ed25519Key.from_private_key(io.StringIO(str(body['key'])),
+                                                        password=body.get('passphrase'))
+        except paramiko.PasswordRequiredException as e:
+            raise ValueError("key is encrypted: passphrase required") from e
+        except (paramiko.SSHException, ValueError, TypeError) as e:
+            raise ValueError(f"key is not a usable Ed25519 private key: {e}") from e
+    elif body.get('password') is None:
+        raise ValueError("key or password required")
+    try:
+        port = int(body.get('port', 22))
+    except (TypeError, ValueError) as e:
+        raise ValueError("port must be a number") from e
+    return {'host': str(body['host']), 'port': port, 'username': str(body['username']),
+            'pkey': pkey, 'password': None if pkey else str(body['password'])}
+
+
+class LiveCommand:
+    """
+    Output of one command as (stream, text) events, kept so any number of
+    clients can follow it from the start, plus the result once finished.
+    """
+
+    def __init__(self, cmd_number: int, command: str):
+        self.cmd_number = cmd_number
+        self.command = command
+        self.events: list[tuple[str, str]] = []
+        self.result: dict[str, Any]|None = None
+        self.condition = threading.Condition()
+
+    def publish(self, stream: str, text: str):
+        """Output callback for rash.execute_command; runs on the session's thread."""
+        if text:
+            with self.condition:
+                self.events.append((stream, text))
+                self.condition.notify_all()
+
+    def finish(self, result: dict[str, Any]):
+        """Record the final result (or error) and wake every follower."""
+        with self.condition:
+            self.result = result
+            self.condition.notify_all()
+
+    def follow(self) -> Iterator[tuple[str, str]]:
+        """All events from the first, waiting for new ones, then ('done', result JSON)."""
+        index = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.events) > index or self.result)
+                events, finished = self.events[index:], self.result is not None
+            index += len(events)
+            yield from events
+            if finished and index == len(self.events):
+                yield 'done', json.dumps(self.result)
+                return
+
+
+def result_json(result: rash.CommandResult) -> dict[str, Any]:
+    """A CommandResult as JSON; large outputs are sent as their head/tail preview."""
+    return {'cmd_number': result['cmd_number'],
+            'command': result['command'],
+            'stdout': str(result['stdout']),
+            'stderr': str(result['stderr']),
+            'exit_status': result['exit_status'],
+            'duration': result['duration'],
+            'phases': result['metrics']['phases']}
+
+
+class WebSession:
+    """
+    One pooled rash session. Commands run one at a time, in submission
+    order, on the session's own thread.
+    """
+
+    def __init__(self, user: UserKey, session_vars: dict):
+        self.session_id = secrets.token_urlsafe(12)
+        self.user = user
+        self.session_vars = session_vars
+        self.cmd_number = 1
+        self.commands: OrderedDict[int, LiveCommand] = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, command: str) -> LiveCommand:
+        """Queue command; its output can be followed right away."""
+        with self.lock:
+            live = LiveCommand(self.cmd_number, command)
+            self.cmd_number += 1
+            self.commands[live.cmd_number] = live
+            while len(self.commands) > WEB_LIVE_COMMANDS:
+                self.commands.popitem(last=False)
+        self.executor.submit(self.run, live)
+        return live
+
+    def run(self, live: LiveCommand):
+        """
+        Run a queued command, reconnecting first if the connection dropped.
+        Any failure finishes the command with an 'error', so its followers
+        always get their 'done' event.
+        """
+        try:
+            rash.ensure_connected(self.session_vars)
+            result = rash.execute_command(live.cmd_number, self.session_vars, live.command,
+                                          on_output=live.publish)
+            live.finish(result_json(result))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            live.finish({'cmd_number': live.cmd_number, 'command': live.command,
+                         'error': f"{type(e).__name__}: {e}"})
+
+    def info(self) -> dict[str, Any]:
+        """Session details for GET /sessions/<id>."""
+        return {'session_id': self.session_id,
+                'session_dir': self.session_vars['session_dir'],
+                'server_prompt': self.session_vars['server_prompt'],
+                'next_cmd_number': self.cmd_number,
+                'connected': rash.connection_alive(self.session_vars)}
+
+    def close(self):
+        """Wait for queued commands, then close the rash session."""
+        self.executor.shutdown(wait=True)
+        rash.close_session(self.session_vars)
+
+
+class SessionPool:
+    """
+    Live sessions by id, plus each user's released (idle, still connected)
+    sessions with their release times. acquire hands out an idle session
+    before connecting a new one; at most WEB_SESSIONS_PER_USER are in use or
+    being connected.
+    """
+
+    def __init__(self, idle_timeout: float = WEB_IDLE_TIMEOUT):
+        self.sessions: dict[str, WebSession] = {}
+        self.idle: defaultdict[UserKey, list[tuple[float, WebSession]]] = defaultdict(list)
+        # sessions each user has being connected, counted against the limit
+        self.connecting: defaultdict[UserKey, int] = defaultdict(int)
+        self.lock = threading.Lock()
+        self.history_cache = HistoryCache()
+        self.metrics = MetricsRecorder()
+        self.closed = threading.Event()
+        threading.Thread(target=self.reap_idle, args=(idle_timeout,), daemon=True).start()
+
+    def acquire(self, connection: rash.Connection) -> WebSession:
+        """A warm session of this user if one is idle, else a newly connected one."""
+        user = user_key(connection)
+        with self.lock:
+            while self.idle[user]:
+                _, session = self.idle[user].pop()
+                if rash.connection_alive(session.session_vars):
+                    self.sessions[session.session_id] = session
+                    return session
+                threading.Thread(target=session.close, daemon=True).start()
+            in_use = sum(session.user == user for session in self.sessions.values())
+            if in_use + self.connecting[user] >= WEB_SESSIONS_PER_USER:
+                raise PermissionError(f"at most {WEB_SESSIONS_PER_USER} sessions per user")
+            # reserve the slot now: concurrent requests must see it while this one connects
+            self.connecting[user] += 1
+        session = None
+        try:
+            session = self.connect(user, connection)
+        finally:
+            with self.lock:
+                self.connecting[user] -= 1
+                if not self.connecting[user]:
+                    del self.connecting[user]
+                if session is not None:
+                    self.sessions[session.session_id] = session
+        return session
+
+    def connect(self, user: UserKey, connection: rash.Connection) -> WebSession:
+        """A newly connected and initialized session (its connection closed if setup fails)."""
+        channel, ssh = rash.connect(connection)
+        try:
+            session_vars = rash.initialize_session(channel, ssh)
+        except BaseException:
+            ssh.close()
+            raise
+        session_vars.update({'connection': connection,
+                             'history_cache': self.history_cache,
+                             'metrics': self.metrics})
+        session_vars['state_cache'] = StateCache(session_vars, rash.SHELL_STATE_FILE)
+        return WebSession(user, session_vars)
+
+    def get(self, session_id: str) -> WebSession:
+        """The live session with this id (KeyError if there is none)."""
+        with self.lock:
+            return self.sessions[session_id]
+
+    def release(self, session_id: str):
+        """Return a session to its user's idle list, still connected."""
+        with self.lock:
+            session = self.sessions.pop(session_id)
+            self.idle[session.user].append((time.time(), session))
+
+    def reap_idle(self, idle_timeout: float):
+        """Close sessions idle for longer than idle_timeout (background thread)."""
+        while not self.closed.wait(min(idle_timeout, 30)):
+            cutoff = time.time() - idle_timeout
+            with self.lock:
+                expired = [session for sessions in self.idle.values()
+                           for released, session in sessions if released < cutoff]
+                for sessions in self.idle.values():
+                    sessions[:] = [entry for entry in sessions if entry[0] >= cutoff]
+            for session in expired:
+                session.close()
+
+    def close(self):
+        """Close every session, live or idle."""
+        self.closed.set()
+        with self.lock:
+            sessions = list(self.sessions.values()) + [session for sessions in self.idle.values()
+                                                       for _, session in sessions]
+            self.sessions, self.idle = {}, defaultdict(list)
+        for session in sessions:
+            session.close()
+        self.history_cache.close()
+        self.metrics.close()
+
+
+def server_sent_event(event: str, data: str) -> str:
+    """One SSE message; multi-line data becomes several data: lines."""
+    return f"event: {event}\n" + "".join(f"data: {line}\n" for line in data.split("\n")) + "\n"
+
+
+def create_app(pool: SessionPool) -> Flask:
+    """The Flask app serving the API over pool."""
+    app = Flask(__name__)
+
+    def find_session(session_id: str) -> WebSession:
+        try:
+            return pool.get(session_id)
+        except KeyError:
+            abort(404, description=f"no session {session_id}")
+
+    def find_command(session: WebSession, cmd_number: int) -> LiveCommand:
+        with session.lock:
+            live = session.commands.get(cmd_number)
+        if live is None:
+            abort(404, description=f"no live command {cmd_number}")
+        return live
+
+    @app.post("/sessions")
+    def create_session():
+        try:
+            session = pool.acquire(web_connection(request.get_json(force=True)))
+        except ValueError as e:
+            abort(400, description=str(e))
+        except PermissionError as e:
+            abort(429, description=str(e))
+        except (*rash.CONNECTION_ERRORS, ConnectionError) as e:
+            abort(502, description=f"connection failed: {e}")
+        return jsonify(session.info()), 201
+
+    @app.get("/sessions/<session_id>")
+    def session_info(session_id: str):
+        return jsonify(find_session(session_id).info())
+
+    @app.delete("/sessions/<session_id>")
+    def release_session(session_id: str):
+        find_session(session_id)
+        pool.release(session_id)
+        return "", 204
+
+    @app.post("/sessions/<session_id>/commands")
+    def submit_command(session_id: str):
+        session = find_session(session_id)
+        body = request.get_json(force=True)
+        command = body.get('command') if isinstance(body, dict) else None
+        if not isinstance(command, str) or not command.strip():
+            abort(400, description="command required (a non-empty string)")
+        live = session.submit(command)
+        return jsonify({'cmd_number': live.cmd_number}), 202
+
+    @app.get("/sessions/<session_id>/commands/<int:cmd_number>")
+    def command_status(session_id: str, cmd_number: int):
+        live = find_command(find_session(session_id), cmd_number)
+        return jsonify({'cmd_number': cmd_number, 'command': live.command,
+                        'finished': live.result is not None, 'result': live.result})
+
+    @app.get("/sessions/<session_id>/commands/<int:cmd_number>/stream")
+    def stream_command(session_id: str, cmd_number: int):
+        live = find_command(find_session(session_id), cmd_number)
+        events = (server_sent_event(event, data) for event, data in live.follow())
+        return Response(events, mimetype="text/event-stream",
+                        headers={'Cache-Control': "no-cache", 'X-Accel-Buffering': "no"})
+
+    @app.get("/sessions/<session_id>/history")
+    def session_history(session_id: str):
+        session = find_session(session_id)
+        limit = request.args.get('limit', "50")
+        if not limit.isdigit() or int(limit) < 1:
+            abort(400, description="limit must be a positive number")
+        name = session.session_vars['session_dir'].rsplit("/", 1)[-1]
+        entries = pool.history_cache.search(request.args.get('q', ""), session=name,
+                                            failed=request.args.get('failed') == "1",
+                                            limit=int(limit))
+        return jsonify(entries)
+
+    @app.get("/sessions/<session_id>/state/<probe>")
+    def session_state(session_id: str, probe: str):
+        cache = find_session(session_id).session_vars['state_cache']
+        path = request.args.get('path')
+        probes = {'cwd': cache.cwd,
+                  'env': cache.environment,
+                  'ls': lambda: cache.listdir(path),
+                  'git': lambda: cache.git_status(path)}
+        if probe not in probes:
+            abort(404, description=f"no state probe {probe}")
+        try:
+            return jsonify({probe: probes[probe]()})
+        except FileNotFoundError:
+            abort(404, description=f"no such directory: {path}")
+        except rash.CONNECTION_ERRORS as e:
+            abort(502, description=f"state probe failed: {e}")
+        return None
+
+    return app
+
+
+def api_request(port: int, method: str, path: str, body: dict|None = None) -> tuple[int, Any]:
+    """One JSON request to the API on localhost; returns (status, decoded body)."""
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    try:
+        conn.request(method, path, body=json.dumps(body) if body is not None else None,
+                     headers={'Content-Type': "application/json"})
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if data else None
+    finally:
+        conn.close()
+
+
+def follow_stream(port: int, path: str) -> tuple[float|None, dict]:
+    """Read an SSE stream to its done event; (sec to first output, done data)."""
+    start = time.perf_counter()
+    first = None
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        event, data = "", []
+        for raw in response:
+            line = raw.decode().rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data.append(line[len("data: "):])
+            elif not line:
+                if event == "done":
+                    return first, json.loads("\n".join(data))
+                if first is None:
+                    first = time.perf_counter() - start
+                event, data = "", []
+    finally:
+        conn.close()
+    return first, {}
+
+
+def load_test_client(port: int, login: dict, commands: int, stats: dict[str, list]):
+    """One client: take a session, run commands following each stream, release it."""
+    start = time.perf_counter()
+    status, session = api_request(port, "POST", "/sessions", login)
+    stats['acquire'].append(time.perf_counter() - start)
+    if status != 201:
+        stats['errors'].append(f"create session: {status} {session}")
+        return
+    for index in range(commands):
+        start = time.perf_counter()
+        _, submitted = api_request(port, "POST", f"/sessions/{session['session_id']}/commands",
+                                   {'command': f"echo client-{index}; seq 1 200"})
+        first, result = follow_stream(port, f"/sessions/{session['session_id']}/commands/"
+                                            f"{submitted['cmd_number']}/stream")
+        stats['command'].append(time.perf_counter() - start)
+        if first is not None:
+            stats['first_output'].append(first)
+        if result.get('exit_status') != 0:
+            stats['errors'].append(f"command {submitted['cmd_number']}: {result}")
+    api_request(port, "DELETE", f"/sessions/{session['session_id']}")
+
+
+def run_load_test(clients: int, commands: int, rtt: float) -> int:
+    """
+    Serve the API against a local SSH server and run `clients` concurrent
+    clients twice: the first round connects new sessions, the second reuses
+    the warm ones released by the first. Prints latency per round; returns
+    the error count.
+    """
+    server = local_server.start_local_server(rtt=rtt)
+    # one log line per request would drown the report
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    pool = SessionPool()
+    http_server = make_server("127.0.0.1", 0, create_app(pool), threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    login = {'host': "127.0.0.1", 'port': server['port'], 'username': "bench",
+             'password': server['password']}
+    errors = 0
+    print(f"{clients} clients x {commands} commands, rtt {rtt * 1000:.0f} ms")
+    print(f"{'round':<8}{'acquire p50':>12}{'cmd p50':>10}{'cmd p99':>10}"
+          f"{'first out':>11}{'cmds/s':>9}")
+    try:
+        for name in ("cold", "warm"):
+            stats: dict[str, list] = defaultdict(list)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                for future in [executor.submit(load_test_client, http_server.server_port, login,
+                                               commands, stats) for _ in range(clients)]:
+                    future.result()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<8}{percentile(stats['acquire'], 50) * 1000:>10.0f}ms"
+                  f"{percentile(stats['command'], 50) * 1000:>8.0f}ms"
+                  f"{percentile(stats['command'], 99) * 1000:>8.0f}ms"
+                  f"{percentile(stats['first_output'] or [0.0], 50) * 1000:>9.0f}ms"
+                  f"{len(stats['command']) / elapsed:>9.1f}")
+            for error in stats['errors']:
+                print(f"ERROR: {error}", file=sys.stderr)
+            errors += len(stats['errors'])
+    finally:
+        http_server.shutdown()
+        pool.close()
+        local_server.stop_local_server(server)
+    return errors
+
+
+def main():
+    """
+    Serve the API, or run the load test against a local server
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="address to serve on")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--load-test", action="store_true",
+                        help="run concurrent clients against an in-process local server")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--commands", type=int, default=20, help="commands per client")
+    parser.add_argument("--rtt", type=float, default=0.02, help="load test network RTT (sec)")
+    args = parser.parse_args()
+    if args.load_test:
+        return 1 if run_load_test(args.clients, args.commands, args.rtt) else 0
+
+    pool = SessionPool()
+    try:
+        create_app(pool).run(host=args.host, port=args.port, threaded=True)
+    finally:
+        pool.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+retention - keep ~/.rash from growing without limit.
+
+Every command leaves history, stdout, stderr and status files in its
+session directory. SessionStore packs those of finished commands, in the
+background, into one archive per session: each distinct output is stored
+once (keyed by its SHA-256), gzip-compressed and appended to
+outputs.pack, with outputs.idx mapping hash -> offset/length and
+commands.idx mapping cmd_number -> status and hashes. The loose files are
+then removed. Once a session has RETENTION_MAX_SESSION_BYTES of packed
+data, packing stops and later commands keep their loose files.
+
+Whole sessions are listed, and pruned by age, count and total size when
+asked to (:prune, or rash's PRUNE_ON_CONNECT), with one remote command each.
+"""
+import gzip
+import posixpath
+import shlex
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TypedDict
+
+RETENTION_MAX_SESSIONS = 50
+RETENTION_MAX_AGE_DAYS = 30
+RETENTION_MAX_TOTAL_BYTES = 1024 * 1024 * 1024
+RETENTION_MAX_SESSION_BYTES = 256 * 1024 * 1024
+# finished commands collected before a background pack is started
+RETENTION_PACK_EVERY = 16
+
+PACK_FILE = "outputs.pack"
+PACK_INDEX = "outputs.idx"
+COMMAND_INDEX = "commands.idx"
+
+# store FILE: print its hash, appending it to the pack unless already there;
+# full: true once the pack has reached the session cap
+PACK_FUNCTIONS = f"""
+store() {{
+  [ -f "$1" ] || {{ echo -; return; }}
+  h=$(sha256sum < "$1" | cut -c1-64)
+  if ! grep -q "^$h " {PACK_INDEX} 2>/dev/null; then
+    off=$(( $(wc -c 2>/dev/null < {PACK_FILE} || echo 0) ))
+    gzip -c < "$1" >> {PACK_FILE}
+    echo "$h $off $(( $(wc -c < {PACK_FILE}) - off ))" >> {PACK_INDEX}
+  fi
+  echo "$h"
+}}
+full() {{
+  [ "$(( $(wc -c 2>/dev/null < {PACK_FILE} || echo 0) ))" -ge "$cap" ]
+}}
+"""
+
+LIST_SESSIONS = """
+for d in session-*/; do
+  d=${d%/}
+  [ -d "$d" ] || continue
+  printf '%s %s %s\\n' "$(stat -c %Y "$d" 2>/dev/null || stat -f %m "$d")" \
+    "$(du -sk "$d" | cut -f1)" "$d"
+done
+"""
+
+
+class SessionInfo(TypedDict):
+    """
+    One session directory under ~/.rash
+    """
+    name: str
+    mtime: float
+    size: int
+
+
+def select_prunable(sessions: list[SessionInfo], keep: set[str],
+                    max_sessions: int = RETENTION_MAX_SESSIONS,
+                    max_age_days: float = RETENTION_MAX_AGE_DAYS,
+                    max_total_bytes: int = RETENTION_MAX_TOTAL_BYTES) -> list[str]:
+    """
+    Sessions to delete, oldest first: anything older than max_age_days, then
+    the oldest beyond max_sessions or beyond max_total_bytes in all. Sessions
+    named in keep are never selected.
+    """
+    oldest = time.time() - max_age_days * 86400
+    kept, total, prunable = 0, 0, []
+    for session in sorted(sessions, key=lambda session: session['mtime'], reverse=True):
+        if session['name'] in keep:
+            kept += 1
+            total += session['size']
+            continue
+        if (session['mtime'] < oldest or kept >= max_sessions
+                or total + session['size'] > max_total_bytes):
+            prunable.append(session['name'])
+            continue
+        kept += 1
+        total += session['size']
+    return prunable[::-1]
+
+
+def report_failure(future: Future):
+    """Done-callback for background retention work: print any error to stderr."""
+    if future.exception() is not None:
+        print(f"[retention] {future.exception()}", file=sys.stderr)
+
+
+class SessionStore:
+    """
+    Retention for one session directory: background packing of finished
+    commands plus listing and pruning of sibling sessions. Remote work runs
+    as exec commands on the session's SSH transport, serialized on one
+    worker thread, so the interactive shell is never used.
+    """
+
+    def __init__(self, ssh, session_dir: str):
+        self.ssh = ssh
+        self.session_dir = session_dir
+        self.root = posixpath.dirname(session_dir)
+        self.finished: list[int] = []
+        self.lock = threading.Lock()
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rash-retention")
+
+    def run_remote(self, script: str) -> str:
+        """Run a bash script on the server over an exec channel; return its stdout."""
+        _, stdout, stderr = self.ssh.exec_command(f"bash -c {shlex.quote(script)}")
+        text = stdout.read().decode(errors="replace")
+        if stdout.channel.recv_exit_status() != 0:
+            raise RuntimeError(f"retention command failed: {stderr.read().decode().strip()}")
+        return text
+
+    def command_finished(self, cmd_number: int):
+        """Note that a command's files are no longer in use; pack every RETENTION_PACK_EVERY."""
+        with self.lock:
+            self.finished.append(cmd_number)
+            if len(self.finished) < RETENTION_PACK_EVERY:
+                return
+            batch, self.finished = self.finished, []
+        self.worker.submit(self.pack, batch).add_done_callback(report_failure)
+
+    def pack(self, cmd_numbers: list[int]):
+        """
+        Move the files of the given finished commands into the session's pack,
+        until it reaches RETENTION_MAX_SESSION_BYTES.
+        """
+        if not cmd_numbers:
+            return
+        script = "".join([f"cd {shlex.quote(self.session_dir)} || exit 1\n",
+                          f"cap={RETENTION_MAX_SESSION_BYTES}\n",
+                          PACK_FUNCTIONS,
+                          f"for n in {' '.join(str(n) for n in sorted(cmd_numbers))}; do\n",
+                          "  [ -f status-cmd$n ] || continue\n",
+                          # past the cap the loose files stay: nothing is dropped
+                          "  full && break\n",
+                          "  printf '%s %s %s %s %s\\n' $n \"$(cat status-cmd$n)\" ",
+                          "\"$(store history-cmd$n)\" \"$(store stdout-cmd$n)\" ",
+                          f"\"$(store stderr-cmd$n)\" >> {COMMAND_INDEX}\n",
+                          "  rm -f history-cmd$n stdout-cmd$n stderr-cmd$n status-cmd$n\n",
+                          "done\n"])
+        self.run_remote(script)
+
+    def read_output(self, sftp, cmd_number: int, stream: str) -> str|None:
+        """
+        Text of a packed command's 'history', 'stdout' or 'stderr', or None if
+        the command is not packed (its loose files are still in place).
+        """
+        column = {'history': 2, 'stdout': 3, 'stderr': 4}[stream]
+        try:
+            with sftp.open(f"{self.session_dir}/{COMMAND_INDEX}", "r") as f:
+                rows = [line.split() for line in f.read().decode().splitlines()]
+        except FileNotFoundError:
+            return None
+        hashes = [row[column] for row in rows if len(row) == 5 and row[0] == str(cmd_number)]
+        if not hashes:
+            return None
+        with sftp.open(f"{self.session_dir}/{PACK_INDEX}", "r") as f:
+            entries = {row[0]: row[1:] for row in
+                       (line.split() for line in f.read().decode().splitlines())}
+        offset, length = entries.get(hashes[-1], ["-", "0"])
+        if offset == "-":
+            return None
+        with sftp.open(f"{self.session_dir}/{PACK_FILE}", "r") as f:
+            f.seek(int(offset))
+            return gzip.decompress(f.read(int(length))).decode(errors="replace")
+
+    def list_sessions(self) -> list[SessionInfo]:
+        """All session directories beside this one, oldest first."""
+        text = self.run_remote(f"cd {shlex.quote(self.root)} || exit 0\n{LIST_SESSIONS}")
+        sessions: list[SessionInfo] = []
+        for line in text.splitlines():
+            mtime, kbytes, name = line.split(" ", 2)
+            sessions.append({'name': name, 'mtime': float(mtime), 'size': int(kbytes) * 1024})
+        return sorted(sessions, key=lambda session: session['mtime'])
+
+    def prune(self, **limits) -> list[str]:
+        """
+        Delete old sessions (never this one) with select_prunable's limits,
+        which may be overridden by keyword. Returns the deleted names.
+        """
+        sessions = self.list_sessions()
+        prunable = select_prunable(sessions, {posixpath.basename(self.session_dir)}, **limits)
+        if prunable:
+            self.run_remote(f"cd {shlex.quote(self.root)} && rm -rf -- "
+                            + " ".join(shlex.quote(name) for name in prunable))
+        return prunable
+
+    def prune_in_background(self):
+        """Queue prune() with the default limits on the worker thread."""
+        self.worker.submit(self.prune).add_done_callback(report_failure)
+
+    def close(self):
+        """Pack whatever has finished since the last pack and wait for pending work."""
+        with self.lock:
+            batch, self.finished = self.finished, []
+        self.worker.submit(self.pack, batch).add_done_callback(report_failure)
+        self.worker.shutdown(wait=True)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+session_recorder - append-only recording of a rash session, with indexed replay.
+
+SessionRecorder writes every command, the stdout/stderr chunks it streamed
+(with the time each one arrived) and its exit status to a compact binary
+log: a header (magic, start time), then records of
+
+    kind (1 byte) | seconds since the start (float64) | cmd_number (uint32) |
+    payload length (uint32) | payload
+
+The payload is the command text, the output chunk (UTF-8) or, for an exit
+record, the exit status (int32) and duration (float64). Nothing is ever
+rewritten, so a log cut off by a crash reads fine up to its last complete
+record.
+
+LOG.idx, next to the log, is its seek index: fixed-size entries (time,
+offset, cmd_number, starts-a-command), one at every command and one at
+least every INDEX_INTERVAL seconds of output. SessionPlayer loads only the
+index (a few KiB for hours of session), finds a command or a time in it
+and reads the log from there, replaying at any speed.
+
+Usage:
+    python session_recorder.py LOG [--list] [--command N | --at SECONDS] [--speed X]
+"""
+import argparse
+import bisect
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterator, TypedDict
+
+# header: magic, start of the session (seconds since the epoch)
+HEADER = struct.Struct("<8sd")
+RECORDING_MAGIC = b"RASHREC1"
+# record header: kind, seconds since the start, cmd_number, payload length
+RECORD = struct.Struct("<BdII")
+# exit record payload: exit status (NO_STATUS when unknown), duration
+EXIT = struct.Struct("<id")
+NO_STATUS = -2**31
+# index entry: seconds since the start, log offset, cmd_number, starts a command
+INDEX_ENTRY = struct.Struct("<dQIB")
+INDEX_SUFFIX = ".idx"
+# at most this many seconds of recording between index entries (and between flushes)
+INDEX_INTERVAL = 5.0
+# write buffer of the log
+RECORDING_BUFFER = 64 * 1024
+# longest pause replayed: idle time beyond it is skipped
+REPLAY_MAX_PAUSE = 2.0
+
+KINDS = {1: "command", 2: "stdout", 3: "stderr", 4: "exit"}
+KIND_CODES = {name: code for code, name in KINDS.items()}
+
+
+class Record(TypedDict):
+    """
+    One entry of a recording. text is the command or output chunk ("" for
+    exit records); exit_status and duration are only set on exit records.
+    """
+    kind: str
+    time: float
+    cmd_number: int
+    text: str
+    exit_status: int|None
+    duration: float
+
+
+class SessionRecorder:
+    """
+    Appends a session's commands, timed output chunks and exit statuses to a
+    recording (see module docstring). Safe to share between threads
+    (background shells record into the same log).
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        # pylint: disable-next=consider-using-with
+        self.log = open(path, "ab", buffering=RECORDING_BUFFER)
+        if self.log.tell() == 0:
+            started = time.time()
+            self.log.write(HEADER.pack(RECORDING_MAGIC, started))
+        else:
+            with open(path, "rb") as f:
+                started = HEADER.unpack(f.read(HEADER.size))[1]
+        # record times are monotonic, counted from the session's start
+        self.start = time.monotonic() - (time.time() - started)
+        # pylint: disable-next=consider-using-with
+        self.index = open(path + INDEX_SUFFIX, "ab")
+        self.last_indexed = -INDEX_INTERVAL
+        # commands whose start was recorded (record_result also sees commands that were not)
+        self.started: set[int] = set()
+
+    def write(self, kind: str, cmd_number: int, payload: bytes):
+        """Append one record, with an index entry when one is due; the caller holds the lock."""
+        now = time.monotonic() - self.start
+        if kind == "command" or now - self.last_indexed >= INDEX_INTERVAL:
+            self.index.write(INDEX_ENTRY.pack(now, self.log.tell(), cmd_number,
+                                              kind == "command"))
+            if kind != "command":
+                self.flush_files()
+            self.last_indexed = now
+        self.log.write(RECORD.pack(KIND_CODES[kind], now, cmd_number, len(payload)))
+        self.log.write(payload)
+
+    def flush_files(self):
+        """Flush the log before the index, so index entries never point past the data."""
+        self.log.flush()
+        self.index.flush()
+
+    def flush(self):
+        """Make everything recorded so far readable by a SessionPlayer."""
+        with self.lock:
+            self.flush_files()
+
+    def command_started(self, cmd_number: int, command: str):
+        """Record a command as it is sent to the shell."""
+        with self.lock:
+            self.started.add(cmd_number)
+            self.write("command", cmd_number, command.encode(errors="replace"))
+
+    def output(self, cmd_number: int, stream: str, text: str):
+        """Record a chunk of a command's stdout or stderr."""
+        if text:
+            with self.lock:
+                self.write(stream, cmd_number, text.encode(errors="replace"))
+
+    def tee(self, cmd_number: int,
+            on_output: Callable[[str, str], None]) -> Callable[[str, str], None]:
+        """An on_output callback that records each chunk, then passes it on."""
+        def record_and_forward(stream: str, text: str):
+            self.output(cmd_number, stream, text)
+            on_output(stream, text)
+        return record_and_forward
+
+    def command_finished(self, result: dict[str, Any]):
+        """
+        Record a finished command's exit status; result is a rash.CommandResult.
+        A command whose start was not recorded (batch results, for one) is
+        recorded whole, output included, at the time it finished.
+        """
+        cmd_number = result['cmd_number']
+        status = result['exit_status']
+        with self.lock:
+            if cmd_number not in self.started:
+                self.write("command", cmd_number, result['command'].encode(errors="replace"))
+                for stream in ('stdout', 'stderr'):
+                    for chunk in output_chunks(result[stream]):
+                        self.write(stream, cmd_number, chunk.encode(errors="replace"))
+            self.started.discard(cmd_number)
+            self.write("exit", cmd_number,
+                       EXIT.pack(NO_STATUS if status is None else status, result['duration']))
+            self.flush_files()
+
+    def close(self):
+        """Flush and close the log and its index."""
+        with self.lock:
+            self.log.close()
+            self.index.close()
+
+
+def output_chunks(output) -> Iterator[str]:
+    """A command's output (a string or a large_output.LargeOutput) in pieces."""
+    if isinstance(output, str):
+        if output:
+            yield output
+        return
+    for number in range(output.page_count()):
+        yield output.page(number)
+
+
+def print_record(record: Record):
+    """Default replay consumer: show a record on the local terminal."""
+    if record['kind'] == "command":
+        print(f"\n[{record['time']:10.3f}] {record['cmd_number']}$ {record['text']}", flush=True)
+    elif record['kind'] == "exit":
+        print(f"[exit {record['exit_status']}, {record['duration']:.2f} sec]", flush=True)
+    else:
+        print(record['text'], end="", flush=True,
+              file=sys.stderr if record['kind'] == "stderr" else sys.stdout)
+
+
+class SessionPlayer:
+    """
+    Reads a recording written by SessionRecorder: lists its commands, seeks
+    to a command or a time through the index and replays from there.
+    """
+
+    def __init__(self, path: str):
+        # pylint: disable-next=consider-using-with
+        self.log = open(path, "rb")
+        magic, self.started = HEADER.unpack(self.log.read(HEADER.size).ljust(HEADER.size, b"\0"))
+        if magic != RECORDING_MAGIC:
+            self.log.close()
+            raise ValueError(f"{path} is not a rash session recording")
+        self.size = os.fstat(self.log.fileno()).st_size
+        # (time, offset, cmd_number, starts a command), in log order
+        self.entries = self.load_index(path + INDEX_SUFFIX)
+        self.times = [entry[0] for entry in self.entries]
+
+    def load_index(self, index_path: str) -> list[tuple[float, int, int, int]]:
+        """The index's entries that point into the log; rebuilt by a scan if it is missing."""
+        try:
+            with open(index_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return self.build_index()
+        data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+        return [entry for entry in INDEX_ENTRY.iter_unpack(data) if entry[1] < self.size]
+
+    def build_index(self) -> list[tuple[float, int, int, int]]:
+        """Index entries for the whole log, as SessionRecorder would have written them."""
+        entries: list[tuple[float, int, int, int]] = []
+        last = -INDEX_INTERVAL
+        for offset, record in self.scan(HEADER.size):
+            if record['kind'] == "command" or record['time'] - last >= INDEX_INTERVAL:
+                entries.append((record['time'], offset, record['cmd_number'],
+                                record['kind'] == "command"))
+                last = record['time']
+        return entries
+
+    def scan(self, offset: int) -> Iterator[tuple[int, Record]]:
+        """(offset, record) from offset to the last complete record."""
+        self.log.seek(offset)
+        while True:
+            header = self.log.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            code, seconds, cmd_number, length = RECORD.unpack(header)
+            payload = self.log.read(length)
+            if len(payload) < length or code not in KINDS:
+                return
+            record: Record = {'kind': KINDS[code], 'time': seconds, 'cmd_number': cmd_number,
+                              'text': "", 'exit_status': None, 'duration': 0.0}
+            if code == KIND_CODES["exit"]:
+                status, record['duration'] = EXIT.unpack(payload)
+                record['exit_status'] = None if status == NO_STATUS else status
+            else:
+                record['text'] = payload.decode(errors="replace")
+            yield offset, record
+            offset += RECORD.size + length
+
+    def commands(self) -> list[tuple[int, float]]:
+        """(cmd_number, seconds since the start) of every recorded command, from the index."""
+        return [(cmd_number, seconds) for seconds, _, cmd_number, is_command in self.entries
+                if is_command]
+
+    def seek_command(self, cmd_number: int) -> int:
+        """Log offset of command cmd_number's (last) start."""
+        for _, offset, number, is_command in reversed(self.entries):
+            if is_command and number == cmd_number:
+                return offset
+        raise KeyError(f"command {cmd_number} is not in the recording")
+
+    def seek_time(self, seconds: float) -> int:
+        """Log offset of the last indexed record at or before seconds since the start."""
+        position = bisect.bisect_right(self.times, seconds)
+        return self.entries[position - 1][1] if position else HEADER.size
+
+    def replay(self, offset: int = HEADER.size, speed: float = 1.0,
+               on_record: Callable[[Record], None] = print_record, after: float = 0.0):
+        """
+        Pass the records from offset (those before `after` seconds skipped) to
+        on_record, paced by their timestamps divided by speed (0: no pauses).
+        Pauses are capped at REPLAY_MAX_PAUSE.
+        """
+        previous = None
+        for _, record in self.scan(offset):
+            if record['time'] < after:
+                continue
+            if speed > 0 and previous is not None:
+                time.sleep(min(max(record['time'] - previous, 0.0) / speed, REPLAY_MAX_PAUSE))
+            previous = record['time']
+            on_record(record)
+
+    def close(self):
+        """Close the log."""
+        self.log.close()
+
+
+def main():
+    """
+    Replay a recording, or list its commands
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="recording written by SessionRecorder")
+    parser.add_argument("--list", action="store_true", help="list the recorded commands")
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument("--command", type=int, help="start at this command number")
+    where.add_argument("--at", type=float, default=0.0,
+                       help="start this many seconds into the session")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed multiplier (0: as fast as possible)")
+    args = parser.parse_args()
+
+    player = SessionPlayer(args.log)
+    try:
+        if args.list:
+            for cmd_number, seconds in player.commands():
+                print(f"{cmd_number:>6}  {seconds:>10.3f}")
+        elif args.command is not None:
+            player.replay(player.seek_command(args.command), args.speed)
+        else:
+            player.replay(player.seek_time(args.at), args.speed, after=args.at)
+    except KeyError as e:
+        print(e.args[0], file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        player.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+shell_state - client-side model of the remote shell's state.
+
+Every command run with save_state (see rash.formulate_command) ends by
+calling the shell function SNAPSHOT_FUNCTION defines. It appends a compact
+snapshot to the command's sentinel line: the number of background jobs,
+then the cwd and the exported environment, each as '-' if unchanged since
+the previous command in that shell, else as base64 ($PWD's bytes; env -0,
+NUL-separated NAME=value records). Base64 of raw bytes survives any
+character in a path or value, newlines and control characters included,
+and needs nothing but POSIX sh, env -0 and base64 on the server. Whether
+the environment changed is checked on export -p, a builtin, so only a
+command that exports or unsets something resends it.
+
+The state file used by background shells and reconnects is only rewritten
+when something changed. It is export -p and a cd, so it can be sourced,
+plus a '# rash-state' comment with the snapshot's base64 fields for
+clients (parse_shell_state). It leaves out CONNECTION_VARIABLES, which
+belong to the login that wrote it and would be wrong in the shell that
+sources it; the model leaves them out too.
+
+ShellState applies these snapshots, so cwd, environment and jobs can be
+read locally with no extra commands.
+"""
+import base64
+import binascii
+import threading
+from typing import Any, TypedDict
+
+# exported variables describing one login or its cwd: neither written to the state file nor modelled
+CONNECTION_VARIABLES = ("SSH_CLIENT", "SSH_CONNECTION", "SSH_TTY", "SSH_AUTH_SOCK", "SHLVL",
+                        "OLDPWD", "PWD", "_")
+# export -p lines declaring them
+CONNECTION_DECLARATION = rf"^(declare -[a-zA-Z-]*|export) ({'|'.join(CONNECTION_VARIABLES)})(=|$)"
+# first line of a state file's client-readable copy of the state
+STATE_MARKER = "# rash-state"
+
+# defined once in each primary shell; $1 is the state file, result in $__rash_snap
+SNAPSHOT_FUNCTION = (
+    "__rash_snapshot() { local decl cwd=- vars=-; "
+    f"decl=\"$(export -p | grep -Ev '{CONNECTION_DECLARATION}')\"; "
+    "if [ -z \"${__rash_pwd+x}\" ] || [ \"$PWD\" != \"$__rash_pwd\" ]; then "
+    "__rash_pwd=$PWD; cwd=\"$(printf '%s' \"$PWD\" | base64 | tr -d '\\n')\"; "
+    "__rash_cwd64=$cwd; fi; "
+    "if [ -z \"${__rash_decl+x}\" ] || [ \"$decl\" != \"$__rash_decl\" ]; then "
+    "__rash_decl=$decl; vars=\"$(env -0 | base64 | tr -d '\\n')\"; __rash_vars64=$vars; fi; "
+    "if [ \"$cwd$vars\" != -- ]; then { "
+    f"printf '{STATE_MARKER} %s %s\\n%s\\n' \"$__rash_cwd64\" \"$__rash_vars64\" \"$decl\"; "
+    "printf 'cd -- \"$(printf %%s %s | base64 -d)\"\\n' \"$__rash_cwd64\"; } > \"$1\"; fi; "
+    "__rash_snap=\"$(jobs -p | wc -l | tr -d ' ') $cwd $vars\"; }\n")
+
+
+def decode_field(field: str) -> bytes|None:
+    """A snapshot field's bytes; None if it is '-' (unchanged). Raises ValueError if malformed."""
+    if field == "-":
+        return None
+    return base64.b64decode(field, validate=True)
+
+
+def parse_environment(data: bytes) -> dict[str, str]:
+    """Exported variables from env -0 output, less CONNECTION_VARIABLES."""
+    environment = {}
+    for record in data.decode(errors="replace").split("\0"):
+        name, equals, value = record.partition("=")
+        if equals and name and name not in CONNECTION_VARIABLES:
+            environment[name] = value
+    return environment
+
+
+def parse_shell_state(text: str) -> tuple[str|None, dict[str, str]]:
+    """(cwd, exported variables) from a saved state file's '# rash-state' line."""
+    for line in text.splitlines():
+        if line.startswith(f"{STATE_MARKER} "):
+            try:
+                cwd64, vars64 = (line[len(STATE_MARKER) + 1:].split(" ") + [""])[:2]
+                cwd = decode_field(cwd64)
+                return (cwd.decode(errors="replace") if cwd else None,
+                        parse_environment(decode_field(vars64) or b""))
+            except (binascii.Error, ValueError):
+                break
+    return None, {}
+
+
+class StateChange(TypedDict):
+    """
+    Shell state after one command: cwd, the variables it set (value) or
+    unset (None), the whole exported environment and the number of
+    background jobs
+    """
+    cwd: str|None
+    changed: dict[str, str|None]
+    environment: dict[str, str]
+    jobs: int
+
+
+class ShellState:
+    """
+    The remote shell's cwd, exported environment and job count as of the
+    last applied snapshot. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self.cwd: str|None = None
+        self.environment: dict[str, str] = {}
+        self.jobs = 0
+        self.cmd_number = 0
+        self.lock = threading.Lock()
+
+    def apply(self, cmd_number: int, fields: list[str]) -> StateChange|None:
+        """
+        Update from the snapshot fields of a sentinel line (jobs, cwd,
+        environment); returns what changed, or None if the command carried
+        no snapshot.
+        """
+        if len(fields) < 2 or not fields[0].isdigit():
+            return None
+        try:
+            cwd = decode_field(fields[1])
+            data = decode_field(fields[2]) if len(fields) > 2 else None
+        except (binascii.Error, ValueError):
+            return None
+        with self.lock:
+            changed: dict[str, str|None] = {}
+            if data is not None:
+                changed = self.replace_environment(parse_environment(data))
+            if cwd is not None:
+                self.cwd = cwd.decode(errors="replace")
+            self.jobs = int(fields[0])
+            self.cmd_number = cmd_number
+            return {'cwd': self.cwd, 'changed': changed,
+                    'environment': dict(self.environment), 'jobs': self.jobs}
+
+    def replace_environment(self, environment: dict[str, str]) -> dict[str, str|None]:
+        """Replace the exported environment (lock held); returns the differences."""
+        changed: dict[str, str|None] = {name: None for name in self.environment
+                                        if name not in environment}
+        changed.update({name: value for name, value in environment.items()
+                        if self.environment.get(name) != value})
+        self.environment = environment
+        return changed
+
+    def snapshot(self) -> dict[str, Any]:
+        """Current cwd, environment (a copy), job count and the command they are from."""
+        with self.lock:
+            return {'cwd': self.cwd, 'environment': dict(self.environment),
+                    'jobs': self.jobs, 'cmd_number': self.cmd_number}
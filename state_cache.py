@@ -0,0 +1,209 @@
+"""
+state_cache - memoized read-only state probes for GUI panels.
+
+Panels showing the shell's cwd, environment, a directory listing or git
+status would otherwise send ordinary commands through the shell, each a
+full history-file round trip. StateCache answers them off the shell:
+
+* cwd and exported environment come from the session's ShellState model
+  (shell_state.py) when it has one, for free; otherwise they are parsed
+  from the shell's saved state file (rash.SHELL_STATE_FILE) over SFTP and
+  kept until a command that may change them finishes;
+* directory listings come from the session's FileBrowser
+  (file_browser.py): SFTP listdir_attr, kept for a TTL or until a command
+  that may change files finishes, and prefetched around the cwd;
+* other probes (git status, anything given to query) run on an exec
+  channel in the cwd and are kept until a non-read-only command finishes
+  in the session, the cwd changes, the mtimes they depend on change, or
+  STATE_CACHE_MAX_AGE passes (files edited outside rash).
+
+A refresh that hits the cache costs one request or nothing.
+"""
+import posixpath
+import re
+import shlex
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+import paramiko
+from file_browser import FileBrowser, FileEntry
+from shell_state import parse_shell_state
+
+# seconds an exec probe result (e.g. git status) is trusted without other evidence
+STATE_CACHE_MAX_AGE = 10.0
+
+# commands that only read state; a command line made of these (no redirection) keeps the cache.
+# Not pagers (less/more run shell commands with !) or history (-c/-d change the shell)
+READ_ONLY_COMMANDS = {"ls", "ll", "cat", "pwd", "echo", "printf", "head", "tail", "grep", "egrep",
+                      "fgrep", "rg", "wc", "du", "df", "stat", "file", "which", "type", "whoami",
+                      "id", "uptime", "ps", "printenv", "uname", "tree", "diff",
+                      "cmp", "md5sum", "sha256sum", "true"}
+# read-only only when run without arguments (`env CMD` runs CMD, `date -s`/`hostname NAME` set them)
+READ_ONLY_BARE_COMMANDS = {"env", "date", "hostname"}
+READ_ONLY_GIT = {"status", "log", "diff", "show", "blame", "grep", "ls-files", "rev-parse",
+                 "describe", "shortlog"}
+
+COMMAND_SEPARATORS = re.compile(r"\|\||&&|[|;&\n]")
+
+CONNECTION_ERRORS = (OSError, EOFError, paramiko.SSHException)
+
+
+def is_read_only(command: str) -> bool:
+    """True if every part of the command line is a known read-only command without redirection."""
+    if ">" in command or "`" in command or "$(" in command:
+        return False
+    for part in COMMAND_SEPARATORS.split(command):
+        try:
+            words = shlex.split(part)
+        except ValueError:
+            return False
+        if not words:
+            continue
+        if words[0] == "git":
+            if len(words) < 2 or words[1] not in READ_ONLY_GIT:
+                return False
+        elif words[0] in READ_ONLY_BARE_COMMANDS:
+            if len(words) > 1:
+                return False
+        elif words[0] not in READ_ONLY_COMMANDS:
+            return False
+    return True
+
+
+class StateCache:
+    """
+    Cached state probes for one rash session (see module docstring). Shares
+    the file browser's SFTP client (one SSH channel fewer), which is on the
+    session's current transport and never competes with commands. Safe to
+    share between threads.
+    """
+
+    def __init__(self, session_vars: dict, state_file: str):
+        self.session_vars = session_vars
+        self.state_path = f"{session_vars['session_dir']}/{state_file}"
+        self.entries: dict[tuple, dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stats': 0, 'invalidations': 0}
+        self.browser = FileBrowser(session_vars)
+
+    @contextmanager
+    def client(self):
+        """The file browser's SFTP client, held exclusively."""
+        with self.browser.client_lock:
+            yield self.browser.client()
+
+    def stat_mtime(self, path: str) -> int|None:
+        """mtime of a remote path (one SFTP stat), or None if it does not exist."""
+        self.stats['stats'] += 1
+        try:
+            with self.client() as sftp:
+                return sftp.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def cached(self, key: tuple, mtimes: dict[str, int|None]|None = None,
+               max_age: float|None = None) -> Any:
+        """The cached value for key if still valid, else None (lock held)."""
+        entry = self.entries.get(key)
+        if entry is None or (max_age is not None and time.time() - entry['at'] > max_age):
+            return None
+        if mtimes is not None and entry['mtimes'] != mtimes:
+            return None
+        self.stats['hits'] += 1
+        return entry['value']
+
+    def store(self, key: tuple, value: Any, mtimes: dict[str, int|None]|None = None) -> Any:
+        """Cache value for key with the mtimes it was read at (lock held)."""
+        self.stats['misses'] += 1
+        self.entries[key] = {'value': value, 'mtimes': mtimes, 'at': time.time()}
+        return value
+
+    def shell_state(self) -> tuple[str, dict[str, str]]:
+        """(cwd, environment) of the primary shell, from its model or saved state file."""
+        model = self.session_vars.get('shell_state')
+        if model is not None and model.cwd is not None:
+            snapshot = model.snapshot()
+            self.stats['hits'] += 1
+            return snapshot['cwd'], snapshot['environment']
+        with self.lock:
+            value = self.cached(('state',))
+            if value is not None:
+                return value
+            try:
+                with self.client() as sftp, sftp.open(self.state_path, "r") as f:
+                    cwd, environment = parse_shell_state(f.read().decode(errors="replace"))
+            except FileNotFoundError:
+                # no command has run yet: the shell is where it logged in
+                cwd, environment = None, {}
+            return self.store(('state',), (cwd or self.session_vars['home_dir'], environment))
+
+    def cwd(self) -> str:
+        """The primary shell's working directory."""
+        return self.shell_state()[0]
+
+    def environment(self) -> dict[str, str]:
+        """The primary shell's exported variables."""
+        return self.shell_state()[1]
+
+    def resolve(self, path: str|None) -> str:
+        """path relative to the shell's cwd (the cwd itself for None)."""
+        if path is None:
+            return self.cwd()
+        if path.startswith("~"):
+            path = self.session_vars['home_dir'] + path[1:]
+        return posixpath.normpath(posixpath.join(self.cwd(), path))
+
+    def listdir(self, path: str|None = None) -> list[FileEntry]:
+        """Entries (name, size, mtime, mode, is_dir) of a directory, from the file browser."""
+        return self.browser.listdir(self.resolve(path))
+
+    def query(self, command: str, path: str|None = None,
+              watch: tuple[str, ...] = ()) -> str:
+        """
+        Output of a read-only probe command run in path (default: the cwd) on
+        an exec channel. Cached until a mutating command, a change of the
+        mtime of any path in watch (relative to that directory), or
+        STATE_CACHE_MAX_AGE.
+        """
+        directory = self.resolve(path)
+        with self.lock:
+            mtimes = {name: self.stat_mtime(posixpath.join(directory, name)) for name in watch}
+            value = self.cached(('query', directory, command), mtimes, STATE_CACHE_MAX_AGE)
+            if value is not None:
+                return value
+        _, stdout, _ = self.session_vars['ssh'].exec_command(
+            f"cd {shlex.quote(directory)} && {command}")
+        output = stdout.read().decode(errors="replace")
+        with self.lock:
+            return self.store(('query', directory, command), output, mtimes)
+
+    def git_status(self, path: str|None = None) -> str:
+        """git status --short --branch of the repository at path (default: the cwd)."""
+        return self.query("git status --short --branch 2>&1", path,
+                          # commits, checkouts and staging all rewrite the index
+                          watch=(".git/index",))
+
+    def command_finished(self, command: str, state: dict|None = None):
+        """
+        Drop everything a finished session command may have changed and
+        prefetch the listing of the cwd it left the shell in (state, its
+        shell_state.StateChange, if any).
+        """
+        if not is_read_only(command):
+            with self.lock:
+                self.stats['invalidations'] += 1
+                self.entries.clear()
+            # the cwd first: it is what a panel shows next
+            self.browser.expire(state['cwd'] if state is not None else None)
+        elif state is not None and state['cwd'] is not None:
+            self.browser.prefetch([state['cwd']], neighbours=True)
+
+    def invalidate(self):
+        """Forget every cached probe."""
+        with self.lock:
+            self.entries.clear()
+
+    def close(self):
+        """Close the file browser and its SFTP client."""
+        self.browser.close()
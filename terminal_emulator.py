@@ -8,6 +8,10 @@ import os
 import logging
 import getpass
 import select
+import shutil
+import signal
+import termios
+import tty
 import paramiko
 
 #HOST = 'login-ci.rc.colorado.edu'
@@ -21,31 +25,88 @@ private_key_path = os.path.expanduser("~/.ssh/id_rsa")
 
 TRANSPORT = None
 
+# bytes asked of the channel (or stdin) per read
+TERMINAL_READ_CHUNK = 64 * 1024
+# most channel output gathered into one write to the terminal
+TERMINAL_WRITE_MAX = 256 * 1024
+
+def terminal_size() -> tuple[int, int]:
+    """(columns, rows) of the local terminal, 80x24 if there is none."""
+    size = shutil.get_terminal_size((80, 24))
+    return size.columns, size.lines
+
+def write_all(fd: int, data: bytes):
+    """Write all of data to a file descriptor."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def drain_channel(channel: paramiko.Channel) -> bytes:
+    """The output the channel has ready, up to TERMINAL_WRITE_MAX; b"" once it has ended."""
+    data = channel.recv(TERMINAL_READ_CHUNK)
+    if not data:
+        return b""
+    chunks, size = [data], len(data)
+    while size < TERMINAL_WRITE_MAX and channel.recv_ready():
+        chunks.append(channel.recv(TERMINAL_READ_CHUNK))
+        size += len(chunks[-1])
+    return b"".join(chunks)
+
 def interactive_shell(channel: paramiko.Channel):
-    """Simple interactive loop to send user input and print server output."""
-    print("Entering interactive shell (type 'exit' or Ctrl-D to quit)")
+    """
+    Pass the local terminal through to the channel's remote shell until it
+    exits. stdin is in raw mode, so keystrokes (Ctrl-C and Ctrl-D too) go
+    out as typed and full-screen programs work; window size changes are
+    forwarded; output is written as raw bytes in large blocks. The loop
+    blocks in select on the channel, stdin and a SIGWINCH pipe, so an idle
+    shell costs no CPU.
+    """
+    stdin_fd, stdout_fd = sys.stdin.fileno(), sys.stdout.fileno()
+    saved_mode = termios.tcgetattr(stdin_fd) if os.isatty(stdin_fd) else None
+    # the signal handler only wakes the loop; the resize request is sent from the loop
+    resize_pipe = os.pipe()
+    os.set_blocking(resize_pipe[1], False)
+
+    def on_resize(*_):
+        try:
+            os.write(resize_pipe[1], b"\0")
+        except BlockingIOError:
+            # a burst of resizes filled the pipe: the loop has a wake-up pending already
+            pass
+
+    previous_handler = signal.signal(signal.SIGWINCH, on_resize)
+    print("Entering interactive shell (exit the remote shell to quit)", flush=True)
     try:
+        if saved_mode is not None:
+            tty.setraw(stdin_fd)
+        readers = [channel, stdin_fd, resize_pipe[0]]
         while True:
-            # Check if there is data from the server
-            if channel.recv_ready():
-                data = channel.recv(4096).decode("utf-8")
-                if data:
-                    print(data, end="", flush=True)
-
-            # Check if there is input from the user
-            if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
-                user_input = sys.stdin.readline()
-                if not user_input:  # EOF (Ctrl-D)
-                    break
-                if user_input.strip().lower() in ["exit", "quit"]:
+            readable, _, _ = select.select(readers, [], [])
+            if channel in readable:
+                data = drain_channel(channel)
+                if not data:
                     break
-                channel.send(user_input.encode("utf-8"))
-
-            # If the channel is closed, exit
-            if channel.closed or channel.exit_status_ready():
-                break
+                write_all(stdout_fd, data)
+            if stdin_fd in readable:
+                keys = os.read(stdin_fd, TERMINAL_READ_CHUNK)
+                if keys:
+                    channel.sendall(keys)
+                else:
+                    # stdin is not a terminal and has ended: let the remote shell see EOF
+                    channel.shutdown_write()
+                    readers.remove(stdin_fd)
+            if resize_pipe[0] in readable:
+                os.read(resize_pipe[0], TERMINAL_READ_CHUNK)
+                channel.resize_pty(*terminal_size())
     except KeyboardInterrupt:
-        print("\nExiting interactive shell.")
+        pass
+    finally:
+        if saved_mode is not None:
+            termios.tcsetattr(stdin_fd, termios.TCSADRAIN, saved_mode)
+        signal.signal(signal.SIGWINCH, previous_handler)
+        for fd in resize_pipe:
+            os.close(fd)
+    print("\nExiting interactive shell.")
 
 def send_command(cmd: str, channel: paramiko.Channel, delay: float = 0.5) -> str:
     """
@@ -94,18 +155,14 @@ try:
         # Open a channel for executing commands
         CHANNEL = transport.open_session()
         print("get_pty()", end="", file=sys.stderr)
-        CHANNEL.get_pty()
+        COLUMNS, ROWS = terminal_size()
+        CHANNEL.get_pty(term=os.environ.get("TERM", "xterm"), width=COLUMNS, height=ROWS)
         print(file=sys.stderr)
         print("invoke_shell()", end="", file=sys.stderr)
         CHANNEL.invoke_shell()
         print(file=sys.stderr)
 
-
-        # (Optional) read initial prompt or MOTD
-        time.sleep(0.5)
-        if CHANNEL.recv_ready():
-            banner = CHANNEL.recv(4096).decode('utf-8')
-            print(banner)
+        # the banner / MOTD is shown by interactive_shell as it arrives
         interactive_shell(CHANNEL)
 
         RUN_TEST_COMMANDS = False
@@ -0,0 +1,35 @@
+"""
+Fixtures for tests against local_server.py: an in-process SSH/SFTP server
+backed by a local bash, and a rash session connected to it.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable-next=wrong-import-position
+import rash
+# pylint: disable-next=wrong-import-position
+from local_server import start_local_server, stop_local_server
+
+
+@pytest.fixture
+def server():
+    """A local SSH server; its home directory is a fresh temporary one."""
+    local = start_local_server()
+    yield local
+    stop_local_server(local)
+
+
+@pytest.fixture
+def session_vars(server):  # pylint: disable=redefined-outer-name
+    """An initialized rash session on the local server, with login details for reconnects."""
+    connection: rash.Connection = {'host': "127.0.0.1", 'port': server['port'],
+                                   'username': "rash", 'pkey': None,
+                                   'password': server['password']}
+    channel, ssh = rash.connect(connection)
+    attached = rash.initialize_session(channel, ssh)
+    attached['connection'] = connection
+    yield attached
+    rash.close_session(attached)
@@ -0,0 +1,16 @@
+"""rash_async sessions logging in with credentials resolved once."""
+import asyncio
+import getpass
+import rash
+from rash_async import run_everywhere
+
+
+def test_resolved_credentials_prompt_once(server, monkeypatch, capsys):
+    """Several hosts share one password prompt; their I/O threads never ask."""
+    prompts = []
+    monkeypatch.setattr(getpass, "getpass",
+                        lambda prompt="": prompts.append(prompt) or server['password'])
+    login = rash.resolve_connection("127.0.0.1", "rash", None, port=server['port'])
+    asyncio.run(run_everywhere([dict(login) for _ in range(3)], "echo hello"))
+    assert len(prompts) == 1
+    assert capsys.readouterr().out.count("127.0.0.1: hello") == 3
@@ -0,0 +1,26 @@
+"""FileBrowser listings after commands that change files."""
+import os
+from file_browser import FileBrowser
+
+
+def test_expire_refetches_file_rewritten_in_place(server, session_vars):
+    """Appending to a file leaves the directory mtime alone; the new size must still show."""
+    directory = os.path.join(server['home_dir'], "browse")
+    os.mkdir(directory)
+    path = os.path.join(directory, "log.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("x")
+    # long unchanged, so its mtime looks trustworthy
+    os.utime(directory, (os.stat(directory).st_atime - 3600, os.stat(directory).st_mtime - 3600))
+    browser = FileBrowser(session_vars)
+    try:
+        assert [entry['size'] for entry in browser.listdir(directory)] == [1]
+        directory_mtime = os.stat(directory).st_mtime_ns
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("more")
+        assert os.stat(directory).st_mtime_ns == directory_mtime
+
+        browser.expire()
+        assert [entry['size'] for entry in browser.listdir(directory)] == [5]
+    finally:
+        browser.close()
@@ -0,0 +1,32 @@
+"""Outputs past the session's large output threshold, streamed and framed."""
+import pytest
+import batch
+import rash
+from large_output import LargeOutput
+
+EXPECTED = "".join(f"{i}\n" for i in range(1, 2001))
+
+
+@pytest.mark.parametrize("framed", [False, True])
+def test_output_past_threshold_is_spilled(session_vars, framed):
+    """Both result paths honour the session's threshold and still show everything."""
+    session_vars['framed'] = framed
+    session_vars['large_output_threshold'] = 1000
+    shown = []
+    result = rash.execute_command(1, session_vars, "seq 1 2000",
+                                  on_output=lambda stream, text: shown.append(text))
+    assert isinstance(result['stdout'], LargeOutput)
+    assert result['stdout'].slice(0, len(result['stdout'])) == EXPECTED
+    assert "".join(shown) == EXPECTED
+    result = rash.execute_command(2, session_vars, "echo small", on_output=lambda *_: None)
+    assert result['stdout'] == "small"
+
+
+def test_batch_output_past_threshold_is_spilled(session_vars):
+    """Batched commands share the framed decoding."""
+    session_vars['large_output_threshold'] = 1000
+    results = batch.execute_batch(1, session_vars, ["seq 1 2000", "echo small"],
+                                  on_output=lambda *_: None)
+    assert isinstance(results[0]['stdout'], LargeOutput)
+    assert "2000\n" in results[0]['stdout']
+    assert results[1]['stdout'] == "small"
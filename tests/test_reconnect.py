@@ -0,0 +1,47 @@
+"""Reconnect and resume (rash.run_resumable) when the connection drops mid-command."""
+import threading
+import time
+import paramiko
+import rash
+
+
+def test_dropped_socket_mid_command_reconnects(session_vars, monkeypatch):
+    """
+    Closing the socket under a running command must not escape run_resumable,
+    even while paramiko's transport thread has not finished noticing the drop
+    (it closes the channels one by one before it marks itself inactive).
+    """
+    unlink = paramiko.Channel._unlink  # pylint: disable=protected-access
+
+    def slow_unlink(channel):
+        time.sleep(0.2)
+        unlink(channel)
+
+    monkeypatch.setattr(paramiko.Channel, "_unlink", slow_unlink)
+    sock = session_vars['ssh'].get_transport().sock
+    threading.Timer(0.3, sock.close).start()
+    assert rash.run_resumable(1, session_vars, "sleep 1; echo finished") == 2
+    assert rash.connection_alive(session_vars)
+
+    result = rash.execute_command(2, session_vars, "echo after", on_output=lambda *_: None)
+    assert result['stdout'].strip() == "after"
+    assert result['exit_status'] == 0
+
+
+def test_file_error_on_live_connection_keeps_shell(session_vars, monkeypatch):
+    """A result file error with the connection up is the command's failure, not a drop."""
+    rash.execute_command(1, session_vars, "unexported=kept", on_output=lambda *_: None)
+
+    def missing_file(*_args, **_kwargs):
+        raise FileNotFoundError("stdout-cmd2")
+
+    def no_reconnect(_session_vars):
+        raise AssertionError("reconnected a live connection")
+
+    monkeypatch.setattr(rash, "stream_command_output", missing_file)
+    monkeypatch.setattr(rash, "reconnect_session", no_reconnect)
+    assert rash.run_resumable(2, session_vars, "true") == 3
+    monkeypatch.undo()
+
+    result = rash.execute_command(3, session_vars, "echo $unexported", on_output=lambda *_: None)
+    assert result['stdout'].strip() == "kept"
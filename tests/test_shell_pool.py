@@ -0,0 +1,20 @@
+"""Background jobs (ShellPool) run in the primary shell's state as of :bg."""
+import os
+import rash
+
+
+def test_job_runs_where_the_shell_was_when_submitted(server, session_vars):
+    """A job queued behind another still starts in the cwd it was submitted from."""
+    first = os.path.join(server['home_dir'], "first")
+    later = os.path.join(server['home_dir'], "later")
+    os.mkdir(first)
+    os.mkdir(later)
+    rash.execute_command(1, session_vars, f"cd {first}", on_output=lambda *_: None)
+    pool = rash.ShellPool(session_vars, size=1)
+    try:
+        pool.submit(2, "sleep 1")
+        queued = pool.submit(3, "pwd")
+        rash.execute_command(4, session_vars, f"cd {later}", on_output=lambda *_: None)
+        assert queued.result(timeout=30)['stdout'].strip() == first
+    finally:
+        pool.close()
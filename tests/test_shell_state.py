@@ -0,0 +1,37 @@
+"""The shell state file that background shells and reconnects source."""
+import rash
+from shell_state import parse_shell_state
+
+
+def test_state_file_leaves_out_connection_variables(session_vars):
+    """A shell sourcing the state keeps its own SSH_*, SHLVL and PWD values."""
+    rash.execute_command(1, session_vars,
+                         "export SSH_CONNECTION='1.2.3.4 1 5.6.7.8 22' SHLVL=7 KEPT=yes",
+                         on_output=lambda *_: None)
+    with open(f"{session_vars['session_dir']}/{rash.SHELL_STATE_FILE}", encoding="utf-8") as f:
+        state = f.read()
+    assert 'KEPT="yes"' in state
+    for name in ("SSH_CONNECTION", "SHLVL", "PWD", "OLDPWD"):
+        assert f" {name}=" not in state
+    assert "\ncd " in state
+
+
+def test_state_survives_newlines_and_control_characters(session_vars):
+    """Multi-line values and odd directory names reach the model and the state file intact."""
+    odd_dir = f"{session_vars['session_dir']}/odd\n\tdir é"
+    result = rash.execute_command(1, session_vars,
+                                  f"cd {session_vars['session_dir']}"
+                                  " && mkdir \"$(printf 'odd\\n\\tdir \\303\\251')\" && cd odd*"
+                                  " && export MULTI=\"$(printf 'one\\ntwo = \"three\"')\"",
+                                  on_output=lambda *_: None)
+    assert result['state']['cwd'] == odd_dir
+    assert result['state']['environment']['MULTI'] == 'one\ntwo = "three"'
+    assert result['state']['changed']['MULTI'] == 'one\ntwo = "three"'
+    assert "PWD" not in result['state']['environment']
+    with open(f"{session_vars['session_dir']}/{rash.SHELL_STATE_FILE}", encoding="utf-8") as f:
+        cwd, environment = parse_shell_state(f.read())
+    assert cwd == odd_dir
+    assert environment['MULTI'] == 'one\ntwo = "three"'
+    result = rash.execute_command(2, session_vars, "true", on_output=lambda *_: None)
+    assert result['state']['changed'] == {}
+    assert result['state']['cwd'] == odd_dir
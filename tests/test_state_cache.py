@@ -0,0 +1,11 @@
+"""Which command lines keep the panel state cache."""
+from state_cache import is_read_only
+
+
+def test_commands_that_set_system_state_are_not_read_only():
+    """date and hostname only read when run bare; with arguments they may set the clock or name."""
+    assert is_read_only("date")
+    assert is_read_only("hostname && pwd")
+    assert not is_read_only("date -s '2020-01-01 00:00'")
+    assert not is_read_only("hostname newname")
+    assert not is_read_only("env rm -rf build")
@@ -0,0 +1,46 @@
+"""Transfers stay within the server's per-connection channel limit."""
+import hashlib
+import os
+import threading
+import rash
+import transfer
+from state_cache import StateCache
+
+# OpenSSH's default MaxSessions: channels one connection may have open at once
+MAX_SESSIONS = 10
+
+
+def sample_channels(ssh, stop: threading.Event, counts: list[int]):
+    """Record the transport's open channel count every few milliseconds until stop."""
+    transport = ssh.get_transport()
+    while not stop.wait(0.002):
+        counts.append(len(transport._channels))  # pylint: disable=protected-access
+
+
+def test_transfers_stay_under_max_sessions(server, session_vars, monkeypatch, tmp_path):
+    """An upload and a download (with the file browser and a command in use) open < 10 channels."""
+    # several chunks per lane, so copying and hashing overlap if they can
+    monkeypatch.setattr(transfer, "TRANSFER_CHUNK_SIZE", 64 * 1024)
+    data = os.urandom(1024 * 1024 + 123)
+    local = tmp_path / "data.bin"
+    local.write_bytes(data)
+    rash.execute_command(1, session_vars, "echo ready", on_output=lambda stream, text: None)
+    # as in the terminal: the file browser's client is open too (closed by close_session)
+    session_vars['state_cache'] = StateCache(session_vars, rash.SHELL_STATE_FILE)
+    session_vars['state_cache'].listdir(server['home_dir'])
+
+    stop, counts = threading.Event(), []
+    sampler = threading.Thread(target=sample_channels, args=(session_vars['ssh'], stop, counts))
+    sampler.start()
+    try:
+        rash.transfer_file("upload", f"{local} {server['home_dir']}/up.bin", session_vars)
+        rash.transfer_file("download", f"{server['home_dir']}/up.bin {tmp_path}/down.bin",
+                           session_vars)
+    finally:
+        stop.set()
+        sampler.join()
+
+    with open(os.path.join(server['home_dir'], "up.bin"), "rb") as f:
+        assert hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest()
+    assert (tmp_path / "down.bin").read_bytes() == data
+    assert counts and max(counts) < MAX_SESSIONS
@@ -0,0 +1,129 @@
+"""The web API: credentials, never server-side paths or prompts; errors end cleanly."""
+import getpass
+import io
+import threading
+import time
+import paramiko
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+import rash
+import rash_web
+from rash_web import SessionPool, create_app
+
+
+@pytest.fixture(name="client")
+def api_client(monkeypatch):
+    """A test client of the API; prompting on the server's terminal fails the test."""
+    def no_prompt(prompt=""):
+        raise AssertionError(f"prompted on the server: {prompt}")
+    monkeypatch.setattr(getpass, "getpass", no_prompt)
+    pool = SessionPool()
+    yield create_app(pool).test_client()
+    pool.close()
+
+
+def ed25519_key(passphrase: bytes|None = None) -> str:
+    """A new Ed25519 private key in OpenSSH format, encrypted with passphrase if given."""
+    encryption = serialization.BestAvailableEncryption(passphrase) if passphrase \
+        else serialization.NoEncryption()
+    return Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH, encryption).decode()
+
+
+def test_rejects_bad_keys_with_400(server, client, tmp_path):
+    """Key paths, encrypted keys without passphrase and other key types are client errors."""
+    login = {'host': "127.0.0.1", 'port': server['port'], 'username': "rash"}
+    key_file = tmp_path / "id_ed25519"
+    key_file.write_text(ed25519_key(b"secret"))
+    rsa_key = io.StringIO()
+    paramiko.RSAKey.generate(1024).write_private_key(rsa_key)
+
+    for key in (str(key_file), str(tmp_path / "missing"), ed25519_key(b"secret"),
+                rsa_key.getvalue()):
+        response = client.post("/sessions", json={**login, 'key': key})
+        assert response.status_code == 400, key
+    assert client.post("/sessions", json=login).status_code == 400
+    response = client.post("/sessions", json={**login, 'password': server['password'],
+                                              'port': "ssh"})
+    assert response.status_code == 400
+
+
+def test_accepts_key_material_or_password(server, client):
+    """
+    An encrypted key with its passphrase is used to log in (the local server
+    refuses keys, so the login fails at the server: 502); a password logs in.
+    """
+    login = {'host': "127.0.0.1", 'port': server['port'], 'username': "rash"}
+    response = client.post("/sessions", json={**login, 'key': ed25519_key(b"secret"),
+                                              'passphrase': "secret"})
+    assert response.status_code == 502, response.get_data(as_text=True)
+    response = client.post("/sessions", json={**login, 'password': server['password']})
+    assert response.status_code == 201, response.get_data(as_text=True)
+
+
+def test_failed_command_ends_its_stream(server, client, monkeypatch):
+    """A command that raises (here a sentinel timeout) still sends 'done' with an error."""
+    login = {'host': "127.0.0.1", 'port': server['port'], 'username': "rash",
+             'password': server['password']}
+    session = client.post("/sessions", json=login).get_json()
+
+    def timed_out(*_args, **_kwargs):
+        raise RuntimeError("no sentinel within 60 sec")
+
+    monkeypatch.setattr(rash, "execute_command", timed_out)
+    submitted = client.post(f"/sessions/{session['session_id']}/commands",
+                            json={'command': "true"}).get_json()
+    stream = client.get(f"/sessions/{session['session_id']}/commands/"
+                        f"{submitted['cmd_number']}/stream").get_data(as_text=True)
+    assert "event: done" in stream and "RuntimeError" in stream
+
+
+def test_rejects_malformed_requests_with_400(server, client):
+    """Commands that are not strings and non-numeric history limits are client errors."""
+    login = {'host': "127.0.0.1", 'port': server['port'], 'username': "rash",
+             'password': server['password']}
+    session_id = client.post("/sessions", json=login).get_json()['session_id']
+    for body in (["ls"], {'command': 42}, {'command': " "}, {}):
+        response = client.post(f"/sessions/{session_id}/commands", json=body)
+        assert response.status_code == 400, body
+    for limit in ("abc", "0", "-1"):
+        response = client.get(f"/sessions/{session_id}/history?limit={limit}")
+        assert response.status_code == 400, limit
+    assert client.get(f"/sessions/{session_id}/history?limit=5").status_code == 200
+
+
+def test_concurrent_logins_respect_the_session_limit(server, monkeypatch):
+    """Logins racing each other may not connect more sessions than the per-user limit."""
+    monkeypatch.setattr(rash_web, "WEB_SESSIONS_PER_USER", 2)
+    connect = rash.connect
+
+    def slow_connect(connection):
+        # every login passes the limit check before any of them is connected
+        time.sleep(0.3)
+        return connect(connection)
+
+    monkeypatch.setattr(rash, "connect", slow_connect)
+    connection: rash.Connection = {'host': "127.0.0.1", 'port': server['port'],
+                                   'username': "rash", 'pkey': None,
+                                   'password': server['password']}
+    pool = SessionPool()
+    outcomes: list[str] = []
+
+    def login():
+        try:
+            pool.acquire(connection)
+            outcomes.append("connected")
+        except PermissionError:
+            outcomes.append("refused")
+
+    threads = [threading.Thread(target=login) for _ in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(outcomes) == ["connected", "connected", "refused", "refused"]
+        assert not pool.connecting
+    finally:
+        pool.close()
@@ -0,0 +1,347 @@
+"""
+transfer - parallel, verified, resumable file transfer over SFTP.
+
+upload() and download() split a file into TRANSFER_CHUNK_SIZE chunks and
+move them over several SFTP clients at once: the session's own (clients),
+or else TRANSFER_LANES opened for the transfer. Each client has its own
+SSH channel, and so its own flow-control window, and keeps its files open
+with requests pipelined across chunks. A transfer is then not held to one
+request stream's rate (window / RTT). Servers cap the channels of one
+connection (OpenSSH MaxSessions, 10 by default), which is why a session
+lends its clients rather than have each transfer open more.
+
+Data goes to a partial file next to the destination (DEST.rash-part), which
+is renamed over the destination once every chunk's sha256 matches the
+source's. Remote chunks are hashed on the remote (dd | sha256sum) on one
+exec channel, once no chunk is being copied. Mismatched chunks are copied
+again. The same checksums make transfers
+resumable: running an interrupted transfer again compares the partial
+file's chunks with the source's and copies only those that differ.
+"""
+import hashlib
+import os
+import posixpath
+import queue
+import shlex
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, TypedDict
+import paramiko
+
+# bytes per chunk: the unit of parallelism, verification and resume
+TRANSFER_CHUNK_SIZE = 8 * 1024 * 1024
+# SFTP clients (SSH channels) a transfer opens to move chunks at once, if not given the session's
+TRANSFER_LANES = 4
+# bytes per SFTP read or write request; requests are pipelined
+TRANSFER_BLOCK_SIZE = 32 * 1024
+# times mismatched chunks are copied again before the transfer fails
+TRANSFER_RETRIES = 2
+# seconds between progress callbacks
+TRANSFER_PROGRESS_INTERVAL = 0.5
+# partial file next to the destination
+PART_SUFFIX = ".rash-part"
+
+CONNECTION_ERRORS = (OSError, EOFError, paramiko.SSHException)
+
+# done bytes, total bytes, seconds since the transfer started
+ProgressCallback = Callable[[int, int, float], None]
+
+
+class TransferResult(TypedDict):
+    """
+    A finished transfer: bytes copied this time and bytes an interrupted
+    earlier attempt had already put in place
+    """
+    source: str
+    destination: str
+    size: int
+    transferred: int
+    resumed: int
+    seconds: float
+    verified: bool
+
+
+class Transfer:
+    """
+    One upload or download (see module docstring). Chunks are copied by a
+    thread per lane. A lane is a dict with its SFTP client, whether the
+    transfer opened that client, and the remote and local files it keeps
+    open from chunk to chunk, so a chunk costs no open/close round trips.
+    """
+
+    def __init__(self, ssh, uploading: bool, source: str, destination: str):
+        self.ssh = ssh
+        self.uploading = uploading
+        self.paths = {'source': source, 'destination': destination}
+        self.lanes: queue.Queue = queue.Queue()
+        self.size = 0
+        # byte counts and times; 'callback' is set by run
+        self.progress: dict[str, Any] = {'done': 0, 'transferred': 0, 'resumed': 0,
+                                         'reported': 0.0, 'start': time.perf_counter()}
+        self.lock = threading.Lock()
+
+    def open_lanes(self, clients: list|None):
+        """One lane per borrowed client, or else open TRANSFER_LANES clients, all at once."""
+        if clients is None:
+            with ThreadPoolExecutor(max_workers=TRANSFER_LANES) as pool:
+                clients = list(pool.map(lambda _: self.ssh.open_sftp(), range(TRANSFER_LANES)))
+            owned = True
+        else:
+            owned = False
+        for client in clients:
+            self.lanes.put({'sftp': client, 'owned': owned, 'remote': None, 'local': None})
+
+    @contextmanager
+    def lane(self):
+        """A free lane, returned to the lanes afterwards."""
+        lane = self.lanes.get()
+        try:
+            yield lane
+        finally:
+            self.lanes.put(lane)
+
+    def lane_files(self, lane: dict) -> tuple[Any, Any]:
+        """The lane's (remote, local) file handles, opened on first use."""
+        if lane['remote'] is None:
+            if self.uploading:
+                lane['remote'] = lane['sftp'].open(self.paths['part'], "r+")
+                # replies are only checked on close, so requests go out back to back
+                lane['remote'].set_pipelined(True)
+                lane['local'] = open(self.paths['source'], "rb") # pylint: disable=consider-using-with
+            else:
+                lane['remote'] = lane['sftp'].open(self.paths['source'], "r")
+                lane['local'] = open(self.paths['part'], "r+b") # pylint: disable=consider-using-with
+        return lane['remote'], lane['local']
+
+    def settle(self, close_clients: bool = False):
+        """
+        Close every lane's files, which waits for all pipelined writes to be
+        acknowledged (and fails if one was not), and optionally the clients
+        the transfer opened. No lane may be in use.
+        """
+        lanes = [self.lanes.get() for _ in range(self.lanes.qsize())]
+        try:
+            for lane in lanes:
+                remote, local, lane['remote'], lane['local'] = \
+                    lane['remote'], lane['local'], None, None
+                try:
+                    if local is not None:
+                        local.close()
+                    if remote is not None:
+                        remote.close()
+                except CONNECTION_ERRORS:
+                    # when tearing down after a failure, that failure is the one to report
+                    if not close_clients:
+                        raise
+        finally:
+            for lane in lanes:
+                if close_clients and lane['owned']:
+                    try:
+                        lane['sftp'].close()
+                    except CONNECTION_ERRORS:
+                        pass
+                self.lanes.put(lane)
+
+    def chunks(self) -> list[int]:
+        """Indices of the file's chunks."""
+        return list(range(-(-self.size // TRANSFER_CHUNK_SIZE)))
+
+    def chunk_span(self, index: int) -> tuple[int, int]:
+        """(offset, length) of a chunk."""
+        offset = index * TRANSFER_CHUNK_SIZE
+        return offset, min(TRANSFER_CHUNK_SIZE, self.size - offset)
+
+    def resolve_paths(self, sftp):
+        """Source size; destination inside a directory if it names one."""
+        if self.uploading:
+            self.size = os.stat(self.paths['source']).st_size
+            try:
+                into_dir = stat.S_ISDIR(sftp.stat(self.paths['destination']).st_mode or 0)
+            except FileNotFoundError:
+                into_dir = False
+            if into_dir:
+                self.paths['destination'] = posixpath.join(
+                    self.paths['destination'], os.path.basename(self.paths['source']))
+        else:
+            self.size = sftp.stat(self.paths['source']).st_size or 0
+            if os.path.isdir(self.paths['destination']):
+                self.paths['destination'] = os.path.join(
+                    self.paths['destination'], posixpath.basename(self.paths['source']))
+        self.paths['part'] = self.paths['destination'] + PART_SUFFIX
+
+    def prepare_part(self, sftp) -> bool:
+        """
+        True if a partial file of the right size is left from an earlier
+        attempt; otherwise create one.
+        """
+        try:
+            size = sftp.stat(self.paths['part']).st_size if self.uploading \
+                else os.path.getsize(self.paths['part'])
+            if size == self.size:
+                return True
+        except FileNotFoundError:
+            pass
+        # pylint: disable-next=consider-using-with
+        with (sftp.open(self.paths['part'], "w") if self.uploading
+              else open(self.paths['part'], "wb")) as f:
+            f.truncate(self.size)
+        return False
+
+    def report(self, nbytes: int, moved: bool = True):
+        """Count bytes in place and call the progress callback at most every interval."""
+        with self.lock:
+            self.progress['done'] += nbytes
+            self.progress['transferred' if moved else 'resumed'] += nbytes
+            now = time.perf_counter()
+            callback = self.progress['callback']
+            if callback is None or (now - self.progress['reported'] < TRANSFER_PROGRESS_INTERVAL
+                                    and self.progress['done'] < self.size):
+                return
+            self.progress['reported'] = now
+            # chunks copied again after a mismatch count twice
+            done = min(self.progress['done'], self.size)
+        callback(done, self.size, now - self.progress['start'])
+
+    def copy_chunk(self, index: int) -> str:
+        """Copy one chunk on a free lane; returns the sha256 of the bytes copied."""
+        offset, length = self.chunk_span(index)
+        digest = hashlib.sha256()
+        with self.lane() as lane:
+            remote, local = self.lane_files(lane)
+            local.seek(offset)
+            if self.uploading:
+                remote.seek(offset)
+                while length > 0:
+                    block = local.read(min(TRANSFER_BLOCK_SIZE, length))
+                    if not block:
+                        raise EOFError(f"{self.paths['source']} shrank during the transfer")
+                    remote.write(block)
+                    digest.update(block)
+                    length -= len(block)
+                    self.report(len(block))
+            else:
+                blocks = [(start, min(TRANSFER_BLOCK_SIZE, offset + length - start))
+                          for start in range(offset, offset + length, TRANSFER_BLOCK_SIZE)]
+                # readv sends every request of the chunk before reading the replies
+                for block in remote.readv(blocks):
+                    local.write(block)
+                    digest.update(block)
+                    self.report(len(block))
+        return digest.hexdigest()
+
+    def copy(self, pending: list[int]) -> dict[int, str]:
+        """Copy chunks over all lanes at once; returns the checksums of the bytes copied."""
+        with ThreadPoolExecutor(max_workers=self.lanes.qsize()) as pool:
+            futures = [pool.submit(self.copy_chunk, index) for index in pending]
+            try:
+                checksums = {index: future.result() for index, future in zip(pending, futures)}
+            except BaseException:
+                # one lane failing (usually the connection) stops the others
+                pool.shutdown(cancel_futures=True)
+                raise
+        # written data is acknowledged before anything reads it back
+        self.settle()
+        return checksums
+
+    def local_checksums(self, indices: list[int]) -> dict[int, str]:
+        """sha256 of chunks of the local file (the source, or the partial download)."""
+        checksums = {}
+        with open(self.paths['source' if self.uploading else 'part'], "rb") as f:
+            for index in indices:
+                offset, length = self.chunk_span(index)
+                f.seek(offset)
+                checksums[index] = hashlib.sha256(f.read(length)).hexdigest()
+        return checksums
+
+    def remote_checksums(self, indices: list[int]) -> dict[int, str]:
+        """sha256 of chunks of the remote file, hashed on the remote over one exec channel."""
+        path = shlex.quote(self.paths['part' if self.uploading else 'source'])
+        _, stdout, _ = self.ssh.exec_command(
+            f"for i in {' '.join(map(str, indices))}; do "
+            f"dd if={path} bs={TRANSFER_CHUNK_SIZE} skip=$i count=1 2>/dev/null "
+            "| sha256sum | cut -c1-64; done")
+        digests = stdout.read().decode().split()
+        if len(digests) != len(indices):
+            raise RuntimeError(f"could not checksum {path} on the remote (dd, sha256sum)")
+        return dict(zip(indices, digests))
+
+    def resume(self) -> tuple[dict, dict, list[int]]:
+        """(source checksums, partial file checksums, chunks that differ) of a partial file."""
+        if self.uploading:
+            source = self.local_checksums(self.chunks())
+            part = self.remote_checksums(self.chunks())
+        else:
+            part = self.local_checksums(self.chunks())
+            source = self.remote_checksums(self.chunks())
+        pending = [index for index in self.chunks() if source[index] != part[index]]
+        for index in self.chunks():
+            if index not in pending:
+                self.report(self.chunk_span(index)[1], moved=False)
+        return source, part, pending
+
+    def finish(self, sftp):
+        """Put the complete partial file in place."""
+        if self.uploading:
+            sftp.posix_rename(self.paths['part'], self.paths['destination'])
+        else:
+            os.replace(self.paths['part'], self.paths['destination'])
+
+    def run(self, on_progress: ProgressCallback|None = None,
+            clients: list|None = None) -> TransferResult:
+        """
+        Copy (or resume), verify and put the file in place, over the given
+        SFTP clients (left open) or TRANSFER_LANES of its own.
+        """
+        self.progress['callback'] = on_progress
+        self.open_lanes(clients)
+        try:
+            with self.lane() as lane:
+                self.resolve_paths(lane['sftp'])
+                resuming = self.prepare_part(lane['sftp'])
+            source, part, pending = self.resume() if resuming else ({}, {}, self.chunks())
+            for _ in range(TRANSFER_RETRIES + 1):
+                copied = self.copy(pending)
+                if self.uploading:
+                    source.update(copied)
+                    part.update(self.remote_checksums(pending))
+                else:
+                    part.update(copied)
+                    # the remote source does not change: hashed once
+                    source = source or self.remote_checksums(self.chunks())
+                pending = [index for index in self.chunks() if source[index] != part[index]]
+                if not pending:
+                    break
+            else:
+                raise RuntimeError(f"checksums of {self.paths['destination']} still differ "
+                                   f"after {TRANSFER_RETRIES} retries")
+            with self.lane() as lane:
+                self.finish(lane['sftp'])
+        finally:
+            self.settle(close_clients=True)
+        return {'source': self.paths['source'], 'destination': self.paths['destination'],
+                'size': self.size, 'transferred': self.progress['transferred'],
+                'resumed': self.progress['resumed'],
+                'seconds': time.perf_counter() - self.progress['start'], 'verified': True}
+
+
+def upload(ssh, local_path: str, remote_path: str, on_progress: ProgressCallback|None = None,
+           clients: list|None = None) -> TransferResult:
+    """
+    Copy a local file to remote_path (a file, or a directory to copy into),
+    over the SFTP clients given (e.g. rash.fetch_pool) or TRANSFER_LANES new ones.
+    """
+    return Transfer(ssh, True, os.path.expanduser(local_path), remote_path).run(
+        on_progress, clients)
+
+
+def download(ssh, remote_path: str, local_path: str, on_progress: ProgressCallback|None = None,
+             clients: list|None = None) -> TransferResult:
+    """
+    Copy a remote file to local_path (a file, or a directory to copy into),
+    over the SFTP clients given (e.g. rash.fetch_pool) or TRANSFER_LANES new ones.
+    """
+    return Transfer(ssh, False, remote_path, os.path.expanduser(local_path)).run(
+        on_progress, clients)